@@ -7,6 +7,10 @@ from abc import ABCMeta, abstractmethod
 class BaseBackend(object):
     __metaclass__ = ABCMeta
 
+    # whether the poll results pulls append the poll stats deltas of the results they save, so the stats can be kept
+    # up to date without a rebuild when POLL_STATS_INCREMENTAL is on
+    supports_poll_stats_deltas = False
+
     def __init__(self, backend):
         self.backend = backend
 
@@ -354,9 +354,12 @@ class FLOIPBackend(BaseBackend):
                     results = response_json["data"]["attributes"]["responses"]
                     poll_results_url = response_json["data"]["relationships"]["links"]["next"]
 
-                    (contacts_map, poll_results_map, poll_results_to_save_map) = self._initiate_lookup_maps(
-                        results, org, poll
-                    )
+                    (
+                        contacts_map,
+                        poll_results_map,
+                        poll_results_to_save_map,
+                        poll_results_to_update_map,
+                    ) = self._initiate_lookup_maps(results, org, poll)
 
                     for result in results:
                         if latest_synced_obj_time is None or json_date_to_datetime(result[0]) > json_date_to_datetime(
@@ -373,6 +376,7 @@ class FLOIPBackend(BaseBackend):
                             contact_obj,
                             poll_results_map,
                             poll_results_to_save_map,
+                            poll_results_to_update_map,
                             stats_dict,
                         )
 
@@ -380,7 +384,9 @@ class FLOIPBackend(BaseBackend):
                         if progress_callback:
                             progress_callback(stats_dict["num_synced"])
 
+                    self._set_poll_results_refs(poll, poll_results_to_save_map, poll_results_to_update_map)
                     self._save_new_poll_results_to_database(poll_results_to_save_map)
+                    self._save_updated_poll_results_to_database(poll_results_to_update_map)
 
                     logger.info(
                         "Processed fetch of %d - %d "
@@ -464,7 +470,8 @@ class FLOIPBackend(BaseBackend):
             poll_results_map[res.contact][res.ruleset] = res
 
         poll_results_to_save_map = defaultdict(dict)
-        return contacts_map, poll_results_map, poll_results_to_save_map
+        poll_results_to_update_map = dict()
+        return contacts_map, poll_results_map, poll_results_to_save_map, poll_results_to_update_map
 
     def _process_run_poll_results(
         self,
@@ -475,6 +482,7 @@ class FLOIPBackend(BaseBackend):
         contact_obj,
         existing_db_poll_results_map,
         poll_results_to_save_map,
+        poll_results_to_update_map,
         stats_dict,
     ):
         contact_uuid = result[2]
@@ -508,20 +516,7 @@ class FLOIPBackend(BaseBackend):
             )
 
             if update_required:
-                # update the db object
-                PollResult.objects.filter(pk=existing_poll_result.pk).update(
-                    category=category,
-                    text=text,
-                    state=state,
-                    district=district,
-                    ward=ward,
-                    date=value_date,
-                    born=born,
-                    gender=gender,
-                    completed=completed,
-                )
-
-                # update the map object as well
+                # update the map object, the db object is updated in bulk at the end of the fetch
                 existing_poll_result.category = category
                 existing_poll_result.text = text
                 existing_poll_result.state = state
@@ -531,8 +526,10 @@ class FLOIPBackend(BaseBackend):
                 existing_poll_result.born = born
                 existing_poll_result.gender = gender
                 existing_poll_result.completed = completed
+                existing_poll_result.contact_ref = contact_obj
 
                 existing_db_poll_results_map[contact_uuid][ruleset_uuid] = existing_poll_result
+                poll_results_to_update_map[existing_poll_result.pk] = existing_poll_result
 
                 stats_dict["num_val_updated"] += 1
             else:
@@ -551,6 +548,7 @@ class FLOIPBackend(BaseBackend):
                     flow=flow_uuid,
                     ruleset=ruleset_uuid,
                     contact=contact_uuid,
+                    contact_ref=contact_obj,
                     category=category,
                     text=text,
                     state=state,
@@ -572,6 +570,7 @@ class FLOIPBackend(BaseBackend):
                 flow=flow_uuid,
                 ruleset=ruleset_uuid,
                 contact=contact_uuid,
+                contact_ref=contact_obj,
                 category=category,
                 text=text,
                 state=state,
@@ -609,6 +608,16 @@ class FLOIPBackend(BaseBackend):
             update_required = True
         return update_required
 
+    @staticmethod
+    def _set_poll_results_refs(poll, poll_results_to_save_map, poll_results_to_update_map):
+        poll_results = list(poll_results_to_update_map.values())
+        for c_key in poll_results_to_save_map.keys():
+            for obj_to_save in poll_results_to_save_map.get(c_key, dict()).values():
+                if obj_to_save is not None:
+                    poll_results.append(obj_to_save)
+
+        PollResult.set_results_refs(poll.org_id, poll.flow_uuid, poll_results)
+
     @staticmethod
     def _save_new_poll_results_to_database(poll_results_to_save_map):
         new_poll_results = []
@@ -617,7 +626,12 @@ class FLOIPBackend(BaseBackend):
                 obj_to_create = poll_results_to_save_map.get(c_key, dict()).get(r_key, None)
                 if obj_to_create is not None:
                     new_poll_results.append(obj_to_create)
-        PollResult.objects.bulk_create(new_poll_results)
+        PollResult.save_new_results(new_poll_results)
+
+    @staticmethod
+    def _save_updated_poll_results_to_database(poll_results_to_update_map):
+        if poll_results_to_update_map:
+            PollResult.bulk_update_values(list(poll_results_to_update_map.values()))
 
     @staticmethod
     def _mark_poll_results_sync_paused(org, poll, latest_synced_obj_time):
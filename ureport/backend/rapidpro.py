@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import gzip
-import io
 import json
 import logging
+import os
+import re
+import tempfile
 import time
+import zlib
 from collections import defaultdict
+from contextlib import ExitStack
 from datetime import timedelta
 
 import requests
@@ -14,7 +17,9 @@ from django_redis import get_redis_connection
 from temba_client.exceptions import TembaRateExceededError
 from temba_client.v2.types import Run
 
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 
 from dash.utils import is_dict_equal
@@ -23,13 +28,15 @@ from ureport.contacts.models import Contact, ContactField
 from ureport.flows.models import FlowResultCategory
 from ureport.locations.models import Boundary
 from ureport.polls.models import Poll, PollQuestion, PollResponseCategory, PollResult
-from ureport.polls.tasks import pull_refresh_from_archives
-from ureport.utils import chunk_list, datetime_to_json_date, json_date_to_datetime
+from ureport.utils import chunk_list, datetime_to_json_date, json_date_to_datetime, prefetch_iterator
 
 from . import BaseBackend
 
 logger = logging.getLogger(__name__)
 
+# flow of an archived run record, to route the records without decoding the JSON of every line
+ARCHIVE_RECORD_FLOW_REGEX = re.compile(r'"flow":\s*\{\s*"uuid":\s*"([^"]+)"')
+
 
 class FieldSyncer(BaseSyncer):
     """
@@ -311,28 +318,143 @@ class ContactSyncer(BaseSyncer):
             ]
         )
 
-    def create_local(self, remote_as_kwargs):
-        obj = super().create_local(remote_as_kwargs)
-
-        one_month_ago = timezone.now() - timedelta(days=30)
-        if obj.registered_on is not None and obj.registered_on > one_month_ago:
-            recent_results = PollResult.objects.filter(
-                org=obj.org,
-                contact=obj.uuid,
-                date__gte=one_month_ago,
-            ).exists()
-
-            if recent_results:
-                PollResult.objects.filter(org=obj.org, contact=obj.uuid, date__gte=one_month_ago).update(
-                    state=obj.state,
-                    district=obj.district,
-                    ward=obj.ward,
-                    gender=obj.gender,
-                    born=obj.born,
-                    scheme=obj.scheme,
-                )
 
-        return obj
+class ArchiveStream(object):
+    """
+    Decompresses a gzipped archive incrementally from a file object, a raw response stream or a cached file, and
+    yields its lines, so only one chunk of the archive is held in memory at a time
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.lines_matched = 0
+
+    def iter_lines(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = b""
+
+        while True:
+            chunk = self.fileobj.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+
+            self.bytes_read += len(chunk)
+            data = decompressor.decompress(chunk)
+
+            # archives can be made of several concatenated gzip members
+            while decompressor.eof and decompressor.unused_data:
+                unused_data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += decompressor.decompress(unused_data)
+
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+
+            for line in lines:
+                self.lines_read += 1
+                yield line
+
+        pending += decompressor.flush()
+        if pending:
+            self.lines_read += 1
+            yield pending
+
+
+class ArchiveCache(object):
+    """
+    Size bounded disk cache of the downloaded archives, shared by all the sync workers of a host. Archives are
+    immutable once published so they are keyed by their period and hash, and the least recently used are evicted
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def get_default(cls):
+        directory = getattr(settings, "ARCHIVES_CACHE_DIR", None)
+        if not directory:
+            return None
+
+        return cls(directory, getattr(settings, "ARCHIVES_CACHE_MAX_SIZE", 10 * 1024 * 1024 * 1024))
+
+    def get_path(self, archive):
+        return os.path.join(self.directory, "%s_%s.jsonl.gz" % (archive.period, archive.hash))
+
+    def open(self, archive):
+        """
+        Returns a file object of the archive content, downloading the archive to the cache first if needed
+        """
+        path = self.get_path(archive)
+
+        try:
+            fileobj = open(path, "rb")
+            # mark the archive as recently used
+            os.utime(path)
+            logger.info("Reading archive %s from cache" % archive.hash)
+            return fileobj
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # download to a temporary file first so other workers never read a partial archive
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                r = requests.get(archive.download_url, stream=True)
+                try:
+                    r.raise_for_status()
+                    while True:
+                        chunk = r.raw.read(self.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        tmp_file.write(chunk)
+                finally:
+                    r.close()
+
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        fileobj = open(path, "rb")
+        self.evict()
+        return fileobj
+
+    def evict(self):
+        """
+        Removes the least recently used archives until the cache fits in its max size
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
 
 
 class RapidProBackend(BaseBackend):
@@ -340,6 +462,8 @@ class RapidProBackend(BaseBackend):
     RapidPro instance as a backend
     """
 
+    supports_poll_stats_deltas = True
+
     @staticmethod
     def _get_client(org, api_version):
         return org.get_temba_client(api_version=api_version)
@@ -434,21 +558,68 @@ class RapidProBackend(BaseBackend):
             org, ContactSyncer(backend=self.backend), fetches, deleted_fetches, progress_callback
         )
 
-    def _iter_archive_records(self, archive, flow_uuid):
-        r = requests.get(archive.download_url, stream=True)
-        stream = gzip.GzipFile(fileobj=io.BytesIO(r.content))
+    def _iter_archive_records(self, archive, flow_uuids):
+        start = time.time()
 
-        while True:
-            line = stream.readline()
-            if not line:
-                break
-            line_decoded = line.decode("utf-8")
-            if line_decoded.find(flow_uuid) > 0:
-                yield json.loads(line_decoded)
+        archive_cache = ArchiveCache.get_default()
+        if archive_cache is not None and archive.hash:
+            fileobj = archive_cache.open(archive)
+        else:
+            response = requests.get(archive.download_url, stream=True)
+            response.raise_for_status()
+            fileobj = response.raw
+
+        stream = ArchiveStream(fileobj)
+        archive_flows = set()
+
+        try:
+            for line in stream.iter_lines():
+                line_decoded = line.decode("utf-8")
+
+                record = None
+                match = ARCHIVE_RECORD_FLOW_REGEX.search(line_decoded)
+                if match:
+                    record_flow_uuid = match.group(1)
+                elif line_decoded.strip():
+                    record = json.loads(line_decoded)
+                    record_flow_uuid = record["flow"]["uuid"]
+                else:
+                    continue
+
+                archive_flows.add(record_flow_uuid)
+
+                if record_flow_uuid in flow_uuids:
+                    stream.lines_matched += 1
+                    yield record if record is not None else json.loads(line_decoded)
+
+            # the whole archive was read, index the flows it contains so later imports can skip it
+            if archive.hash:
+                cache.set(Poll.POLL_ARCHIVE_FLOWS_CACHE_KEY % archive.hash, sorted(archive_flows), None)
+        finally:
+            fileobj.close()
+            logger.info(
+                "Streamed archive %s, read %d bytes and matched %d of %d lines in %ds"
+                % (
+                    archive.download_url,
+                    stream.bytes_read,
+                    stream.lines_matched,
+                    stream.lines_read,
+                    time.time() - start,
+                )
+            )
+
+    @staticmethod
+    def _get_archive_flows(archive):
+        """
+        Returns the flow UUIDs found in the archive the first time it was read, or None if it was never read
+        """
+        if not archive.hash:
+            return None
+        return cache.get(Poll.POLL_ARCHIVE_FLOWS_CACHE_KEY % archive.hash)
 
     def _iter_poll_record_runs(self, archive, poll_flow_uuid):
 
-        for record_batch in chunk_list(self._iter_archive_records(archive, poll_flow_uuid), 1000):
+        for record_batch in chunk_list(self._iter_archive_records(archive, [poll_flow_uuid]), 1000):
             matching = []
             for record in record_batch:
                 if record["flow"]["uuid"] == poll_flow_uuid:
@@ -456,6 +627,187 @@ class RapidProBackend(BaseBackend):
                     matching.append(record)
             yield Run.deserialize_list(matching)
 
+    def _iter_org_record_runs(self, archive, flow_uuids):
+        """
+        Yields dicts of the runs found in the archive for each of the given flows, by batches of records
+        """
+        for record_batch in chunk_list(self._iter_archive_records(archive, flow_uuids), 1000):
+            flows_records = defaultdict(list)
+            for record in record_batch:
+                if record["flow"]["uuid"] in flow_uuids:
+                    record.update(start=None)
+                    flows_records[record["flow"]["uuid"]].append(record)
+            yield {flow_uuid: Run.deserialize_list(records) for flow_uuid, records in flows_records.items()}
+
+    def _process_archive_fetch(self, org, poll, questions_uuids, fetch, stats_dict):
+        (
+            contacts_map,
+            poll_results_map,
+            poll_results_to_save_map,
+            poll_results_to_update_map,
+        ) = self._initiate_lookup_maps(fetch, org, poll)
+        poll_stats_deltas = defaultdict(int) if Poll.use_incremental_poll_stats() else None
+
+        for temba_run in fetch:
+
+            contact_obj = contacts_map.get(temba_run.contact.uuid, None)
+            self._process_run_poll_results(
+                org,
+                questions_uuids,
+                temba_run,
+                contact_obj,
+                poll_results_map,
+                poll_results_to_save_map,
+                poll_results_to_update_map,
+                stats_dict,
+                poll_stats_deltas,
+            )
+
+        stats_dict["num_synced"] += len(fetch)
+
+        self._save_poll_results_to_database(
+            poll, poll_results_to_save_map, poll_results_to_update_map, stats_dict, poll_stats_deltas
+        )
+
+    def pull_org_results_from_archives(self, org, polls):
+        """
+        Imports the run archives of the org for all the given polls reading each archive only once. Records are routed
+        to the polls by their flow UUID and archives already imported for a flow are not read again for it.
+        Returns a dict of flow UUID to the tuple of the number of results created, updated and ignored
+        """
+        r = get_redis_connection()
+
+        flow_polls = dict()
+        for poll in polls:
+            if poll.stopped_syncing:
+                continue
+
+            if r.get(Poll.POLL_PULL_RESULTS_TASK_LOCK % (org.pk, poll.flow_uuid)):
+                logger.info(
+                    "Skipping importing archives for poll #%d on org #%d as it is still running" % (poll.pk, org.pk)
+                )
+                continue
+
+            flow_polls.setdefault(poll.flow_uuid, poll)
+
+        flows_stats = {
+            flow_uuid: dict(
+                num_val_created=0,
+                num_val_updated=0,
+                num_val_ignored=0,
+                num_path_created=0,
+                num_path_updated=0,
+                num_path_ignored=0,
+                num_synced=0,
+            )
+            for flow_uuid in flow_polls.keys()
+        }
+
+        if flow_polls:
+            with ExitStack() as stack:
+                flows_first = []
+                flows_questions_uuids = dict()
+                for flow_uuid in sorted(flow_polls.keys()):
+                    key = Poll.POLL_PULL_RESULTS_TASK_LOCK % (org.pk, flow_uuid)
+                    stack.enter_context(r.lock(key, timeout=Poll.POLL_SYNC_LOCK_TIMEOUT))
+
+                    poll = flow_polls[flow_uuid]
+                    flows_questions_uuids[flow_uuid] = poll.get_question_uuids()
+
+                    flow_date_json = poll.get_flow_date()
+                    flows_first.append(
+                        json_date_to_datetime(flow_date_json).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                        if flow_date_json
+                        else None
+                    )
+
+                lock_expiration = time.time() + 0.8 * Poll.POLL_SYNC_LOCK_TIMEOUT
+                start = time.time()
+
+                # start from the month of the oldest flow, from the beginning if one of the flows has no date
+                first = None if None in flows_first else min(flows_first)
+
+                client = self._get_client(org, 2)
+                archives_query = client.get_archives(archive_type="run", after=first)
+
+                paused = False
+                for archives in archives_query.iterfetches(retry_on_rate_exceed=True):
+                    for archive in archives:
+                        if time.time() > lock_expiration:
+                            # the polls stay pending and the imported archives are not read again, so the next
+                            # task resumes from this archive
+                            logger.info(
+                                "Break importing archives for %d flows on org #%d in %ds"
+                                % (len(flow_polls), org.pk, time.time() - start)
+                            )
+                            paused = True
+                            break
+
+                        if archive.record_count <= 0:
+                            continue
+
+                        archive_flows = {
+                            flow_uuid
+                            for flow_uuid in flow_polls.keys()
+                            if not r.sismember(Poll.POLL_ARCHIVES_IMPORTED_KEY % (org.pk, flow_uuid), archive.hash)
+                        }
+
+                        indexed_flows = self._get_archive_flows(archive)
+                        if indexed_flows is not None:
+                            archive_flows &= set(indexed_flows)
+
+                        if not archive_flows:
+                            logger.info("Skipping archive %s without runs to import for the flows" % archive.hash)
+                            continue
+
+                        try:
+                            start_archive = time.time()
+
+                            for flows_fetches in self._iter_org_record_runs(archive, archive_flows):
+                                for flow_uuid, fetch in flows_fetches.items():
+                                    self._process_archive_fetch(
+                                        org,
+                                        flow_polls[flow_uuid],
+                                        flows_questions_uuids[flow_uuid],
+                                        fetch,
+                                        flows_stats[flow_uuid],
+                                    )
+
+                            for flow_uuid in archive_flows:
+                                imported_key = Poll.POLL_ARCHIVES_IMPORTED_KEY % (org.pk, flow_uuid)
+                                r.sadd(imported_key, archive.hash)
+                                r.expire(imported_key, Poll.POLL_ARCHIVES_IMPORTED_TIMEOUT)
+
+                            logger.info(
+                                "Imported archive %s for %d flows in %ds"
+                                % (archive.hash, len(archive_flows), time.time() - start_archive)
+                            )
+                        except Exception:
+                            logger.error(
+                                "Failed to import archive %s for %d flows on org #%d"
+                                % (archive.hash, len(archive_flows), org.pk),
+                                exc_info=True,
+                            )
+
+                    if paused:
+                        break
+
+                if not paused:
+                    imported_ids = [poll.pk for poll in polls if poll.flow_uuid in flow_polls]
+                    r.srem(Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % org.pk, *imported_ids)
+
+        return {
+            flow_uuid: (
+                stats_dict["num_val_created"],
+                stats_dict["num_val_updated"],
+                stats_dict["num_val_ignored"],
+                stats_dict["num_path_created"],
+                stats_dict["num_path_updated"],
+                stats_dict["num_path_ignored"],
+            )
+            for flow_uuid, stats_dict in flows_stats.items()
+        }
+
     def pull_results_from_archives(self, poll):
         org = poll.org
         r = get_redis_connection()
@@ -511,30 +863,16 @@ class RapidProBackend(BaseBackend):
 
                         flow_uuid = poll.flow_uuid
 
+                        indexed_flows = self._get_archive_flows(archive)
+                        if indexed_flows is not None and flow_uuid not in indexed_flows:
+                            logger.info("Skipping archive %d without runs for flow %s" % (i, flow_uuid))
+                            continue
+
                         for fetch in self._iter_poll_record_runs(archive, flow_uuid):
 
                             fetch_start = time.time()
 
-                            (contacts_map, poll_results_map, poll_results_to_save_map) = self._initiate_lookup_maps(
-                                fetch, org, poll
-                            )
-
-                            for temba_run in fetch:
-
-                                contact_obj = contacts_map.get(temba_run.contact.uuid, None)
-                                self._process_run_poll_results(
-                                    org,
-                                    questions_uuids,
-                                    temba_run,
-                                    contact_obj,
-                                    poll_results_map,
-                                    poll_results_to_save_map,
-                                    stats_dict,
-                                )
-
-                            stats_dict["num_synced"] += len(fetch)
-
-                            self._save_new_poll_results_to_database(poll_results_to_save_map)
+                            self._process_archive_fetch(org, poll, questions_uuids, fetch, stats_dict)
 
                             logger.info(
                                 "Processing archive %d took %ds for fetch of %d"
@@ -600,7 +938,7 @@ class RapidProBackend(BaseBackend):
                 if pull_after_delete is not None:
                     latest_synced_obj_time = None
                     poll.delete_poll_results()
-                    pull_refresh_from_archives.apply_async((poll.pk,), queue="sync")
+                    Poll.pull_org_results_from_archives_task(org.pk, [poll.pk])
 
                 start = time.time()
                 logger.info("Start fetching runs for poll #%d on org #%d" % (poll.pk, org.pk))
@@ -608,7 +946,10 @@ class RapidProBackend(BaseBackend):
                 poll_runs_query = client.get_runs(
                     flow=poll.flow_uuid, after=latest_synced_obj_time, reverse=True, paths=True
                 )
-                fetches = poll_runs_query.iterfetches(retry_on_rate_exceed=True)
+                # fetch the next pages in the background while the current one is saved
+                fetches = prefetch_iterator(
+                    poll_runs_query.iterfetches(retry_on_rate_exceed=True), Poll.POLL_RESULTS_PREFETCH_FETCHES
+                )
 
                 try:
                     fetch_start = time.time()
@@ -626,9 +967,13 @@ class RapidProBackend(BaseBackend):
                             )
                         )
 
-                        (contacts_map, poll_results_map, poll_results_to_save_map) = self._initiate_lookup_maps(
-                            fetch, org, poll
-                        )
+                        (
+                            contacts_map,
+                            poll_results_map,
+                            poll_results_to_save_map,
+                            poll_results_to_update_map,
+                        ) = self._initiate_lookup_maps(fetch, org, poll)
+                        poll_stats_deltas = defaultdict(int) if Poll.use_incremental_poll_stats() else None
 
                         for temba_run in fetch:
 
@@ -647,14 +992,18 @@ class RapidProBackend(BaseBackend):
                                 contact_obj,
                                 poll_results_map,
                                 poll_results_to_save_map,
+                                poll_results_to_update_map,
                                 stats_dict,
+                                poll_stats_deltas,
                             )
 
                         stats_dict["num_synced"] += len(fetch)
                         if progress_callback:
                             progress_callback(stats_dict["num_synced"])
 
-                        self._save_new_poll_results_to_database(poll_results_to_save_map)
+                        self._save_poll_results_to_database(
+                            poll, poll_results_to_save_map, poll_results_to_update_map, stats_dict, poll_stats_deltas
+                        )
 
                         logger.info(
                             "Processed fetch of %d - %d "
@@ -668,7 +1017,7 @@ class RapidProBackend(BaseBackend):
                             stats_dict["num_synced"] >= Poll.POLL_RESULTS_MAX_SYNC_RUNS
                             or time.time() > lock_expiration
                         ):
-                            poll.rebuild_poll_results_counts()
+                            poll.update_poll_results_counts()
 
                             self._mark_poll_results_sync_paused(org, poll, latest_synced_obj_time)
 
@@ -696,7 +1045,7 @@ class RapidProBackend(BaseBackend):
                                 stats_dict["num_path_ignored"],
                             )
                 except TembaRateExceededError:
-                    poll.rebuild_poll_results_counts()
+                    poll.update_poll_results_counts()
 
                     self._mark_poll_results_sync_paused(org, poll, latest_synced_obj_time)
 
@@ -723,6 +1072,9 @@ class RapidProBackend(BaseBackend):
                         stats_dict["num_path_updated"],
                         stats_dict["num_path_ignored"],
                     )
+                finally:
+                    # stop the prefetching of pages we will not process
+                    fetches.close()
 
                 self._mark_poll_results_sync_completed(poll, org, latest_synced_obj_time)
 
@@ -761,15 +1113,19 @@ class RapidProBackend(BaseBackend):
         contact_uuids = [run.contact.uuid for run in fetch]
         contacts = Contact.objects.filter(org=org, uuid__in=contact_uuids)
         contacts_map = {c.uuid: c for c in contacts}
-        existing_poll_results = PollResult.objects.filter(
-            flow=poll.flow_uuid, org=poll.org_id, contact__in=contact_uuids
-        )
+
         poll_results_map = defaultdict(dict)
-        for res in existing_poll_results:
-            poll_results_map[res.contact][res.ruleset] = res
+        # with upsert ingestion the database resolves the existing results, no need to load them
+        if not self._use_upsert_ingestion():
+            existing_poll_results = PollResult.objects.filter(
+                flow=poll.flow_uuid, org=poll.org_id, contact__in=contact_uuids
+            )
+            for res in existing_poll_results:
+                poll_results_map[res.contact][res.ruleset] = res
 
         poll_results_to_save_map = defaultdict(dict)
-        return contacts_map, poll_results_map, poll_results_to_save_map
+        poll_results_to_update_map = dict()
+        return contacts_map, poll_results_map, poll_results_to_save_map, poll_results_to_update_map
 
     def _process_run_poll_results(
         self,
@@ -779,7 +1135,9 @@ class RapidProBackend(BaseBackend):
         contact_obj,
         existing_db_poll_results_map,
         poll_results_to_save_map,
+        poll_results_to_update_map,
         stats_dict,
+        poll_stats_deltas=None,
     ):
         flow_uuid = temba_run.flow.uuid
         contact_uuid = temba_run.contact.uuid
@@ -826,21 +1184,10 @@ class RapidProBackend(BaseBackend):
                 )
 
                 if update_required:
-                    # update the db object
-                    PollResult.objects.filter(pk=existing_poll_result.pk).update(
-                        category=category,
-                        text=text,
-                        state=state,
-                        district=district,
-                        ward=ward,
-                        date=value_date,
-                        born=born,
-                        gender=gender,
-                        scheme=scheme,
-                        completed=completed,
-                    )
+                    # update the map object, the db object is updated in bulk at the end of the fetch
+                    if poll_stats_deltas is not None:
+                        poll_stats_deltas[existing_poll_result.get_result_tuple()] -= 1
 
-                    # update the map object as well
                     existing_poll_result.category = category
                     existing_poll_result.text = text
                     existing_poll_result.state = state
@@ -851,8 +1198,13 @@ class RapidProBackend(BaseBackend):
                     existing_poll_result.gender = gender
                     existing_poll_result.scheme = scheme
                     existing_poll_result.completed = completed
+                    existing_poll_result.contact_ref = contact_obj
+
+                    if poll_stats_deltas is not None:
+                        poll_stats_deltas[existing_poll_result.get_result_tuple()] += 1
 
                     existing_db_poll_results_map[contact_uuid][ruleset_uuid] = existing_poll_result
+                    poll_results_to_update_map[existing_poll_result.pk] = existing_poll_result
 
                     stats_dict["num_val_updated"] += 1
                 else:
@@ -881,6 +1233,7 @@ class RapidProBackend(BaseBackend):
                         flow=flow_uuid,
                         ruleset=ruleset_uuid,
                         contact=contact_uuid,
+                        contact_ref=contact_obj,
                         category=category,
                         text=text,
                         state=state,
@@ -903,6 +1256,7 @@ class RapidProBackend(BaseBackend):
                     flow=flow_uuid,
                     ruleset=ruleset_uuid,
                     contact=contact_uuid,
+                    contact_ref=contact_obj,
                     category=category,
                     text=text,
                     state=state,
@@ -933,21 +1287,10 @@ class RapidProBackend(BaseBackend):
                     if existing_poll_result.date is None or value_date > (
                         existing_poll_result.date + timedelta(seconds=5)
                     ):
-                        # update the db object
-                        PollResult.objects.filter(pk=existing_poll_result.pk).update(
-                            category=category,
-                            text=text,
-                            state=state,
-                            district=district,
-                            ward=ward,
-                            date=value_date,
-                            born=born,
-                            gender=gender,
-                            scheme=scheme,
-                            completed=completed,
-                        )
+                        # update the map object, the db object is updated in bulk at the end of the fetch
+                        if poll_stats_deltas is not None:
+                            poll_stats_deltas[existing_poll_result.get_result_tuple()] -= 1
 
-                        # update the map object as well
                         existing_poll_result.category = category
                         existing_poll_result.text = text
                         existing_poll_result.state = state
@@ -958,8 +1301,13 @@ class RapidProBackend(BaseBackend):
                         existing_poll_result.gender = gender
                         existing_poll_result.scheme = scheme
                         existing_poll_result.completed = completed
+                        existing_poll_result.contact_ref = contact_obj
+
+                        if poll_stats_deltas is not None:
+                            poll_stats_deltas[existing_poll_result.get_result_tuple()] += 1
 
                         existing_db_poll_results_map[contact_uuid][ruleset_uuid] = existing_poll_result
+                        poll_results_to_update_map[existing_poll_result.pk] = existing_poll_result
 
                         stats_dict["num_path_updated"] += 1
                     else:
@@ -972,6 +1320,7 @@ class RapidProBackend(BaseBackend):
                             flow=flow_uuid,
                             ruleset=ruleset_uuid,
                             contact=contact_uuid,
+                            contact_ref=contact_obj,
                             category=category,
                             text=text,
                             state=state,
@@ -995,6 +1344,7 @@ class RapidProBackend(BaseBackend):
                         flow=flow_uuid,
                         ruleset=ruleset_uuid,
                         contact=contact_uuid,
+                        contact_ref=contact_obj,
                         category=category,
                         text=text,
                         state=state,
@@ -1033,6 +1383,86 @@ class RapidProBackend(BaseBackend):
             update_required = True
         return update_required
 
+    @staticmethod
+    def _set_poll_results_refs(poll, poll_results_to_save_map, poll_results_to_update_map):
+        poll_results = list(poll_results_to_update_map.values())
+        for c_key in poll_results_to_save_map.keys():
+            for obj_to_save in poll_results_to_save_map.get(c_key, dict()).values():
+                if obj_to_save is not None:
+                    poll_results.append(obj_to_save)
+
+        PollResult.set_results_refs(poll.org_id, poll.flow_uuid, poll_results)
+
+    @staticmethod
+    def _use_upsert_ingestion():
+        return getattr(settings, "POLL_RESULTS_UPSERT_INGESTION", False)
+
+    def _save_poll_results_to_database(
+        self, poll, poll_results_to_save_map, poll_results_to_update_map, stats_dict, poll_stats_deltas=None
+    ):
+        self._set_poll_results_refs(poll, poll_results_to_save_map, poll_results_to_update_map)
+
+        if poll_stats_deltas is None:
+            self._save_poll_results_only_to_database(poll_results_to_save_map, poll_results_to_update_map, stats_dict)
+            return
+
+        # the deltas are committed with the results they count, under the rebuild lock so a rebuild of the poll stats
+        # never counts the results and then their deltas again
+        r = get_redis_connection()
+        key = Poll.POLL_REBUILD_COUNTS_LOCK % (poll.org_id, poll.flow_uuid)
+        with r.lock(key, timeout=Poll.POLL_SYNC_LOCK_TIMEOUT):
+            with transaction.atomic():
+                self._save_poll_results_only_to_database(
+                    poll_results_to_save_map, poll_results_to_update_map, stats_dict
+                )
+                self._save_poll_stats_deltas(poll, poll_results_to_save_map, poll_stats_deltas)
+
+    def _save_poll_results_only_to_database(self, poll_results_to_save_map, poll_results_to_update_map, stats_dict):
+        if self._use_upsert_ingestion():
+            self._upsert_poll_results_to_database(poll_results_to_save_map, stats_dict)
+        else:
+            self._save_new_poll_results_to_database(poll_results_to_save_map)
+            self._save_updated_poll_results_to_database(poll_results_to_update_map)
+
+    @staticmethod
+    def _upsert_poll_results_to_database(poll_results_to_save_map, stats_dict):
+        poll_results = []
+        for c_key in poll_results_to_save_map.keys():
+            for r_key in poll_results_to_save_map.get(c_key, dict()):
+                obj_to_save = poll_results_to_save_map.get(c_key, dict()).get(r_key, None)
+                if obj_to_save is not None:
+                    poll_results.append(obj_to_save)
+
+        if not poll_results:
+            return
+
+        num_paths = len([obj for obj in poll_results if obj.category is None])
+        num_values = len(poll_results) - num_paths
+
+        val_created, val_updated, path_created, path_updated = PollResult.upsert_results(poll_results)
+
+        # without the existing results lookup every result was counted as created while processing the fetch,
+        # correct the counts with what the database actually inserted, updated or kept
+        stats_dict["num_val_created"] += val_created - num_values
+        stats_dict["num_val_updated"] += val_updated
+        stats_dict["num_val_ignored"] += num_values - val_created - val_updated
+        stats_dict["num_path_created"] += path_created - num_paths
+        stats_dict["num_path_updated"] += path_updated
+        stats_dict["num_path_ignored"] += num_paths - path_created - path_updated
+
+    @staticmethod
+    def _save_poll_stats_deltas(poll, poll_results_to_save_map, poll_stats_deltas):
+        if poll_stats_deltas is None:
+            return
+
+        # the updated results deltas are counted as they change, the new results only count once saved
+        for c_key in poll_results_to_save_map.keys():
+            for obj_saved in poll_results_to_save_map.get(c_key, dict()).values():
+                if obj_saved is not None:
+                    poll_stats_deltas[obj_saved.get_result_tuple()] += 1
+
+        poll.add_poll_stats_deltas(poll_stats_deltas)
+
     @staticmethod
     def _save_new_poll_results_to_database(poll_results_to_save_map):
         new_poll_results = []
@@ -1041,7 +1471,12 @@ class RapidProBackend(BaseBackend):
                 obj_to_create = poll_results_to_save_map.get(c_key, dict()).get(r_key, None)
                 if obj_to_create is not None:
                     new_poll_results.append(obj_to_create)
-        PollResult.objects.bulk_create(new_poll_results)
+        PollResult.save_new_results(new_poll_results)
+
+    @staticmethod
+    def _save_updated_poll_results_to_database(poll_results_to_update_map):
+        if poll_results_to_update_map:
+            PollResult.bulk_update_values(list(poll_results_to_update_map.values()))
 
     @staticmethod
     def _mark_poll_results_sync_paused(org, poll, latest_synced_obj_time):
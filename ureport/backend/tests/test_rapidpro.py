@@ -5,8 +5,12 @@ import gzip
 import io
 import json
 import logging
+import os
+import shutil
+import tempfile
 from datetime import timedelta
 
+from django_redis import get_redis_connection
 from mock import PropertyMock, patch
 from temba_client.exceptions import TembaRateExceededError
 from temba_client.v2.types import (
@@ -18,6 +22,7 @@ from temba_client.v2.types import (
     Run as TembaRun,
 )
 
+from django.core.cache import cache
 from django.db import connection, reset_queries
 from django.test import override_settings
 from django.utils import timezone
@@ -25,7 +30,14 @@ from django.utils import timezone
 from dash.categories.models import Category
 from dash.test import MockClientQuery
 from dash.utils.sync import SyncOutcome
-from ureport.backend.rapidpro import BoundarySyncer, ContactSyncer, FieldSyncer, RapidProBackend
+from ureport.backend.rapidpro import (
+    ArchiveCache,
+    ArchiveStream,
+    BoundarySyncer,
+    ContactSyncer,
+    FieldSyncer,
+    RapidProBackend,
+)
 from ureport.contacts.models import Contact, ContactField
 from ureport.flows.models import FlowResult, FlowResultCategory
 from ureport.locations.models import Boundary
@@ -595,8 +607,30 @@ class ContactSyncerTest(UreportTest):
         self.assertEqual(contact.registered_on, json_date_to_datetime("2015-04-09T12:48:44.320Z"))
         self.assertEqual(contact.state, "R-LAGOS")
 
+        # results are only updated once the propagation runs after the sync
+        result.refresh_from_db()
+        self.assertFalse(result.state)
+
+        old_result = PollResult.objects.get(contact="C-008")
+
+        self.assertEqual(Contact.propagate_to_poll_results(self.nigeria), 1)
+
         result.refresh_from_db()
         self.assertEqual(result.state, "R-LAGOS")
+        self.assertEqual(result.district, "R-OYO")
+        self.assertEqual(result.gender, "M")
+        self.assertEqual(result.born, 1990)
+
+        # contacts registered more than a month ago are not propagated
+        old_result.refresh_from_db()
+        self.assertFalse(old_result.state)
+
+        # contacts already propagated are skipped
+        PollResult.objects.filter(pk=result.pk).update(state="")
+        self.assertEqual(Contact.propagate_to_poll_results(self.nigeria), 0)
+
+        result.refresh_from_db()
+        self.assertFalse(result.state)
 
 
 class RapidProBackendTest(UreportTest):
@@ -1230,7 +1264,8 @@ class RapidProBackendTest(UreportTest):
             ]
         )
 
-        with self.assertNumQueries(7):
+        # deleting a boundary looks up the poll stats of its location and of its state, district and ward ancestry
+        with self.assertNumQueries(10):
             boundaries_results = self.backend.pull_boundaries(self.nigeria)
 
         self.assertEqual(
@@ -1276,7 +1311,7 @@ class RapidProBackendTest(UreportTest):
             ]
         )
 
-        with self.assertNumQueries(13):
+        with self.assertNumQueries(19):
             boundaries_results = self.backend.pull_boundaries(self.nigeria)
 
         self.assertEqual(
@@ -1299,7 +1334,7 @@ class RapidProBackendTest(UreportTest):
             org=self.nigeria, uuid="C-001", gender="M", born=1990, state="R-LAGOS", district="R-OYO"
         )
         poll = self.create_poll(self.nigeria, "Flow 1", "flow-uuid", self.education_nigeria, self.admin)
-        self.create_poll_question(self.admin, poll, "question 1", "ruleset-uuid")
+        poll_question = self.create_poll_question(self.admin, poll, "question 1", "ruleset-uuid")
 
         self.create_poll_question(self.admin, poll, "question 2", "ruleset-uuid-2")
 
@@ -1323,7 +1358,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1350,6 +1385,8 @@ class RapidProBackendTest(UreportTest):
         self.assertEqual(poll_result.flow, "flow-uuid")
         self.assertEqual(poll_result.category, "Win")
         self.assertEqual(poll_result.text, "We'll win today")
+        self.assertEqual(poll_result.contact_ref_id, contact.id)
+        self.assertEqual(poll_result.flow_result_id, poll_question.flow_result_id)
 
         temba_run_1 = TembaRun.create(
             id=1235,
@@ -1391,7 +1428,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run_1, temba_run_2])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1435,7 +1472,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run_3])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1521,7 +1558,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run_4])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1566,7 +1603,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run_4])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1593,7 +1630,7 @@ class RapidProBackendTest(UreportTest):
         PollResult.objects.filter(ruleset="ruleset-uuid-2").update(date=None)
         mock_get_runs.side_effect = [MockClientQuery([temba_run_4])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1611,7 +1648,7 @@ class RapidProBackendTest(UreportTest):
         PollResult.objects.filter(ruleset="ruleset-uuid").update(date=None)
         mock_get_runs.side_effect = [MockClientQuery([temba_run_4])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1720,7 +1757,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run_no_response])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1783,7 +1820,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -1828,6 +1865,7 @@ class RapidProBackendTest(UreportTest):
         mock_timezone_now.return_value = now_date
 
         mock_poll_flow_date.return_value = None
+        cache.delete(Poll.POLL_ARCHIVE_FLOWS_CACHE_KEY % "f0d79988b7772c003d04a28bd7417a62")
 
         PollResult.objects.all().delete()
         Contact.objects.create(
@@ -1878,7 +1916,7 @@ class RapidProBackendTest(UreportTest):
             )
         ]
 
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(6):
             (
                 num_val_created,
                 num_val_updated,
@@ -1962,7 +2000,7 @@ class RapidProBackendTest(UreportTest):
             )
         ]
 
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(6):
             (
                 num_val_created,
                 num_val_updated,
@@ -1979,6 +2017,21 @@ class RapidProBackendTest(UreportTest):
         self.assertEqual(3, PollResult.objects.all().count())
         self.assertEqual(1, Contact.objects.all().count())
 
+        # failed downloads are not read as archives
+        mock_request_get.side_effect = [MockResponse(404, b"Not Found")]
+        archive = TembaArchive.create(
+            archive_type="run",
+            start_date=poll.created_on,
+            period="daily",
+            record_count=12,
+            size=23,
+            hash="f0d79988b7772c003d04a28bd7417a62",
+            download_url="http://s3-bucket.aws.com/my/archive.jsonl.gz",
+        )
+
+        with self.assertRaisesMessage(Exception, "Server returned 404"):
+            list(self.backend._iter_archive_records(archive, {"flow-uuid"}))
+
         poll.stopped_syncing = True
         poll.save()
 
@@ -1996,6 +2049,224 @@ class RapidProBackendTest(UreportTest):
             (0, 0, 0, 0, 0, 0),
         )
 
+    def test_archive_stream(self):
+        stream = io.BytesIO()
+
+        # two concatenated gzip members, the last line without a trailing new line
+        gz = gzip.GzipFile(fileobj=stream, mode="wb")
+        gz.write(b'{"flow": "flow-1"}\n{"flow": "flow-2"}\n')
+        gz.close()
+        gz = gzip.GzipFile(fileobj=stream, mode="wb")
+        gz.write(b'{"flow": "flow-3"}')
+        gz.close()
+
+        content = stream.getvalue()
+
+        with patch("ureport.backend.rapidpro.ArchiveStream.CHUNK_SIZE", 8):
+            archive_stream = ArchiveStream(io.BytesIO(content))
+            self.assertEqual(
+                list(archive_stream.iter_lines()),
+                [b'{"flow": "flow-1"}', b'{"flow": "flow-2"}', b'{"flow": "flow-3"}'],
+            )
+
+        self.assertEqual(archive_stream.bytes_read, len(content))
+        self.assertEqual(archive_stream.lines_read, 3)
+
+    @patch("requests.get")
+    def test_archive_cache(self, mock_request_get):
+        def archive(archive_hash):
+            return TembaArchive.create(
+                archive_type="run",
+                start_date=timezone.now(),
+                period="daily",
+                record_count=12,
+                size=23,
+                hash=archive_hash,
+                download_url="http://s3-bucket.aws.com/my/%s.jsonl.gz" % archive_hash,
+            )
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        with override_settings(ARCHIVES_CACHE_DIR=cache_dir, ARCHIVES_CACHE_MAX_SIZE=25):
+            archive_cache = ArchiveCache.get_default()
+
+        self.assertEqual(archive_cache.directory, cache_dir)
+        self.assertEqual(archive_cache.max_size, 25)
+        self.assertIsNone(ArchiveCache.get_default())
+
+        mock_request_get.side_effect = [MockResponse(200, b"archive-1-content")]
+
+        with archive_cache.open(archive("hash-1")) as fileobj:
+            self.assertEqual(fileobj.read(), b"archive-1-content")
+
+        mock_request_get.assert_called_once_with("http://s3-bucket.aws.com/my/hash-1.jsonl.gz", stream=True)
+        self.assertEqual(os.listdir(cache_dir), ["daily_hash-1.jsonl.gz"])
+
+        # read again from the cache without downloading
+        with archive_cache.open(archive("hash-1")) as fileobj:
+            self.assertEqual(fileobj.read(), b"archive-1-content")
+        self.assertEqual(mock_request_get.call_count, 1)
+
+        # least recently used archive is evicted when over the max size
+        os.utime(archive_cache.get_path(archive("hash-1")), (1, 1))
+        mock_request_get.side_effect = [MockResponse(200, b"archive-2-content")]
+
+        with archive_cache.open(archive("hash-2")) as fileobj:
+            self.assertEqual(fileobj.read(), b"archive-2-content")
+        self.assertEqual(os.listdir(cache_dir), ["daily_hash-2.jsonl.gz"])
+
+        # failed downloads are not cached
+        mock_request_get.side_effect = [MockResponse(404, b"Not Found")]
+
+        with self.assertRaises(Exception):
+            archive_cache.open(archive("hash-3"))
+        self.assertEqual(os.listdir(cache_dir), ["daily_hash-2.jsonl.gz"])
+
+    @patch("redis.client.StrictRedis.lock")
+    @patch("ureport.polls.models.Poll.get_flow_date")
+    @patch("dash.orgs.models.TembaClient.get_archives")
+    @patch("requests.get")
+    def test_pull_org_results_from_archives(
+        self, mock_request_get, mock_get_archives, mock_poll_flow_date, mock_redis_lock
+    ):
+        def gzipped_records(records):
+            stream = io.BytesIO()
+            gz = gzip.GzipFile(fileobj=stream, mode="wb")
+
+            for record in records:
+                gz.write(json.dumps(record).encode("utf-8"))
+                gz.write(b"\n")
+            gz.close()
+            stream.seek(0)
+            return MockResponse(200, stream.read())
+
+        def temba_run(run_id, flow_uuid, ruleset_uuid, contact_uuid, value):
+            return TembaRun.create(
+                id=run_id,
+                flow=ObjectRef.create(uuid=flow_uuid, name="Flow"),
+                contact=ObjectRef.create(uuid=contact_uuid, name="Wiz Kid"),
+                responded=True,
+                values={
+                    "win": TembaRun.Value.create(value=value, input=value, category="Win", node=ruleset_uuid, time=now)
+                },
+                path=[TembaRun.Step.create(node=ruleset_uuid, time=now)],
+                created_on=now,
+                modified_on=now,
+                exited_on=now,
+                exit_type="completed",
+            )
+
+        mock_poll_flow_date.return_value = None
+
+        PollResult.objects.all().delete()
+        poll1 = self.create_poll(self.nigeria, "Flow 1", "flow-uuid-1", self.education_nigeria, self.admin)
+        self.create_poll_question(self.admin, poll1, "question 1", "ruleset-uuid-1")
+        poll2 = self.create_poll(self.nigeria, "Flow 2", "flow-uuid-2", self.education_nigeria, self.admin)
+        self.create_poll_question(self.admin, poll2, "question 2", "ruleset-uuid-2")
+
+        r = get_redis_connection()
+        for flow_uuid in ["flow-uuid-1", "flow-uuid-2", "flow-uuid-4"]:
+            r.delete(Poll.POLL_ARCHIVES_IMPORTED_KEY % (self.nigeria.pk, flow_uuid))
+        cache.delete(Poll.POLL_ARCHIVE_FLOWS_CACHE_KEY % "a1b2c3d4e5f60718293a4b5c6d7e8f90")
+
+        now = timezone.now()
+        archive = TembaArchive.create(
+            archive_type="run",
+            start_date=poll1.created_on,
+            period="daily",
+            record_count=3,
+            size=23,
+            hash="a1b2c3d4e5f60718293a4b5c6d7e8f90",
+            download_url="http://s3-bucket.aws.com/my/archive.jsonl.gz",
+        )
+
+        mock_request_get.side_effect = [
+            gzipped_records(
+                [
+                    temba_run(1, "flow-uuid-1", "ruleset-uuid-1", "C-001", "Yes").serialize(),
+                    temba_run(2, "flow-uuid-2", "ruleset-uuid-2", "C-001", "No").serialize(),
+                    temba_run(3, "flow-uuid-3", "ruleset-uuid-3", "C-001", "Maybe").serialize(),
+                ]
+            )
+        ]
+        mock_get_archives.side_effect = [MockClientQuery([archive])]
+
+        pending_key = Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % self.nigeria.pk
+        r.delete(pending_key)
+        r.sadd(pending_key, poll1.pk, poll2.pk)
+
+        flows_stats = self.backend.pull_org_results_from_archives(self.nigeria, [poll1, poll2])
+
+        # the imported polls are not pending anymore and the imported archives are forgotten after a while
+        self.assertFalse(r.smembers(pending_key))
+        imported_ttl = r.ttl(Poll.POLL_ARCHIVES_IMPORTED_KEY % (self.nigeria.pk, "flow-uuid-1"))
+        self.assertTrue(0 < imported_ttl <= Poll.POLL_ARCHIVES_IMPORTED_TIMEOUT)
+
+        # the archive is downloaded once for both polls
+        self.assertEqual(mock_request_get.call_count, 1)
+        mock_get_archives.assert_called_once_with(archive_type="run", after=None)
+
+        self.assertEqual(flows_stats, {"flow-uuid-1": (1, 0, 0, 0, 0, 1), "flow-uuid-2": (1, 0, 0, 0, 0, 1)})
+        self.assertEqual(PollResult.objects.get(flow="flow-uuid-1").text, "Yes")
+        self.assertEqual(PollResult.objects.get(flow="flow-uuid-2").text, "No")
+        self.assertFalse(PollResult.objects.filter(flow="flow-uuid-3"))
+
+        # all the flows of the archive are indexed
+        self.assertEqual(
+            cache.get(Poll.POLL_ARCHIVE_FLOWS_CACHE_KEY % archive.hash), ["flow-uuid-1", "flow-uuid-2", "flow-uuid-3"]
+        )
+
+        # archive already imported for both flows is not downloaded again
+        mock_get_archives.side_effect = [MockClientQuery([archive])]
+
+        flows_stats = self.backend.pull_org_results_from_archives(self.nigeria, [poll1, poll2])
+        self.assertEqual(mock_request_get.call_count, 1)
+        self.assertEqual(flows_stats, {"flow-uuid-1": (0, 0, 0, 0, 0, 0), "flow-uuid-2": (0, 0, 0, 0, 0, 0)})
+
+        # stopped polls are left out
+        poll2.stopped_syncing = True
+        poll2.save()
+
+        mock_get_archives.side_effect = [MockClientQuery([archive])]
+        flows_stats = self.backend.pull_org_results_from_archives(self.nigeria, [poll1, poll2])
+        self.assertEqual(flows_stats, {"flow-uuid-1": (0, 0, 0, 0, 0, 0)})
+
+        # a new poll for a flow not in the archive index does not download the archive
+        poll4 = self.create_poll(self.nigeria, "Flow 4", "flow-uuid-4", self.education_nigeria, self.admin)
+        self.create_poll_question(self.admin, poll4, "question 4", "ruleset-uuid-4")
+
+        mock_get_archives.side_effect = [MockClientQuery([archive])]
+        flows_stats = self.backend.pull_org_results_from_archives(self.nigeria, [poll1, poll4])
+        self.assertEqual(flows_stats, {"flow-uuid-1": (0, 0, 0, 0, 0, 0), "flow-uuid-4": (0, 0, 0, 0, 0, 0)})
+        self.assertEqual(mock_request_get.call_count, 1)
+
+        # the locks of the flows expire if the task dies
+        mock_redis_lock.assert_called_with(
+            Poll.POLL_PULL_RESULTS_TASK_LOCK % (self.nigeria.pk, "flow-uuid-4"), timeout=Poll.POLL_SYNC_LOCK_TIMEOUT
+        )
+
+        # flows still syncing are left out
+        r.set(Poll.POLL_PULL_RESULTS_TASK_LOCK % (self.nigeria.pk, "flow-uuid-4"), "1")
+        try:
+            mock_get_archives.side_effect = [MockClientQuery([archive])]
+            flows_stats = self.backend.pull_org_results_from_archives(self.nigeria, [poll1, poll4])
+            self.assertEqual(flows_stats, {"flow-uuid-1": (0, 0, 0, 0, 0, 0)})
+        finally:
+            r.delete(Poll.POLL_PULL_RESULTS_TASK_LOCK % (self.nigeria.pk, "flow-uuid-4"))
+
+        # the import is paused before the next archive when the locks are about to expire, the poll stays pending
+        r.delete(Poll.POLL_ARCHIVES_IMPORTED_KEY % (self.nigeria.pk, "flow-uuid-1"))
+        r.sadd(pending_key, poll1.pk)
+        mock_get_archives.side_effect = [MockClientQuery([archive])]
+
+        with patch.object(Poll, "POLL_SYNC_LOCK_TIMEOUT", 0):
+            flows_stats = self.backend.pull_org_results_from_archives(self.nigeria, [poll1])
+
+        self.assertEqual(flows_stats, {"flow-uuid-1": (0, 0, 0, 0, 0, 0)})
+        self.assertEqual(mock_request_get.call_count, 1)
+        self.assertEqual(r.smembers(pending_key), {b"%d" % poll1.pk})
+
     @patch("dash.orgs.models.TembaClient.get_runs")
     @patch("django.utils.timezone.now")
     @patch("django.core.cache.cache.get")
@@ -2032,7 +2303,7 @@ class RapidProBackendTest(UreportTest):
 
         mock_get_runs.side_effect = [MockClientQuery([temba_run])]
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             (
                 num_val_created,
                 num_val_updated,
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ureport.contacts.models import ReportersCounter
+
+
+class Command(BaseCommand):
+    help = "Squashes the reporters counters added since the last squash into one row per org and counter type"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=ReportersCounter.SQUASH_BATCH_SIZE,
+            help="The number of org and counter type pairs squashed per transaction",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report the number of rows the squash would remove"
+        )
+
+    def handle(self, *args, **options):
+        rows_in, rows_out = ReportersCounter.squash_batches(
+            batch_size=options["batch_size"], dry_run=options["dry_run"]
+        )
+
+        if options["dry_run"]:
+            message = "Would squash %d rows into %d rows, removing %d rows"
+        else:
+            message = "Squashed %d rows into %d rows, removed %d rows"
+        self.stdout.write(message % (rows_in, rows_out, rows_in - rows_out))
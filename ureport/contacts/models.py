@@ -4,15 +4,19 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging
 import time
 from collections import defaultdict
+from contextlib import nullcontext
+from datetime import timedelta
 
 from django_redis import get_redis_connection
 
-from django.db import connection, models
+from django.core.cache import cache
+from django.db import connection, models, transaction
 from django.db.models import Count, Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from dash.orgs.models import Org, OrgBackend
-from ureport.utils import chunk_list
+from ureport.utils import chunk_list, iterate_keyset
 
 CONTACT_LOCK_KEY = "lock:contact:%d:%s"
 CONTACT_FIELD_LOCK_KEY = "lock:contact-field:%d:%s"
@@ -73,6 +77,30 @@ class Contact(models.Model):
     CONTACT_LAST_FETCHED_CACHE_KEY = "last:fetch_contacts:%d:backend:%s"
     CONTACT_LAST_FETCHED_CACHE_TIMEOUT = 60 * 60 * 24 * 30
 
+    POLL_RESULTS_PROPAGATED_ID_KEY = "org:%d:poll-results-propagated-contact-id"
+    POLL_RESULTS_PROPAGATION_DAYS = 30
+    POLL_RESULTS_PROPAGATION_BATCH_SIZE = 1000
+
+    # language=SQL
+    POLL_RESULTS_PROPAGATION_SQL = """
+    UPDATE polls_pollresult r
+    SET "state" = c."state", "district" = c."district", "ward" = c."ward",
+        "gender" = c."gender", "born" = c."born", "scheme" = c."scheme", "contact_ref_id" = c."id",
+        "state_boundary_id" = st."id", "district_boundary_id" = d."id", "ward_boundary_id" = w."id",
+        "gender_segment_id" = g."id", "scheme_segment_id" = sc."id"
+    FROM contacts_contact c
+      LEFT JOIN locations_boundary st ON st."org_id" = c."org_id" AND UPPER(st."osm_id") = UPPER(c."state")
+      LEFT JOIN locations_boundary d ON d."org_id" = c."org_id" AND UPPER(d."osm_id") = UPPER(c."district")
+      LEFT JOIN locations_boundary w ON w."org_id" = c."org_id" AND UPPER(w."osm_id") = UPPER(c."ward")
+      LEFT JOIN stats_gendersegment g ON LOWER(g."gender") = LOWER(c."gender")
+      LEFT JOIN stats_schemesegment sc ON LOWER(sc."scheme") = LOWER(c."scheme")
+    WHERE c."org_id" = %(org_id)s AND c."id" >= %(min_id)s AND c."id" <= %(max_id)s
+      AND c."registered_on" > %(since)s
+      AND r."org_id" = %(org_id)s AND r."contact" = c."uuid" AND r."date" >= %(since)s
+      AND (r."state", r."district", r."ward", r."gender", r."born", r."scheme")
+        IS DISTINCT FROM (c."state", c."district", c."ward", c."gender", c."born", c."scheme")
+    """
+
     MALE = "M"
     FEMALE = "F"
     OTHER = "O"
@@ -122,22 +150,109 @@ class Contact(models.Model):
     def lock(cls, org, uuid):
         return get_redis_connection().lock(CONTACT_LOCK_KEY % (org.pk, uuid), timeout=60)
 
+    @classmethod
+    def propagate_to_poll_results(cls, org):
+        """
+        Copies the locations, gender, born and scheme of the contacts created since the last propagation and
+        registered recently to their recent poll results, which were synced before them, with one UPDATE ... FROM
+        contacts_contact per range of contact ids
+        """
+        start = time.time()
+
+        since = timezone.now() - timedelta(days=cls.POLL_RESULTS_PROPAGATION_DAYS)
+        last_id_key = cls.POLL_RESULTS_PROPAGATED_ID_KEY % org.id
+        last_id = cache.get(last_id_key, 0)
+
+        # contacts created while we run are left for the next propagation
+        max_id = cls.objects.filter(org=org).order_by("-id").values_list("id", flat=True).first()
+        if max_id is None or max_id <= last_id:
+            return 0
+
+        contacts = cls.objects.filter(org=org, id__gt=last_id, id__lte=max_id, registered_on__gt=since)
+
+        contacts_count = 0
+        rows_count = 0
+        for batch_ids in iterate_keyset(contacts, cls.POLL_RESULTS_PROPAGATION_BATCH_SIZE, ids_only=True):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    cls.POLL_RESULTS_PROPAGATION_SQL,
+                    dict(org_id=org.id, min_id=batch_ids[0], max_id=batch_ids[-1], since=since),
+                )
+                rows_count += cursor.rowcount
+            contacts_count += len(batch_ids)
+
+        cache.set(last_id_key, max_id, None)
+
+        logger.info(
+            "Propagated %d new contacts to %d poll results for org #%d up to contact #%d in %.1fs"
+            % (contacts_count, rows_count, org.id, max_id, time.time() - start)
+        )
+        return rows_count
+
+    # language=SQL
+    REPORTERS_COUNTERS_REBUILD_SQL = """
+    INSERT INTO contacts_reporterscounter ("org_id", "type", "count")
+    SELECT %(org_id)s, k."type", COUNT(*)
+    FROM (
+      SELECT NULLIF(LOWER("gender"), '') AS "gender", CAST(NULLIF("born", 0) AS VARCHAR) AS "born",
+             NULLIF(LOWER("occupation"), '') AS "occupation",
+             TO_CHAR("registered_on" AT TIME ZONE 'UTC', 'YYYY-MM-DD') AS "registered_on",
+             NULLIF(UPPER("state"), '') AS "state", NULLIF(UPPER("district"), '') AS "district",
+             NULLIF(UPPER("ward"), '') AS "ward", NULLIF(LOWER("scheme"), '') AS "scheme"
+      FROM contacts_contact
+      WHERE "org_id" = %(org_id)s AND "is_active" = TRUE
+    ) c
+    CROSS JOIN LATERAL (
+      VALUES ('total-reporters'),
+             ('gender:' || c."gender"),
+             ('born:' || c."born"),
+             ('occupation:' || c."occupation"),
+             ('registered_on:' || c."registered_on"),
+             ('registered_gender:' || c."registered_on" || ':' || c."gender"),
+             ('registered_born:' || c."registered_on" || ':' || c."born"),
+             ('registered_state:' || c."registered_on" || ':' || c."state"),
+             ('registered_scheme:' || c."registered_on" || ':' || c."scheme"),
+             ('state:' || c."state"),
+             ('district:' || c."district"),
+             ('ward:' || c."ward"),
+             ('scheme:' || c."scheme")
+    ) AS k("type")
+    WHERE k."type" IS NOT NULL
+    GROUP BY k."type"
+    """
+
+    @classmethod
+    def rebuild_reporters_counters(cls, org):
+        """
+        Rebuilds the reporters counters of the org with the same types as generate_counters, counted by Postgres in
+        one pass over the org contacts, and replaces the existing counters in the same transaction so the counts never
+        read as empty while the rebuild runs
+        """
+        start = time.time()
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM contacts_reporterscounter WHERE org_id = %s", [org.id])
+                cursor.execute(cls.REPORTERS_COUNTERS_REBUILD_SQL, dict(org_id=org.id))
+                inserted = cursor.rowcount
+
+        logger.info(
+            "Finished rebuilding the reporters counters for org #%d in SQL in %.3fs, inserted %d counters"
+            % (org.id, time.time() - start, inserted)
+        )
+        return inserted
+
     @classmethod
     def recalculate_reporters_stats(cls, org):
         ReportersCounter.objects.filter(org_id=org.id).delete()
 
-        all_contacts = Contact.objects.filter(org=org).values_list("id", flat=True).order_by("id")
+        all_contacts = Contact.objects.filter(org=org)
         start = time.time()
         i = 0
 
-        all_contacts = list(all_contacts)
-        all_contacts_count = len(all_contacts)
-
         counters_dict = defaultdict(int)
 
-        for contact_id_batch in chunk_list(all_contacts, 1000):
-            contact_batch = list(contact_id_batch)
-            contacts = Contact.objects.filter(id__in=contact_batch)
+        for contacts in iterate_keyset(all_contacts, 1000, label="Reporters counters rebuild for org #%d" % org.id):
             for contact in contacts:
                 i += 1
                 gen_counters = contact.generate_counters()
@@ -153,7 +268,7 @@ class Contact(models.Model):
 
         logger.info(
             "Finished Rebuilding the contacts reporters counters for org #%d in %ds, inserted %d counters objects for %s contacts"
-            % (org.id, time.time() - start, len(counters_to_insert), all_contacts_count)
+            % (org.id, time.time() - start, len(counters_to_insert), i)
         )
 
         return counters_dict
@@ -240,6 +355,43 @@ class ReportersCounter(models.Model):
     COUNTS_SQUASH_LOCK = "org-reporters-counts-squash-lock"
     LAST_SQUASHED_ID_KEY = "org-reporters-last-squashed-id"
 
+    SQUASH_BATCH_SIZE = 5000
+
+    # language=SQL
+    SQUASH_SQL = """
+    WITH pairs AS (
+      SELECT c."org_id", c."type"
+      FROM contacts_reporterscounter c
+      JOIN UNNEST(%(org_ids)s::INT[], %(types)s::VARCHAR[]) AS p("org_id", "type")
+        ON c."org_id" = p."org_id" AND c."type" = p."type"
+      GROUP BY c."org_id", c."type"
+      HAVING COUNT(*) > 1
+    ), deleted AS (
+      DELETE FROM contacts_reporterscounter c USING pairs p
+      WHERE c."org_id" = p."org_id" AND c."type" = p."type"
+      RETURNING c."org_id", c."type", c."count"
+    ), inserted AS (
+      INSERT INTO contacts_reporterscounter("org_id", "type", "count")
+      SELECT "org_id", "type", GREATEST(0, SUM("count")) FROM deleted
+      GROUP BY "org_id", "type"
+      RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM deleted), (SELECT COUNT(*) FROM inserted);
+    """
+
+    # language=SQL
+    SQUASH_DRY_RUN_SQL = """
+    SELECT COALESCE(SUM(s."rows"), 0)::BIGINT, COUNT(*)
+    FROM (
+      SELECT COUNT(*) AS "rows"
+      FROM contacts_reporterscounter c
+      JOIN UNNEST(%(org_ids)s::INT[], %(types)s::VARCHAR[]) AS p("org_id", "type")
+        ON c."org_id" = p."org_id" AND c."type" = p."type"
+      GROUP BY c."org_id", c."type"
+      HAVING COUNT(*) > 1
+    ) s;
+    """
+
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="reporters_counters")
 
     type = models.CharField(max_length=255)
@@ -309,6 +461,77 @@ class ReportersCounter(models.Model):
                     "Squashed poll results counts for %d types in %0.3fs" % (squash_count, time.time() - start)
                 )
 
+    @classmethod
+    def squash_batches(cls, batch_size=None, dry_run=False):
+        """
+        Squashes the counters of the (org, type) pairs added since the last squash like squash_counts, but with one
+        DELETE feeding a GROUP BY INSERT per batch of pairs, each in its own transaction, instead of one function call
+        per pair. Pairs that are already down to one row are left as they are.
+
+        The watermark is the max id when the squash starts, so counters added meanwhile are squashed by the next run.
+        In dry run nothing is changed and the rows out are the rows the squash would leave. Returns the counts of
+        (rows in, rows out).
+        """
+        batch_size = batch_size or cls.SQUASH_BATCH_SIZE
+
+        r = get_redis_connection()
+        if not dry_run and r.get(cls.COUNTS_SQUASH_LOCK):
+            logger.info("Squash reporters counts already running.")
+            return 0, 0
+
+        with r.lock(cls.COUNTS_SQUASH_LOCK) if not dry_run else nullcontext():
+            last_squashed_id = int(r.get(cls.LAST_SQUASHED_ID_KEY) or 0)
+
+            start = time.time()
+
+            max_id = cls.objects.aggregate(max_id=models.Max("id"))["max_id"] or 0
+            if max_id < last_squashed_id:
+                # the table was emptied since the last squash
+                last_squashed_id = 0
+
+            pairs = list(
+                cls.objects.filter(id__gt=last_squashed_id, id__lte=max_id)
+                .values_list("org_id", "type")
+                .order_by("org_id", "type")
+                .distinct()
+            )
+
+            sql = cls.SQUASH_DRY_RUN_SQL if dry_run else cls.SQUASH_SQL
+
+            rows_in, rows_out, pairs_count = 0, 0, 0
+            for batch in chunk_list(pairs, batch_size):
+                org_ids, types = zip(*batch)
+                pairs_count += len(org_ids)
+
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, dict(org_ids=list(org_ids), types=list(types)))
+                        batch_rows_in, batch_rows_out = cursor.fetchone()
+
+                rows_in += batch_rows_in
+                rows_out += batch_rows_out
+
+                elapsed = time.time() - start
+                logger.info(
+                    "Squashing reporters counts progress... %0.2f/100, %d rows in, %d rows out in %0.3fs, %0.0f rows/s"
+                    % (
+                        pairs_count * 100 / len(pairs),
+                        rows_in,
+                        rows_out,
+                        elapsed,
+                        rows_in / elapsed if elapsed else rows_in,
+                    )
+                )
+
+            if not dry_run:
+                r.set(cls.LAST_SQUASHED_ID_KEY, max_id)
+
+            logger.info(
+                "%s %d rows of %d reporters counts types into %d rows in %0.3fs"
+                % ("Would squash" if dry_run else "Squashed", rows_in, len(pairs), rows_out, time.time() - start)
+            )
+            return rows_in, rows_out
+
     @classmethod
     def get_counts(cls, org, types=None):
         """
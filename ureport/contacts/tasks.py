@@ -6,6 +6,7 @@ import time
 from django_redis import get_redis_connection
 
 from django.core.cache import cache
+from django.db import connection
 from django.utils import timezone
 
 from celery.utils.log import get_task_logger
@@ -15,8 +16,7 @@ from dash.orgs.tasks import org_task
 from dash.utils.sync import SyncOutcome
 from ureport.celery import app
 from ureport.contacts.models import Contact, ReportersCounter
-from ureport.stats.models import ContactActivity
-from ureport.utils import chunk_list, datetime_to_json_date, update_cache_org_contact_counts
+from ureport.utils import datetime_to_json_date, iterate_keyset, update_cache_org_contact_counts
 
 logger = get_task_logger(__name__)
 
@@ -28,7 +28,7 @@ def rebuild_contacts_counts():
     for org in orgs:
         key = TaskState.get_lock_key(org, "contact-pull")
         with r.lock(key):
-            Contact.recalculate_reporters_stats(org)
+            Contact.rebuild_reporters_counters(org)
 
 
 @app.task(name="contacts.check_contacts_count_mismatch")
@@ -162,6 +162,9 @@ def pull_contacts(org, ignored_since, ignored_until):
             "contacts": {"created": contacts_created, "updated": contacts_updated, "deleted": contacts_deleted},
         }
 
+    # copy the demographics of the new contacts to their results synced before them, once for all the backends
+    Contact.propagate_to_poll_results(org)
+
     return results
 
 
@@ -253,7 +256,7 @@ def populate_contact_schemes(org, since, until):
 
             logger.info("Fetch contacts for org #%d took %ss" % (org.pk, time.time() - start_contacts))
 
-        Contact.recalculate_reporters_stats(org)
+        Contact.rebuild_reporters_counters(org)
 
     elapsed = time.time() - start_time
     logger.info(f"Finished populating schemes on contacts for org #{org.id} in {elapsed:.1f} seconds")
@@ -268,55 +271,89 @@ def populate_contact_schemes(org, since, until):
     populate_contact_activities_schemes.apply_async((org.id,), queue="slow")
 
 
-@app.task(name="contacts.populate_contact_activities_schemes")
-def populate_contact_activities_schemes(org_id):
+SCHEMES_BATCH_SIZE = 1000
 
-    contact_activities_schemes_populated_key = f"contact_activities_schemes_populated:{org_id}"
+# language=SQL
+CONTACT_ACTIVITIES_SCHEMES_SQL = """
+UPDATE stats_contactactivity a SET "scheme" = c."scheme"
+FROM contacts_contact c
+WHERE c."org_id" = %(org_id)s AND c."id" >= %(min_id)s AND c."id" <= %(max_id)s
+  AND c."is_active" = TRUE AND c."scheme" IS NOT NULL AND c."scheme" <> ''
+  AND a."org_id" = c."org_id" AND a."contact" = c."uuid" AND a."scheme" IS DISTINCT FROM c."scheme"
+"""
 
-    if cache.get(contact_activities_schemes_populated_key):
-        logger.info(f"Skipping populating schemes for org #{org_id}")
-        populate_poll_results_schemes.apply_async((org_id,), queue="slow")
-        return
+# language=SQL
+POLL_RESULTS_SCHEMES_SQL = """
+UPDATE polls_pollresult r SET "scheme" = c."scheme",
+  "scheme_segment_id" = (SELECT s."id" FROM stats_schemesegment s WHERE LOWER(s."scheme") = LOWER(c."scheme") LIMIT 1)
+FROM contacts_contact c
+WHERE c."org_id" = %(org_id)s AND c."id" >= %(min_id)s AND c."id" <= %(max_id)s
+  AND c."is_active" = TRUE AND c."scheme" IS NOT NULL AND c."scheme" <> ''
+  AND r."org_id" = %(org_id)s AND r."contact" = c."uuid" AND r."scheme" IS DISTINCT FROM c."scheme"
+"""
 
-    contact_activities_schemes_max_id_key = f"contact_activities_schemes_max_id:{org_id}"
-    max_id = cache.get(contact_activities_schemes_max_id_key, 0)
+
+def populate_schemes_by_contact_ranges(org_id, sql, max_id_key, label):
+    """
+    Copies the schemes of the org contacts to the rows of their uuid with one UPDATE ... FROM contacts_contact per
+    range of contact ids, resuming after the last contact id of the previous run and saving it once per range
+    """
+    max_id = cache.get(max_id_key, 0)
 
     start_time = time.time()
-    logger.info(f"started populating schemes on contacts activities for org #{org_id}")
-    contact_ids = (
-        Contact.objects.filter(org_id=org_id, is_active=True, id__gt=max_id)
-        .exclude(scheme=None)
-        .exclude(scheme="")
-        .order_by("id")
-        .values_list("id", flat=True)
+    logger.info(f"started populating schemes on {label} for org #{org_id} after contact #{max_id}")
+
+    contacts = (
+        Contact.objects.filter(org_id=org_id, is_active=True, id__gt=max_id).exclude(scheme=None).exclude(scheme="")
     )
 
     contacts_count = 0
+    rows_count = 0
 
-    for batch in chunk_list(contact_ids, 1000):
-        batch_ids = list(batch)
-        contacts = Contact.objects.filter(id__in=batch_ids)
-        for contact in contacts:
-            ContactActivity.objects.filter(org_id=contact.org_id, contact=contact.uuid).update(scheme=contact.scheme)
-            cache.set(contact_activities_schemes_max_id_key, contact.id, None)
+    for batch_ids in iterate_keyset(contacts, SCHEMES_BATCH_SIZE, ids_only=True):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, dict(org_id=org_id, min_id=batch_ids[0], max_id=batch_ids[-1]))
+            rows_count += cursor.rowcount
 
+        cache.set(max_id_key, batch_ids[-1], None)
         contacts_count += len(batch_ids)
 
         elapsed = time.time() - start_time
+        rate = rows_count / elapsed if elapsed else rows_count
         logger.info(
-            f"Populating schemes on contacts activities batch {contacts_count} for org #{org_id} in {elapsed:.1f} seconds"
+            f"Populating schemes on {label} for org #{org_id}, {contacts_count} contacts and {rows_count} rows "
+            f"updated up to contact #{batch_ids[-1]} in {elapsed:.1f} seconds, {rate:.0f} rows/s"
         )
 
     elapsed = time.time() - start_time
-    logger.info(f"Finished populating schemes on contacts activities for org #{org_id} in {elapsed:.1f} seconds")
+    logger.info(
+        f"Finished populating schemes on {label} for org #{org_id}, {contacts_count} contacts and {rows_count} rows "
+        f"updated in {elapsed:.1f} seconds"
+    )
+    return rows_count
+
+
+@app.task(name="contacts.populate_contact_activities_schemes")
+def populate_contact_activities_schemes(org_id):
+
+    contact_activities_schemes_populated_key = f"contact_activities_schemes_populated:{org_id}"
+
+    if cache.get(contact_activities_schemes_populated_key):
+        logger.info(f"Skipping populating schemes for org #{org_id}")
+        populate_poll_results_schemes.apply_async((org_id,), queue="slow")
+        return
+
+    contact_activities_schemes_max_id_key = f"contact_activities_schemes_max_id:{org_id}"
+    populate_schemes_by_contact_ranges(
+        org_id, CONTACT_ACTIVITIES_SCHEMES_SQL, contact_activities_schemes_max_id_key, "contacts activities"
+    )
+
     cache.set(contact_activities_schemes_populated_key, datetime_to_json_date(timezone.now()), None)
     populate_poll_results_schemes.apply_async((org_id,), queue="slow")
 
 
 @app.task(name="contacts.populate_poll_results_schemes")
 def populate_poll_results_schemes(org_id):
-    from ureport.polls.models import PollResult
-
     poll_results_schemes_populated_key = f"poll_results_schemes_populated:{org_id}"
 
     if cache.get(poll_results_schemes_populated_key):
@@ -324,34 +361,8 @@ def populate_poll_results_schemes(org_id):
         return
 
     poll_results_schemes_max_id_key = f"poll_results_schemes_max_id:{org_id}"
-    max_id = cache.get(poll_results_schemes_max_id_key, 0)
-
-    start_time = time.time()
-    logger.info(f"started populating schemes on poll results for org #{org_id}")
-    contact_ids = (
-        Contact.objects.filter(org_id=org_id, is_active=True, id__gt=max_id)
-        .exclude(scheme=None)
-        .exclude(scheme="")
-        .order_by("id")
-        .values_list("id", flat=True)
+    populate_schemes_by_contact_ranges(
+        org_id, POLL_RESULTS_SCHEMES_SQL, poll_results_schemes_max_id_key, "poll results"
     )
 
-    contacts_count = 0
-
-    for batch in chunk_list(contact_ids, 1000):
-        batch_ids = list(batch)
-        contacts = Contact.objects.filter(id__in=batch_ids)
-        for contact in contacts:
-            PollResult.objects.filter(contact=contact.uuid).update(scheme=contact.scheme)
-            cache.set(poll_results_schemes_max_id_key, contact.id, None)
-
-        contacts_count += len(batch_ids)
-
-        elapsed = time.time() - start_time
-        logger.info(
-            f"Populating schemes on poll results batch {contacts_count} for org #{org_id} in {elapsed:.1f} seconds"
-        )
-
-    elapsed = time.time() - start_time
-    logger.info(f"Finished populating schemes on poll results for org #{org_id} in {elapsed:.1f} seconds")
     cache.set(poll_results_schemes_populated_key, datetime_to_json_date(timezone.now()), None)
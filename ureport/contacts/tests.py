@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from io import StringIO
+
+from django_redis import get_redis_connection
 from mock import patch
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+
 from dash.orgs.models import TaskState
 from dash.utils.sync import SyncOutcome
 from ureport.contacts.models import Contact, ContactField, ReportersCounter
-from ureport.contacts.tasks import check_contacts_count_mismatch, pull_contacts, update_org_contact_count
+from ureport.contacts.tasks import (
+    POLL_RESULTS_SCHEMES_SQL,
+    check_contacts_count_mismatch,
+    populate_contact_activities_schemes,
+    populate_poll_results_schemes,
+    populate_schemes_by_contact_ranges,
+    pull_contacts,
+    update_org_contact_count,
+)
 from ureport.locations.models import Boundary
+from ureport.polls.models import PollResult
+from ureport.stats.models import ContactActivity
 from ureport.tests import TestBackend, UreportTest
 from ureport.utils import json_date_to_datetime
 
@@ -230,6 +247,93 @@ class ContactTest(UreportTest):
 
         self.assertEqual(ReportersCounter.get_counts(self.nigeria), expected)
 
+    def test_reporters_counter_statement_triggers(self):
+        Contact.objects.bulk_create(
+            [
+                Contact(
+                    uuid="C-00%d" % i,
+                    org=self.nigeria,
+                    gender="M",
+                    born=1990,
+                    registered_on=json_date_to_datetime("2014-01-02T03:04:05.000"),
+                    state="R-LAGOS",
+                )
+                for i in range(3)
+            ]
+        )
+
+        # one counter row per type for the whole statement
+        self.assertEqual(ReportersCounter.objects.filter(org=self.nigeria, type="gender:m").count(), 1)
+        self.assertEqual(ReportersCounter.get_counts(self.nigeria)["total-reporters"], 3)
+        self.assertEqual(ReportersCounter.get_counts(self.nigeria)["registered_born:2014-01-02:1990"], 3)
+
+        Contact.objects.filter(org=self.nigeria).update(state="R-OYO")
+
+        counts = ReportersCounter.get_counts(self.nigeria)
+        self.assertEqual(counts["state:R-LAGOS"], 0)
+        self.assertEqual(counts["state:R-OYO"], 3)
+        self.assertEqual(counts["total-reporters"], 3)
+        self.assertEqual(ReportersCounter.objects.filter(org=self.nigeria, type="state:R-OYO").count(), 1)
+
+        # updates that don't change a counter don't insert any
+        num_counters = ReportersCounter.objects.filter(org=self.nigeria).count()
+        Contact.objects.filter(org=self.nigeria).update(occupation=None)
+        self.assertEqual(ReportersCounter.objects.filter(org=self.nigeria).count(), num_counters)
+
+        Contact.objects.filter(org=self.nigeria, uuid="C-000").update(is_active=False)
+        self.assertEqual(ReportersCounter.get_counts(self.nigeria)["total-reporters"], 2)
+
+        Contact.objects.filter(org=self.nigeria, is_active=True).delete()
+        counts = ReportersCounter.get_counts(self.nigeria)
+        self.assertEqual(counts["total-reporters"], 0)
+        self.assertEqual(counts["gender:m"], 0)
+
+    def test_rebuild_reporters_counters(self):
+        Contact.objects.create(
+            uuid="C-007",
+            org=self.nigeria,
+            gender="M",
+            born=1990,
+            occupation="Student",
+            registered_on=json_date_to_datetime("2014-01-02T23:04:05.000"),
+            state="R-LAGOS",
+            district="R-OYO",
+            ward="R-IKEJA",
+            scheme="tel",
+        )
+        Contact.objects.create(
+            uuid="C-008",
+            org=self.nigeria,
+            gender="F",
+            born=0,
+            occupation="",
+            registered_on=json_date_to_datetime("2014-01-03T03:07:05.000"),
+            state="R-LAGOS",
+            scheme="facebook",
+        )
+        Contact.objects.create(uuid="C-009", org=self.nigeria)
+        Contact.objects.create(uuid="C-010", org=self.nigeria, gender="M", born=1980, is_active=False)
+        Contact.objects.create(uuid="C-011", org=self.uganda, gender="M", born=1980)
+
+        # the counters generated for each contact
+        Contact.recalculate_reporters_stats(self.nigeria)
+        expected = ReportersCounter.get_counts(self.nigeria)
+        self.assertEqual(expected["total-reporters"], 3)
+        self.assertEqual(expected["registered_gender:2014-01-02:m"], 1)
+        self.assertEqual(expected["registered_scheme:2014-01-03:facebook"], 1)
+        self.assertNotIn("born:0", expected)
+        self.assertNotIn("occupation:", expected)
+
+        # drift the counters, the rebuild replaces them with the counts of the contacts
+        ReportersCounter.objects.create(org=self.nigeria, type="total-reporters", count=5)
+        ReportersCounter.objects.create(org=self.nigeria, type="gender:x", count=2)
+        uganda_counts = ReportersCounter.get_counts(self.uganda)
+
+        self.assertEqual(Contact.rebuild_reporters_counters(self.nigeria), len(expected))
+        self.assertEqual(ReportersCounter.get_counts(self.nigeria), expected)
+        self.assertEqual(ReportersCounter.objects.filter(org=self.nigeria).count(), len(expected))
+        self.assertEqual(ReportersCounter.get_counts(self.uganda), uganda_counts)
+
     def test_reporters_counter(self):
         self.assertEqual(ReportersCounter.get_counts(self.nigeria), dict())
         Contact.objects.create(
@@ -324,6 +428,39 @@ class ContactTest(UreportTest):
 
         self.assertTrue(counter_type_a.count, 5)
 
+    def test_squash_batches_reporters(self):
+        get_redis_connection().delete(ReportersCounter.LAST_SQUASHED_ID_KEY)
+
+        ReportersCounter.objects.create(org=self.nigeria, type="type-a", count=2)
+        counter2 = ReportersCounter.objects.create(org=self.nigeria, type="type-b", count=1)
+        ReportersCounter.objects.create(org=self.nigeria, type="type-a", count=3)
+        ReportersCounter.objects.create(org=self.uganda, type="type-a", count=4)
+        ReportersCounter.objects.create(org=self.uganda, type="type-a", count=-6)
+
+        # nothing is changed in dry run
+        out = StringIO()
+        call_command("squash_reporters_counters", "--dry-run", stdout=out)
+        self.assertIn("Would squash 4 rows into 2 rows, removing 2 rows", out.getvalue())
+        self.assertEqual(ReportersCounter.objects.all().count(), 5)
+        self.assertFalse(get_redis_connection().get(ReportersCounter.LAST_SQUASHED_ID_KEY))
+
+        # pairs are squashed in batches of one
+        self.assertEqual(ReportersCounter.squash_batches(batch_size=1), (4, 2))
+
+        self.assertEqual(ReportersCounter.objects.all().count(), 3)
+        self.assertTrue(ReportersCounter.objects.filter(pk=counter2.pk))
+        self.assertEqual(ReportersCounter.get_counts(self.nigeria), {"type-a": 5, "type-b": 1})
+        self.assertEqual(ReportersCounter.get_counts(self.uganda), {"type-a": 0})
+
+        # only the pairs with counters added since the last squash are squashed
+        ReportersCounter.objects.create(org=self.nigeria, type="type-b", count=2)
+
+        out = StringIO()
+        call_command("squash_reporters_counters", stdout=out)
+        self.assertIn("Squashed 2 rows into 1 rows, removed 1 rows", out.getvalue())
+        self.assertEqual(ReportersCounter.get_counts(self.nigeria), {"type-a": 5, "type-b": 3})
+        self.assertEqual(ReportersCounter.objects.all().count(), 3)
+
 
 class ContactsTasksTest(UreportTest):
     def setUp(self):
@@ -393,6 +530,65 @@ class ContactsTasksTest(UreportTest):
             None,
         )
 
+    @patch("ureport.contacts.tasks.populate_poll_results_schemes.apply_async")
+    def test_populate_schemes(self, mock_populate_poll_results_schemes):
+        contact1 = Contact.objects.create(org=self.nigeria, uuid="C-001", scheme="tel")
+        contact2 = Contact.objects.create(org=self.nigeria, uuid="C-002", scheme="facebook")
+        Contact.objects.create(org=self.nigeria, uuid="C-003", scheme=None)
+
+        today = timezone.now().date()
+        rows = ((self.nigeria, "C-001"), (self.nigeria, "C-002"), (self.nigeria, "C-003"), (self.uganda, "C-001"))
+        for org, contact in rows:
+            ContactActivity.objects.create(org=org, contact=contact, date=today)
+            PollResult.objects.create(
+                org=org, flow="flow-uuid", ruleset="ruleset-uuid", contact=contact, completed=False
+            )
+
+        # an already populated row is not updated again
+        PollResult.objects.filter(org=self.nigeria, contact="C-002").update(scheme="facebook")
+
+        for key in (
+            f"contact_activities_schemes_populated:{self.nigeria.id}",
+            f"contact_activities_schemes_max_id:{self.nigeria.id}",
+            f"poll_results_schemes_populated:{self.nigeria.id}",
+            f"poll_results_schemes_max_id:{self.nigeria.id}",
+        ):
+            cache.delete(key)
+
+        with patch("ureport.contacts.tasks.SCHEMES_BATCH_SIZE", 1):
+            populate_contact_activities_schemes(self.nigeria.id)
+
+        mock_populate_poll_results_schemes.assert_called_once_with((self.nigeria.id,), queue="slow")
+        self.assertEqual(
+            set(ContactActivity.objects.filter(org=self.nigeria).values_list("contact", "scheme")),
+            {("C-001", "tel"), ("C-002", "facebook"), ("C-003", None)},
+        )
+        self.assertEqual(ContactActivity.objects.get(org=self.uganda).scheme, None)
+        self.assertEqual(cache.get(f"contact_activities_schemes_max_id:{self.nigeria.id}"), contact2.id)
+        self.assertTrue(cache.get(f"contact_activities_schemes_populated:{self.nigeria.id}"))
+
+        self.assertEqual(
+            populate_schemes_by_contact_ranges(
+                self.nigeria.id,
+                POLL_RESULTS_SCHEMES_SQL,
+                f"poll_results_schemes_max_id:{self.nigeria.id}",
+                "poll results",
+            ),
+            1,
+        )
+        self.assertEqual(
+            set(PollResult.objects.filter(org=self.nigeria).values_list("contact", "scheme")),
+            {("C-001", "tel"), ("C-002", "facebook"), ("C-003", None)},
+        )
+        self.assertEqual(PollResult.objects.get(org=self.uganda).scheme, None)
+
+        # resumes after the last contact populated
+        contact1.scheme = "twitter"
+        contact1.save()
+        populate_poll_results_schemes(self.nigeria.id)
+        self.assertEqual(PollResult.objects.get(org=self.nigeria, contact="C-001").scheme, "tel")
+        self.assertTrue(cache.get(f"poll_results_schemes_populated:{self.nigeria.id}"))
+
     @patch("ureport.contacts.tasks.update_cache_org_contact_counts")
     def test_update_org_contact_count(self, mock_update_cache_org_contact_counts):
         mock_update_cache_org_contact_counts.return_value = "Called"
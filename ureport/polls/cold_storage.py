@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class PollResultsColdStorage(object):
+    """
+    Keeps the results of the polls cleared from the database in the file storage, so their stats can still be rebuilt.
+
+    The results of a poll flow are stored as one gzipped JSON lines file, a header line followed by one line per chunk
+    of results with a column per result field. The columns of a chunk are dictionary encoded as their distinct values
+    and the code of the value of each result, so the repeated uuids, categories and boundaries are only stored once,
+    except the dates which are mostly distinct and stored as they are.
+    """
+
+    VERSION = 2
+
+    COLUMNS = (
+        "ruleset",
+        "contact",
+        "date",
+        "completed",
+        "category",
+        "text",
+        "state",
+        "district",
+        "ward",
+        "gender",
+        "born",
+        "scheme",
+    )
+
+    EXPORT_CHUNK_SIZE = 10000
+
+    def __init__(self, directory, storage=None):
+        self.directory = directory
+        self.storage = storage if storage is not None else default_storage
+
+    @classmethod
+    def get_default(cls):
+        directory = getattr(settings, "POLL_RESULTS_COLD_STORAGE_DIR", None)
+        if not directory:
+            return None
+
+        return cls(directory)
+
+    def get_path(self, poll):
+        return os.path.join(self.directory, "org_%d" % poll.org_id, "%s.jsonl.gz" % poll.flow_uuid)
+
+    def exists(self, poll):
+        return self.storage.exists(self.get_path(poll))
+
+    @classmethod
+    def encode_chunk(cls, rows):
+        columns = dict()
+        for column, values in zip(cls.COLUMNS, zip(*rows)):
+            if column == "date":
+                columns[column] = [value.isoformat() if value else None for value in values]
+            else:
+                index = dict()
+                codes = [index.setdefault(value, len(index)) for value in values]
+                columns[column] = dict(values=list(index), codes=codes)
+
+        return dict(num_results=len(rows), columns=columns)
+
+    @classmethod
+    def decode_chunk(cls, chunk, columns):
+        decoded = []
+        for column in columns:
+            encoded = chunk["columns"][column]
+            if column == "date":
+                decoded.append([datetime.fromisoformat(value) if value else None for value in encoded])
+            else:
+                values = encoded["values"]
+                decoded.append([values[code] for code in encoded["codes"]])
+
+        return zip(*decoded)
+
+    def export(self, poll):
+        """
+        Writes the results of the poll flow to the storage, replacing any previous export. Returns the number of
+        results exported
+        """
+        from ureport.polls.models import PollResult
+        from ureport.utils import chunk_list
+
+        start = time.time()
+
+        header = dict(
+            version=self.VERSION,
+            org_id=poll.org_id,
+            flow=poll.flow_uuid,
+            exported_on=timezone.now().isoformat(),
+        )
+
+        results = PollResult.objects.filter(org_id=poll.org_id, flow=poll.flow_uuid).order_by("id")
+        rows = results.values_list(*self.COLUMNS).iterator(chunk_size=self.EXPORT_CHUNK_SIZE)
+
+        path = self.get_path(poll)
+        num_results = 0
+        with tempfile.TemporaryFile() as tmp_file:
+            with gzip.GzipFile(fileobj=tmp_file, mode="wb") as gzip_file:
+                gzip_file.write(json.dumps(header).encode("utf-8") + b"\n")
+
+                for batch in chunk_list(rows, self.EXPORT_CHUNK_SIZE):
+                    chunk = self.encode_chunk(list(batch))
+                    gzip_file.write(json.dumps(chunk).encode("utf-8") + b"\n")
+                    num_results += chunk["num_results"]
+
+            tmp_file.seek(0)
+            if self.storage.exists(path):
+                self.storage.delete(path)
+            self.storage.save(path, File(tmp_file))
+
+        logger.info(
+            "Exported %d results for poll #%d on org #%d to %s in %0.3fs"
+            % (num_results, poll.pk, poll.org_id, path, time.time() - start)
+        )
+        return num_results
+
+    def read_rows(self, poll, columns):
+        """
+        Yields the exported results of the poll flow as tuples of the values of the given columns, decoding a single
+        chunk at a time
+        """
+        with self.storage.open(self.get_path(poll), "rb") as stored_file:
+            with gzip.GzipFile(fileobj=stored_file, mode="rb") as gzip_file:
+                header = json.loads(gzip_file.readline().decode("utf-8"))
+                if header.get("version") != self.VERSION:
+                    raise ValueError("Unsupported poll results export version %s" % header.get("version"))
+
+                for line in gzip_file:
+                    yield from self.decode_chunk(json.loads(line.decode("utf-8")), columns)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import time
+from collections import Counter
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+
+class PollStatsCounter(object):
+    """
+    Counts poll results into poll stats fields in plain Python, without building a result tuple per row.
+
+    The rows are read in chunks and each column of a chunk is dictionary encoded, so the normalisation and the ids
+    lookups only run once per distinct value instead of once per row. The combined ids are then counted with a
+    Counter shared by all the chunks. Nothing is vectorized, the gain over the per-row loop only comes from the
+    repeated values of the columns.
+    """
+
+    COLUMNS = ("ruleset", "category", "born", "gender", "state", "district", "ward", "scheme", "date")
+
+    CHUNK_SIZE = 10000
+
+    def __init__(self, poll, lookups=None):
+        self.poll = poll
+        self.lookups = lookups if lookups is not None else poll.get_poll_stats_lookups()
+
+    @staticmethod
+    def factorize(values):
+        """
+        Returns the code of each value and the list of the distinct values, in order of first appearance
+        """
+        index = dict()
+        codes = [index.setdefault(value, len(index)) for value in values]
+        return codes, list(index)
+
+    @staticmethod
+    def take(ids, codes):
+        return [ids[code] for code in codes]
+
+    def get_category_ids(self, ruleset_codes, rulesets, category_codes, categories):
+        from ureport.polls.models import PollResponseCategory
+
+        questions_dict = self.lookups["questions"]
+
+        normalized = []
+        for category in categories:
+            if category is not None and category.lower() not in PollResponseCategory.IGNORED_CATEGORY_RULES:
+                normalized.append(category.lower())
+            else:
+                normalized.append("")
+
+        # the category ids depend on the question, so the pairs of ruleset and category are factorized together
+        pair_codes, pairs = self.factorize(zip(ruleset_codes, category_codes))
+        pair_ids = []
+        for ruleset_code, category_code in pairs:
+            flow_categories = questions_dict.get(rulesets[ruleset_code], dict()).get("flow_categories", dict())
+            pair_ids.append(flow_categories.get(normalized[category_code]) or 0)
+
+        return self.take(pair_ids, pair_codes)
+
+    def get_age_ids(self, born_codes, borns):
+        from ureport.stats.models import AgeSegment
+
+        age_dict = self.lookups["ages"]
+        poll_year = self.poll.poll_date.year
+
+        born_values = [int(born) if born else 0 for born in borns]
+        min_ages = [AgeSegment.get_age_segment_min_age(max(poll_year - born, 0)) for born in born_values]
+
+        age_ids = [age_dict.get(min_age) or 0 if born else 0 for born, min_age in zip(born_values, min_ages)]
+        return self.take(age_ids, born_codes)
+
+    def get_scheme_ids(self, scheme_codes, schemes):
+        from ureport.stats.models import SchemeSegment
+
+        scheme_dict = self.lookups["schemes"]
+
+        scheme_ids = []
+        for scheme in schemes:
+            scheme_id = 0
+            if scheme:
+                scheme_id = scheme_dict.get(scheme.lower())
+                if scheme_id is None:
+                    scheme_obj, created_flag = SchemeSegment.objects.get_or_create(scheme=scheme.lower())
+                    scheme_id = scheme_dict[scheme.lower()] = scheme_obj.id
+            scheme_ids.append(scheme_id)
+
+        return self.take(scheme_ids, scheme_codes)
+
+    def get_location_ids(self, state_column, district_column, ward_column):
+        location_dict = self.lookups["locations"]
+
+        # ids of the most precise location set, -1 when the boundary is not set at all
+        location_ids = None
+        for column in (state_column, district_column, ward_column):
+            codes, values = self.factorize(column)
+            ids = self.take([location_dict.get(value.upper()) or 0 if value else -1 for value in values], codes)
+
+            if location_ids is None:
+                location_ids = ids
+            else:
+                location_ids = [elt if elt >= 0 else previous for elt, previous in zip(ids, location_ids)]
+
+        return [max(elt, 0) for elt in location_ids]
+
+    def count_chunk(self, rows, counter):
+        """
+        Adds the keys of the given rows to the counter, the keys have the ids of the poll stats fields and the day
+        """
+        ruleset, category, born, gender, state, district, ward, scheme, date = zip(*rows)
+
+        questions_dict = self.lookups["questions"]
+        gender_dict = self.lookups["genders"]
+
+        ruleset_codes, rulesets = self.factorize(ruleset)
+        rulesets = [elt.lower() if elt else "" for elt in rulesets]
+        flow_result_ids = self.take(
+            [questions_dict.get(elt, dict()).get("flow_result_id") or 0 for elt in rulesets], ruleset_codes
+        )
+
+        category_codes, categories = self.factorize(category)
+        category_ids = self.get_category_ids(ruleset_codes, rulesets, category_codes, categories)
+
+        born_codes, borns = self.factorize(born)
+        age_ids = self.get_age_ids(born_codes, borns)
+
+        gender_codes, genders = self.factorize(gender)
+        gender_ids = self.take(
+            [gender_dict.get(elt.lower(), gender_dict.get("O")) or 0 if elt else 0 for elt in genders], gender_codes
+        )
+
+        scheme_codes, schemes = self.factorize(scheme)
+        scheme_ids = self.get_scheme_ids(scheme_codes, schemes)
+
+        location_ids = self.get_location_ids(state, district, ward)
+
+        date_codes, dates = self.factorize(date)
+        days = self.take(
+            [elt.replace(hour=0, minute=0, second=0, microsecond=0) if elt else None for elt in dates], date_codes
+        )
+
+        columns = [flow_result_ids, category_ids, age_ids, gender_ids, scheme_ids, location_ids, days]
+        counter.update(key for key in zip(*columns) if key[0] > 0)
+
+    def count(self, rows):
+        """
+        Returns the poll stats fields counting the given rows, which have the values of the COLUMNS of poll results
+        for the org and flow of the poll, the rows are consumed CHUNK_SIZE at a time so they can be streamed
+        """
+        start = time.time()
+
+        rows = iter(rows)
+        counter = Counter()
+        num_rows = 0
+
+        while True:
+            chunk = list(islice(rows, self.CHUNK_SIZE))
+            if not chunk:
+                break
+
+            self.count_chunk(chunk, counter)
+            num_rows += len(chunk)
+
+        stats_kwargs = []
+        for (flow_result_id, category_id, age_id, gender_id, scheme_id, location_id, day), count in counter.items():
+            stat_kwargs = dict(org_id=self.poll.org_id, flow_result_id=flow_result_id, count=count, date=day)
+            if category_id:
+                stat_kwargs["flow_result_category_id"] = category_id
+            if age_id:
+                stat_kwargs["age_segment_id"] = age_id
+            if gender_id:
+                stat_kwargs["gender_segment_id"] = gender_id
+            if scheme_id:
+                stat_kwargs["scheme_segment_id"] = scheme_id
+            if location_id:
+                stat_kwargs["location_id"] = location_id
+
+            stats_kwargs.append(stat_kwargs)
+
+        logger.info(
+            "Counted %d poll results into %d poll stats for poll #%d on org #%d in %.3fs"
+            % (num_rows, len(stats_kwargs), self.poll.pk, self.poll.org_id, time.time() - start)
+        )
+        return stats_kwargs
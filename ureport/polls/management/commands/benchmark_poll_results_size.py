@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# language=SQL
+SYNTHETIC_RESULTS_SQL = """
+CREATE TEMPORARY TABLE bench_pollresult (LIKE polls_pollresult) ON COMMIT DROP;
+
+INSERT INTO bench_pollresult ("id", "org_id", "flow", "ruleset", "contact", "date", "completed", "category", "text",
+  "state", "district", "ward", "gender", "born", "scheme")
+SELECT
+  r."n",
+  0,
+  md5('flow')::uuid::text,
+  md5('ruleset-' || (r."n" %% %(questions)s))::uuid::text,
+  md5('contact-' || r."contact")::uuid::text,
+  now() - (r."contact" %% 365) * INTERVAL '1 day',
+  TRUE,
+  (ARRAY['Yes', 'No', 'Other'])[1 + r."n" %% 3],
+  CASE
+    WHEN r."n" %% 10 = 0 THEN 'open ended answer number ' || r."n"
+    ELSE (ARRAY['yes', 'no', 'maybe'])[1 + r."n" %% 3]
+  END,
+  'R' || (1000000 + r."contact" %% %(states)s),
+  'R' || (2000000 + r."contact" %% (%(states)s * 10)),
+  'R' || (3000000 + r."contact" %% (%(states)s * 100)),
+  (ARRAY['M', 'F', 'O'])[1 + r."contact" %% 3],
+  1970 + r."contact" %% 40,
+  (ARRAY['tel', 'facebook', 'twitter'])[1 + r."contact" %% 3]
+FROM (SELECT "n", "n" / %(questions)s AS "contact" FROM generate_series(1, %(results)s) AS "n") AS r;
+"""
+
+# language=SQL
+CURRENT_INDEXES_SQL = """
+CREATE UNIQUE INDEX bench_pollresult_pkey ON bench_pollresult ("id", "org_id");
+CREATE UNIQUE INDEX bench_pollresult_org_flow_contact_ruleset
+  ON bench_pollresult ("org_id", "flow", "contact", "ruleset");
+CREATE INDEX bench_pollresult_org_flow ON bench_pollresult ("org_id", "flow");
+CREATE INDEX bench_pollresult_org_flow_contact ON bench_pollresult ("org_id", "flow", "contact");
+CREATE INDEX bench_pollresult_contact ON bench_pollresult ("contact");
+CREATE INDEX bench_pollresult_org_flow_ruleset_text ON bench_pollresult ("org_id", "flow", "ruleset", "text");
+CREATE INDEX bench_pollresult_org_flow_ruleset_with_text ON bench_pollresult ("org_id", "flow", "ruleset")
+  WHERE "text" IS NOT NULL;
+"""
+
+# language=SQL
+COMPACT_RESULTS_SQL = """
+CREATE TEMPORARY TABLE bench_flowresult ON COMMIT DROP AS
+  SELECT ROW_NUMBER() OVER (ORDER BY "ruleset")::integer AS "id", "ruleset" FROM bench_pollresult GROUP BY "ruleset";
+CREATE TEMPORARY TABLE bench_contact ON COMMIT DROP AS
+  SELECT ROW_NUMBER() OVER (ORDER BY "contact")::integer AS "id", "contact" FROM bench_pollresult GROUP BY "contact";
+CREATE TEMPORARY TABLE bench_category ON COMMIT DROP AS
+  SELECT ROW_NUMBER() OVER (ORDER BY "ruleset", "category")::integer AS "id", "ruleset", "category"
+  FROM bench_pollresult GROUP BY "ruleset", "category";
+CREATE TEMPORARY TABLE bench_boundary ON COMMIT DROP AS
+  SELECT ROW_NUMBER() OVER (ORDER BY "osm_id")::integer AS "id", "osm_id" FROM (
+    SELECT "state" AS "osm_id" FROM bench_pollresult UNION SELECT "district" FROM bench_pollresult
+    UNION SELECT "ward" FROM bench_pollresult
+  ) AS b;
+CREATE TEMPORARY TABLE bench_segment ON COMMIT DROP AS
+  SELECT ROW_NUMBER() OVER (ORDER BY "value")::smallint AS "id", "value" FROM (
+    SELECT "gender" AS "value" FROM bench_pollresult UNION SELECT "scheme" FROM bench_pollresult
+  ) AS s;
+
+CREATE INDEX ON bench_flowresult ("ruleset");
+CREATE INDEX ON bench_contact ("contact");
+CREATE INDEX ON bench_category ("ruleset", "category");
+CREATE INDEX ON bench_boundary ("osm_id");
+
+-- widest columns first so the rows need no alignment padding
+CREATE TEMPORARY TABLE bench_pollresult_compact (
+  "date" timestamp with time zone,
+  "id" integer NOT NULL,
+  "org_id" integer NOT NULL,
+  "flow_result_id" integer NOT NULL,
+  "contact_id" integer NOT NULL,
+  "category_id" integer,
+  "state_id" integer,
+  "district_id" integer,
+  "ward_id" integer,
+  "born" smallint,
+  "gender_segment_id" smallint,
+  "scheme_segment_id" smallint,
+  "completed" boolean NOT NULL,
+  "text" text
+) ON COMMIT DROP;
+
+INSERT INTO bench_pollresult_compact
+SELECT r."date", r."id", r."org_id", fr."id", c."id", cat."id", st."id", d."id", w."id", r."born", g."id", sc."id",
+  r."completed", r."text"
+FROM bench_pollresult r
+JOIN bench_flowresult fr ON fr."ruleset" = r."ruleset"
+JOIN bench_contact c ON c."contact" = r."contact"
+LEFT JOIN bench_category cat ON cat."ruleset" = r."ruleset" AND cat."category" = r."category"
+LEFT JOIN bench_boundary st ON st."osm_id" = r."state"
+LEFT JOIN bench_boundary d ON d."osm_id" = r."district"
+LEFT JOIN bench_boundary w ON w."osm_id" = r."ward"
+LEFT JOIN bench_segment g ON g."value" = r."gender"
+LEFT JOIN bench_segment sc ON sc."value" = r."scheme";
+
+CREATE UNIQUE INDEX bench_compact_pkey ON bench_pollresult_compact ("id", "org_id");
+CREATE UNIQUE INDEX bench_compact_org_result_contact
+  ON bench_pollresult_compact ("org_id", "flow_result_id", "contact_id");
+CREATE INDEX bench_compact_org_result ON bench_pollresult_compact ("org_id", "flow_result_id");
+CREATE INDEX bench_compact_contact ON bench_pollresult_compact ("contact_id");
+CREATE INDEX bench_compact_org_result_with_text ON bench_pollresult_compact ("org_id", "flow_result_id")
+  WHERE "text" IS NOT NULL;
+"""
+
+# language=SQL
+RELATION_SIZES_SQL = """
+SELECT c."relname", pg_table_size(c."oid")
+FROM pg_class c
+WHERE c."oid" = %(table)s::regclass
+  OR c."oid" IN (SELECT "indexrelid" FROM pg_index WHERE "indrelid" = %(table)s::regclass)
+ORDER BY c."relkind" DESC, c."relname";
+"""
+
+
+class Command(BaseCommand):
+    help = "Compares the table and index sizes of the poll results of a synthetic org with a compact row format"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--results", type=int, default=1000000, help="The number of results of the synthetic org")
+        parser.add_argument("--questions", type=int, default=10, help="The number of questions each contact answers")
+        parser.add_argument("--states", type=int, default=30, help="The number of states of the synthetic org")
+
+    def get_sizes(self, cursor, table):
+        cursor.execute("ANALYZE %s" % table)
+        cursor.execute(RELATION_SIZES_SQL, dict(table=table))
+        return cursor.fetchall()
+
+    def write_sizes(self, title, sizes, excluded=()):
+        self.stdout.write(title)
+        total = 0
+        for name, size in sizes:
+            if name in excluded:
+                continue
+            total += size
+            self.stdout.write("  %-50s %10.1f MB" % (name, size / 1024 / 1024))
+        self.stdout.write("  %-50s %10.1f MB" % ("total", total / 1024 / 1024))
+        return total
+
+    def handle(self, *args, **options):
+        params = dict(results=options["results"], questions=options["questions"], states=options["states"])
+
+        # everything is created in temporary tables dropped when the transaction ends
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(SYNTHETIC_RESULTS_SQL, params)
+                cursor.execute(CURRENT_INDEXES_SQL)
+                current_sizes = self.get_sizes(cursor, "bench_pollresult")
+
+                cursor.execute(COMPACT_RESULTS_SQL)
+                compact_sizes = self.get_sizes(cursor, "bench_pollresult_compact")
+
+        self.stdout.write("%d results of %d questions" % (options["results"], options["questions"]))
+
+        full_text = self.write_sizes(
+            "Current format with the full text index",
+            current_sizes,
+            excluded=("bench_pollresult_org_flow_ruleset_with_text",),
+        )
+        partial_text = self.write_sizes(
+            "Current format with the partial text index",
+            current_sizes,
+            excluded=("bench_pollresult_org_flow_ruleset_text",),
+        )
+        compact = self.write_sizes("Compact format", compact_sizes)
+
+        self.stdout.write(
+            "Partial text index: %.1f%% smaller, compact format: %.1f%% smaller"
+            % (100 * (1 - partial_text / full_text), 100 * (1 - compact / full_text))
+        )
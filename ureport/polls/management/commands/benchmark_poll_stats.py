@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ureport.polls.models import Poll, PollResult
+
+
+class Command(BaseCommand):
+    help = "Compares the rows per second of the poll stats counting engines for the results of a poll"
+
+    def add_arguments(self, parser):
+        parser.add_argument("poll_id", type=int, help="The id of the poll whose results are counted")
+
+    def count_with_loop(self, poll):
+        lookups = poll.get_poll_stats_lookups()
+
+        stats_dict = defaultdict(int)
+        for result in PollResult.objects.filter(org_id=poll.org_id, flow=poll.flow_uuid).iterator():
+            gen_stats = result.generate_poll_stats()
+            for dict_key in gen_stats.keys():
+                stats_dict[dict_key] += gen_stats[dict_key]
+
+        stats_kwargs = []
+        for stat_tuple, count in stats_dict.items():
+            stat_kwargs = poll.get_poll_stats_kwargs(stat_tuple, count, lookups)
+            if stat_kwargs is not None:
+                stats_kwargs.append(stat_kwargs)
+
+        return stats_kwargs
+
+    def handle(self, *args, **options):
+        poll = Poll.objects.filter(pk=options["poll_id"]).first()
+        if poll is None:
+            raise CommandError("No poll with id %d" % options["poll_id"])
+
+        num_results = PollResult.objects.filter(org_id=poll.org_id, flow=poll.flow_uuid).count()
+        self.stdout.write("Counting %d results of poll #%d on org #%d" % (num_results, poll.pk, poll.org_id))
+
+        engines = [
+            ("per-row loop", self.count_with_loop),
+            ("python counter", Poll.count_poll_stats),
+            ("sql", Poll.aggregate_poll_stats),
+        ]
+
+        for name, count_stats in engines:
+            start = time.time()
+            stats_kwargs = count_stats(poll)
+            duration = time.time() - start
+
+            self.stdout.write(
+                "%-20s %8d stats rows, %10d results counted, %8.2fs, %12.0f rows/s"
+                % (
+                    name,
+                    len(stats_kwargs),
+                    sum(elt["count"] for elt in stats_kwargs),
+                    duration,
+                    num_results / duration if duration else 0,
+                )
+            )
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ureport.polls.models import PollResult
+
+
+class Command(BaseCommand):
+    help = "Moves the poll results of orgs out of the default partition into a partition of their own"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "org_ids", type=int, nargs="*", help="The ids of the orgs to partition, all the orgs if none"
+        )
+        parser.add_argument(
+            "--drop", action="store_true", help="Drop the partitions of the given orgs with all their poll results"
+        )
+
+    def handle(self, *args, **options):
+        if not PollResult.is_partitioned():
+            raise CommandError("The poll results table is not partitioned, run the migrations first")
+
+        org_ids = options["org_ids"]
+
+        if options["drop"]:
+            if not org_ids:
+                raise CommandError("The ids of the orgs whose partitions are dropped are required")
+
+            for org_id in org_ids:
+                if PollResult.drop_org_partition(org_id):
+                    self.stdout.write("Dropped the poll results partition of org #%d" % org_id)
+                else:
+                    self.stdout.write("Org #%d has no poll results partition" % org_id)
+            return
+
+        partitioned_org_ids = set(PollResult.get_partitioned_org_ids())
+        if not org_ids:
+            org_ids = PollResult.get_default_partition_org_ids()
+
+        for org_id in org_ids:
+            if org_id in partitioned_org_ids:
+                self.stdout.write("Org #%d already has a poll results partition" % org_id)
+                continue
+
+            num_moved = PollResult.create_org_partition(org_id)
+            table = PollResult.get_org_partition_table(org_id)
+            self.stdout.write("Moved %d poll results of org #%d to %s" % (num_moved, org_id, table))
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ureport.polls.cold_storage import PollResultsColdStorage
+from ureport.polls.models import Poll
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the stats of polls whose results were cleared from the results exported to the cold storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("poll_ids", type=int, nargs="+", help="The ids of the polls whose stats are rebuilt")
+
+    def handle(self, *args, **options):
+        if PollResultsColdStorage.get_default() is None:
+            raise CommandError("No cold storage configured, set POLL_RESULTS_COLD_STORAGE_DIR")
+
+        for poll in Poll.objects.filter(pk__in=options["poll_ids"]).order_by("pk"):
+            if poll.replay_poll_stats():
+                self.stdout.write("Replayed the stats of poll #%d" % poll.pk)
+            else:
+                self.stdout.write("No exported results for poll #%d" % poll.pk)
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+# language=SQL
+DEDUPLICATE_POLL_RESULTS_SQL = """
+DELETE FROM polls_pollresult WHERE id IN (
+  SELECT id FROM (
+    SELECT id, ROW_NUMBER() OVER (
+      PARTITION BY org_id, flow, contact, ruleset ORDER BY date DESC NULLS LAST, id DESC
+    ) AS row_num
+    FROM polls_pollresult
+  ) AS ranked
+  WHERE ranked.row_num > 1
+);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0072_alter_featuredresponse_created_by_and_more"),
+    ]
+
+    operations = [
+        # keep only the latest result for each contact and ruleset before adding the unique key
+        migrations.RunSQL(DEDUPLICATE_POLL_RESULTS_SQL, migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name="pollresult",
+            unique_together={("org", "flow", "contact", "ruleset")},
+        ),
+    ]
@@ -0,0 +1,82 @@
+from django.db import migrations
+
+from ureport.sql import InstallSQL
+
+# language=SQL
+PARTITION_POLL_RESULTS_SQL = """
+DO $$
+DECLARE
+  _next_id integer;
+  _sequence text;
+  _rec record;
+BEGIN
+  -- the triggers and the functions taking a row of the table are installed again for the partitioned table
+  DROP TRIGGER IF EXISTS ureport_when_poll_result_contact_activities ON polls_pollresult;
+  DROP TRIGGER IF EXISTS ureport_when_poll_results_truncate_then_update_contact_activities ON polls_pollresult;
+  DROP FUNCTION IF EXISTS generate_contact_activities_for_latest_poll_result(polls_pollresult);
+  DROP FUNCTION IF EXISTS ureport_insert_missing_contact_activities(polls_pollresult);
+
+  SELECT COALESCE(MAX(id), 0) + 1 INTO _next_id FROM polls_pollresult;
+  _sequence := pg_get_serial_sequence('polls_pollresult', 'id');
+
+  -- the existing table becomes the default partition with all its rows, no data is copied
+  ALTER TABLE polls_pollresult RENAME TO polls_pollresult_default;
+
+  IF EXISTS (
+    SELECT 1 FROM pg_attribute WHERE attrelid = 'polls_pollresult_default'::regclass AND attname = 'id' AND attidentity <> ''
+  ) THEN
+    ALTER TABLE polls_pollresult_default ALTER COLUMN id DROP IDENTITY;
+  ELSE
+    ALTER TABLE polls_pollresult_default ALTER COLUMN id DROP DEFAULT;
+    EXECUTE format('DROP SEQUENCE IF EXISTS %s', _sequence);
+  END IF;
+
+  -- the primary key of a partitioned table has to include the partition key
+  FOR _rec IN SELECT conname FROM pg_constraint WHERE conrelid = 'polls_pollresult_default'::regclass AND contype = 'p' LOOP
+    EXECUTE format('ALTER TABLE polls_pollresult_default DROP CONSTRAINT %I', _rec.conname);
+  END LOOP;
+
+  CREATE TABLE polls_pollresult (LIKE polls_pollresult_default) PARTITION BY LIST (org_id);
+
+  CREATE SEQUENCE polls_pollresult_id_seq AS integer OWNED BY polls_pollresult.id;
+  PERFORM setval('polls_pollresult_id_seq', _next_id, false);
+  ALTER TABLE polls_pollresult ALTER COLUMN id SET DEFAULT nextval('polls_pollresult_id_seq');
+
+  ALTER TABLE polls_pollresult ADD CONSTRAINT polls_pollresult_pkey PRIMARY KEY (id, org_id);
+
+  -- the unique key, the foreign key and the indexes move to the partitioned table under their names, the ones of the
+  -- default partition are renamed and get attached to them instead of being built again
+  FOR _rec IN
+    SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+    WHERE conrelid = 'polls_pollresult_default'::regclass AND contype IN ('u', 'f')
+  LOOP
+    EXECUTE format(
+      'ALTER TABLE polls_pollresult_default RENAME CONSTRAINT %I TO %I', _rec.conname, left(_rec.conname, 55) || '_default'
+    );
+    EXECUTE format('ALTER TABLE polls_pollresult ADD CONSTRAINT %I %s', _rec.conname, _rec.definition);
+  END LOOP;
+
+  FOR _rec IN
+    SELECT c.relname, pg_get_indexdef(i.indexrelid) AS definition FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = 'polls_pollresult_default'::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE pg_constraint.conindid = i.indexrelid)
+  LOOP
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', _rec.relname, left(_rec.relname, 55) || '_default');
+    EXECUTE regexp_replace(
+      _rec.definition, '^CREATE (UNIQUE )?INDEX \\S+ ON \\S+', format('CREATE \\1INDEX %I ON polls_pollresult', _rec.relname)
+    );
+  END LOOP;
+
+  ALTER TABLE polls_pollresult ATTACH PARTITION polls_pollresult_default DEFAULT;
+END;
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0073_deduplicate_pollresults_and_unique_key"),
+    ]
+
+    operations = [migrations.RunSQL(PARTITION_POLL_RESULTS_SQL), InstallSQL("polls_0074")]
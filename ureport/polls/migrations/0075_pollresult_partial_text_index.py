@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0074_partition_pollresult_by_org"),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name="pollresult",
+            index_together={("org", "flow")},
+        ),
+        migrations.AddIndex(
+            model_name="pollresult",
+            index=models.Index(
+                condition=models.Q(("text__isnull", False)),
+                fields=["org", "flow", "ruleset"],
+                name="polls_pllrslt_org_flw_rlst_txt",
+            ),
+        ),
+    ]
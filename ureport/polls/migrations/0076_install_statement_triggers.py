@@ -0,0 +1,12 @@
+from django.db import migrations
+
+from ureport.sql import InstallSQL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0075_pollresult_partial_text_index"),
+    ]
+
+    operations = [InstallSQL("polls_0076")]
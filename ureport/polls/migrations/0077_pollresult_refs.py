@@ -0,0 +1,100 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contacts", "0028_install_statement_triggers"),
+        ("flows", "0001_initial"),
+        ("locations", "0006_boundary_backend"),
+        ("stats", "0028_partition_pollstats_by_month"),
+        ("polls", "0076_install_statement_triggers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pollresult",
+            name="flow_result",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="flows.flowresult",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollresult",
+            name="contact_ref",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="contacts.contact",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollresult",
+            name="state_boundary",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="locations.boundary",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollresult",
+            name="district_boundary",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="locations.boundary",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollresult",
+            name="ward_boundary",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="locations.boundary",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollresult",
+            name="gender_segment",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="stats.gendersegment",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollresult",
+            name="scheme_segment",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="stats.schemesegment",
+            ),
+        ),
+    ]
@@ -0,0 +1,90 @@
+import time
+
+from django.db import connection, migrations
+
+# language=SQL
+POPULATE_POLL_RESULTS_REFS_SQL = """
+UPDATE polls_pollresult r
+SET "flow_result_id" = (
+        SELECT fr."id" FROM flows_flowresult fr
+        WHERE fr."org_id" = r."org_id" AND fr."flow_uuid" = r."flow" AND LOWER(fr."result_uuid") = LOWER(r."ruleset")
+        LIMIT 1
+    ),
+    "contact_ref_id" = (
+        SELECT c."id" FROM contacts_contact c WHERE c."org_id" = r."org_id" AND c."uuid" = r."contact" LIMIT 1
+    ),
+    "state_boundary_id" = (
+        SELECT b."id" FROM locations_boundary b
+        WHERE b."org_id" = r."org_id" AND UPPER(b."osm_id") = UPPER(r."state") LIMIT 1
+    ),
+    "district_boundary_id" = (
+        SELECT b."id" FROM locations_boundary b
+        WHERE b."org_id" = r."org_id" AND UPPER(b."osm_id") = UPPER(r."district") LIMIT 1
+    ),
+    "ward_boundary_id" = (
+        SELECT b."id" FROM locations_boundary b
+        WHERE b."org_id" = r."org_id" AND UPPER(b."osm_id") = UPPER(r."ward") LIMIT 1
+    ),
+    "gender_segment_id" = (
+        SELECT g."id" FROM stats_gendersegment g WHERE LOWER(g."gender") = LOWER(r."gender") LIMIT 1
+    ),
+    "scheme_segment_id" = (
+        SELECT s."id" FROM stats_schemesegment s WHERE LOWER(s."scheme") = LOWER(r."scheme") LIMIT 1
+    )
+WHERE r."org_id" = %(org_id)s AND r."id" >= %(start)s AND r."id" < %(end)s
+"""
+
+BATCH_SIZE = 10000
+
+
+def noop(apps, schema_editor):  # pragma: no cover
+    pass
+
+
+def populate_poll_results_refs(apps, schema_editor):  # pragma: no cover
+    Org = apps.get_model("orgs", "Org")
+
+    start_time = time.time()
+    count = 0
+
+    for org in Org.objects.all().order_by("id"):
+        print(f"Populating poll results references on org #{org.id}")
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT MIN("id"), MAX("id") FROM polls_pollresult WHERE "org_id" = %(org_id)s', dict(org_id=org.id)
+            )
+            min_id, max_id = cursor.fetchone()
+
+        if min_id is None:
+            continue
+
+        # one transaction per batch of ids so the partition of the org is never locked for the whole backfill
+        for start in range(min_id, max_id + 1, BATCH_SIZE):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    POPULATE_POLL_RESULTS_REFS_SQL, dict(org_id=org.id, start=start, end=start + BATCH_SIZE)
+                )
+                count += cursor.rowcount
+
+            elapsed = time.time() - start_time
+            print(f"Populated references of {count} poll results in {elapsed:.1f} seconds")
+
+        print(f"Finished populating poll results references on org #{org.id}")
+
+
+def apply_manual():  # pragma: no cover
+    from django.apps import apps
+
+    populate_poll_results_refs(apps, None)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("polls", "0077_pollresult_refs"),
+    ]
+
+    operations = [migrations.RunPython(populate_poll_results_refs, noop)]
@@ -3,6 +3,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import json
 import logging
+import time
 import uuid
 from collections import defaultdict
 from datetime import timedelta
@@ -89,6 +90,16 @@ class Poll(SmartModel):
 
     POLL_PULL_RESULTS_TASK_LOCK = "poll-pull-results-task-lock:%s:%s"
 
+    POLL_ARCHIVES_IMPORTED_KEY = "poll-archives-imported:org:%d:flow:%s"
+
+    POLL_ARCHIVES_IMPORTED_TIMEOUT = 60 * 60 * 24 * 30
+
+    POLL_ARCHIVES_PENDING_POLLS_KEY = "poll-archives-pending-polls:org:%d"
+
+    POLL_ARCHIVES_IMPORT_QUEUED_KEY = "poll-archives-import-queued:org:%d"
+
+    POLL_ARCHIVE_FLOWS_CACHE_KEY = "run-archive-flows:%s"
+
     POLL_REBUILD_COUNTS_LOCK = "poll-rebuild-counts-lock:org:%d:poll:%s"
 
     POLL_RESULTS_LAST_PULL_CACHE_KEY = "last:pull_results:reverse:org:%d:poll:%s"
@@ -97,6 +108,10 @@ class Poll(SmartModel):
 
     POLL_RESULTS_MAX_SYNC_RUNS = 100_000
 
+    POLL_RESULTS_PREFETCH_FETCHES = 2
+
+    POLL_STATS_COUNT_CHUNK_SIZE = 10000
+
     POLL_RESULTS_LAST_OTHER_POLLS_SYNCED_CACHE_KEY = "last:poll_last_other_polls_sync:org:%d:poll:%s"
 
     POLL_RESULTS_LAST_OTHER_POLLS_SYNCED_CACHE_TIMEOUT = 60 * 60 * 24 * 2
@@ -185,12 +200,82 @@ class Poll(SmartModel):
         ) = backend.pull_results_from_archives(poll)
 
         if num_val_created + num_val_updated + num_path_created + num_path_updated != 0:
-            poll.rebuild_poll_results_counts()
+            poll.update_poll_results_counts()
 
         Poll.objects.filter(org=poll.org_id, flow_uuid=poll.flow_uuid).update(has_synced=True)
 
         return num_val_created, num_val_updated, num_val_ignored, num_path_created, num_path_updated, num_path_ignored
 
+    @classmethod
+    def pull_org_results_from_archives_task(cls, org_id, poll_ids=(), countdown=0):
+        """
+        Adds the polls to the pending polls of the org archives import and queues the import if it is not queued yet,
+        so an org backfilling many polls reads each archive once for all of them
+        """
+        from ureport.polls.tasks import pull_org_refresh_from_archives
+
+        r = get_redis_connection()
+        if poll_ids:
+            r.sadd(Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % org_id, *poll_ids)
+
+        if r.set(Poll.POLL_ARCHIVES_IMPORT_QUEUED_KEY % org_id, 1, nx=True, ex=Poll.POLL_SYNC_LOCK_TIMEOUT):
+            pull_org_refresh_from_archives.apply_async((org_id,), countdown=countdown, queue="sync")
+
+    @classmethod
+    def pull_org_results_from_archives(cls, org_id):
+        from ureport.polls.tasks import pull_refresh_from_archives
+
+        r = get_redis_connection()
+        pending_key = Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % org_id
+
+        # polls pending from now on queue a new import
+        r.delete(Poll.POLL_ARCHIVES_IMPORT_QUEUED_KEY % org_id)
+
+        org = Org.objects.get(pk=org_id)
+        pending_ids = {int(elt) for elt in r.smembers(pending_key)}
+        polls = Poll.objects.filter(id__in=pending_ids, is_active=True, stopped_syncing=False).select_related(
+            "backend"
+        )
+
+        backends_polls = defaultdict(list)
+        for poll in polls:
+            backends_polls[poll.backend.slug].append(poll)
+
+        # the polls deactivated or stopped since they were queued have nothing to import
+        left_out_ids = pending_ids - {poll.pk for poll in polls}
+        if left_out_ids:
+            r.srem(pending_key, *left_out_ids)
+
+        for backend_slug, backend_polls in backends_polls.items():
+            backend = org.get_backend(backend_slug=backend_slug)
+            if not hasattr(backend, "pull_org_results_from_archives"):
+                for poll in backend_polls:
+                    pull_refresh_from_archives.apply_async((poll.pk,), queue="sync")
+                r.srem(pending_key, *[poll.pk for poll in backend_polls])
+                continue
+
+            flows_stats = backend.pull_org_results_from_archives(org, backend_polls)
+
+            for flow_uuid, flow_stats in flows_stats.items():
+                (
+                    num_val_created,
+                    num_val_updated,
+                    num_val_ignored,
+                    num_path_created,
+                    num_path_updated,
+                    num_path_ignored,
+                ) = flow_stats
+
+                if num_val_created + num_val_updated + num_path_created + num_path_updated != 0:
+                    flow_poll = next(poll for poll in backend_polls if poll.flow_uuid == flow_uuid)
+                    flow_poll.update_poll_results_counts()
+
+                Poll.objects.filter(org=org_id, flow_uuid=flow_uuid).update(has_synced=True)
+
+        # polls of flows still syncing or of a paused import are imported by a later task
+        if r.scard(pending_key):
+            Poll.pull_org_results_from_archives_task(org_id, countdown=300)
+
     @classmethod
     def pull_results(cls, poll_id):
         from ureport.utils import json_date_to_datetime
@@ -206,9 +291,7 @@ class Poll(SmartModel):
         )
 
         if has_archives_results and not poll.has_synced:
-            from ureport.polls.tasks import pull_refresh_from_archives
-
-            pull_refresh_from_archives.apply_async((poll.pk,), queue="sync")
+            Poll.pull_org_results_from_archives_task(poll.org_id, [poll.pk])
 
         (
             num_val_created,
@@ -220,7 +303,7 @@ class Poll(SmartModel):
         ) = backend.pull_results(poll, None, None)
 
         if num_val_created + num_val_updated + num_path_created + num_path_updated != 0:
-            poll.rebuild_poll_results_counts()
+            poll.update_poll_results_counts()
 
         Poll.objects.filter(org=poll.org_id, flow_uuid=poll.flow_uuid).update(has_synced=True)
 
@@ -234,49 +317,46 @@ class Poll(SmartModel):
 
         return latest_synced_obj_time, pull_after_delete
 
-    def delete_poll_stats(self):
+    def delete_poll_stats(self, force=False):
         from ureport.stats.models import PollStats
-        from ureport.utils import chunk_list
+        from ureport.utils import iterate_keyset
 
-        if self.stopped_syncing:
+        if self.stopped_syncing and not force:
             logger.error("Poll cannot delete stats for poll #%d on org #%d" % (self.pk, self.org_id), exc_info=True)
             return
 
-        flow_result_ids = self.questions.all().values_list("flow_result_id", flat=True)
-
-        poll_stats_ids = PollStats.objects.filter(org_id=self.org_id, flow_result_id__in=flow_result_ids)
-        poll_stats_ids = poll_stats_ids.values_list("pk", flat=True)
+        flow_result_ids = list(self.questions.all().values_list("flow_result_id", flat=True))
 
-        poll_stats_ids_count = len(poll_stats_ids)
+        poll_stats = PollStats.objects.filter(org_id=self.org_id, flow_result_id__in=flow_result_ids)
 
-        for batch in chunk_list(poll_stats_ids, 1000):
-            PollStats.objects.filter(pk__in=batch).delete()
+        poll_stats_ids_count = 0
+        for batch in iterate_keyset(poll_stats, 1000, ids_only=True):
+            poll_stats.filter(pk__gte=batch[0], pk__lte=batch[-1]).delete()
+            poll_stats_ids_count += len(batch)
 
         logger.info("Deleted %d poll stats for poll #%d on org #%d" % (poll_stats_ids_count, self.pk, self.org_id))
 
     def delete_poll_results(self):
-        from ureport.utils import chunk_list
-
-        results_ids = PollResult.objects.filter(org_id=self.org_id, flow=self.flow_uuid).values_list("pk", flat=True)
+        from ureport.utils import iterate_keyset
 
-        results_ids_count = len(results_ids)
+        poll_results = PollResult.objects.filter(org_id=self.org_id, flow=self.flow_uuid)
 
-        for batch in chunk_list(results_ids, 1000):
-            PollResult.objects.filter(pk__in=batch).delete()
+        results_ids_count = 0
+        for batch in iterate_keyset(poll_results, 1000, ids_only=True, label="Poll #%d results delete" % self.pk):
+            poll_results.filter(pk__gte=batch[0], pk__lte=batch[-1]).delete()
+            results_ids_count += len(batch)
 
         logger.info("Deleted %d poll results for poll #%d on org #%d" % (results_ids_count, self.pk, self.org_id))
 
         cache.delete(Poll.POLL_PULL_ALL_RESULTS_AFTER_DELETE_FLAG % (self.org_id, self.pk))
         cache.delete(Poll.POLL_RESULTS_LAST_PULL_CACHE_KEY % (self.org.pk, self.flow_uuid))
 
+        # the results of the imported archives are gone, so they are imported again for the flow
+        get_redis_connection().delete(Poll.POLL_ARCHIVES_IMPORTED_KEY % (self.org_id, self.flow_uuid))
+
     def update_questions_results_cache(self):
         for question in self.questions.all():
-            question.calculate_polled()
-            question.calculate_responded()
-            question.calculate_results()
-            question.calculate_results(segment=dict(location="State"))
-            question.calculate_results(segment=dict(age="Age"))
-            question.calculate_results(segment=dict(gender="Gender"))
+            question.calculate_all_results()
 
         self.update_poll_participation_maps_cache()
 
@@ -294,13 +374,7 @@ class Poll(SmartModel):
         if not top_question:
             return
 
-        org = self.org
-        states = org.get_segment_org_boundaries({"location": "State"})
-        for state in states:
-            top_question.calculate_results(segment=dict(location="District", parent=state["osm_id"]))
-            districts = org.get_segment_org_boundaries(dict(location="state", parent=state["osm_id"]))
-            for district in districts:
-                top_question.calculate_results(segment=dict(location="Ward", parent=district["osm_id"]))
+        top_question.calculate_participation_maps_results()
 
     @classmethod
     def pull_poll_results_task(cls, poll):
@@ -335,19 +409,315 @@ class Poll(SmartModel):
                 flow_poll.update_question_word_clouds()
                 flow_poll.update_questions_results_cache()
 
+    def get_poll_stats_lookups(self):
+        """
+        Returns the maps used to resolve the poll results tuples to the ids of the poll stats columns
+        """
+        from ureport.locations.models import Boundary
+        from ureport.stats.models import AgeSegment, GenderSegment, SchemeSegment
+
+        questions = self.questions.all().select_related("flow_result").prefetch_related("response_categories")
+        questions_dict = dict()
+
+        for qsn in questions:
+            categories = qsn.response_categories.all().select_related("flow_result_category")
+            categoryies_dict = {elt.flow_result_category.category.lower(): elt.id for elt in categories}
+            flow_categories_dict = {
+                elt.flow_result_category.category.lower(): elt.flow_result_category.id for elt in categories
+            }
+            questions_dict[qsn.flow_result.result_uuid] = dict(
+                id=qsn.id,
+                flow_result_id=qsn.flow_result_id,
+                categories=categoryies_dict,
+                flow_categories=flow_categories_dict,
+            )
+
+        gender_dict = {elt.gender.lower(): elt.id for elt in GenderSegment.objects.all()}
+        age_dict = {elt.min_age: elt.id for elt in AgeSegment.objects.all()}
+        scheme_dict = {elt.scheme.lower(): elt.id for elt in SchemeSegment.objects.all()}
+
+        boundaries = Boundary.objects.filter(org_id=self.org_id)
+        location_dict = {elt.osm_id.upper(): elt.id for elt in boundaries}
+
+        return dict(
+            questions=questions_dict,
+            genders=gender_dict,
+            ages=age_dict,
+            schemes=scheme_dict,
+            locations=location_dict,
+        )
+
+    def get_poll_stats_kwargs(self, stat_tuple, count, lookups):
+        """
+        Returns the poll stats fields for the given poll results tuple and count, None if the tuple is not for one of
+        the questions of this poll
+        """
+        from ureport.stats.models import AgeSegment, SchemeSegment
+
+        questions_dict = lookups["questions"]
+        gender_dict = lookups["genders"]
+        age_dict = lookups["ages"]
+        scheme_dict = lookups["schemes"]
+        location_dict = lookups["locations"]
+
+        org_id, ruleset, category, born, gender, state, district, ward, scheme, date = stat_tuple
+        stat_kwargs = dict(org_id=org_id, count=count, date=date)
+
+        if ruleset not in questions_dict:
+            return None
+
+        question_id = questions_dict[ruleset].get("id")
+        if not question_id:
+            return None
+
+        flow_result_id = questions_dict[ruleset].get("flow_result_id")
+        if not flow_result_id:
+            return None
+
+        flow_category_id = questions_dict[ruleset].get("flow_categories", dict()).get(category)
+
+        gender_id = None
+        if gender:
+            gender_id = gender_dict.get(gender, gender_dict.get("O"))
+
+        age_id = None
+        if born:
+            age_id = age_dict.get(AgeSegment.get_age_segment_min_age(max(self.poll_date.year - int(born), 0)))
+
+        scheme_id = None
+        if scheme:
+            scheme_id = scheme_dict.get(scheme, None)
+            if scheme_id is None:
+                scheme_obj, created_flag = SchemeSegment.objects.get_or_create(scheme=scheme.lower())
+                scheme_dict[scheme.lower()] = scheme_obj.id
+
+        location_id = None
+        if ward:
+            location_id = location_dict.get(ward)
+        elif district:
+            location_id = location_dict.get(district)
+        elif state:
+            location_id = location_dict.get(state)
+
+        if flow_result_id:
+            stat_kwargs["flow_result_id"] = flow_result_id
+
+        if flow_category_id:
+            stat_kwargs["flow_result_category_id"] = flow_category_id
+
+        if age_id:
+            stat_kwargs["age_segment_id"] = age_id
+        if gender_id:
+            stat_kwargs["gender_segment_id"] = gender_id
+        if scheme_id:
+            stat_kwargs["scheme_segment_id"] = scheme_id
+        if location_id:
+            stat_kwargs["location_id"] = location_id
+
+        return stat_kwargs
+
+    def aggregate_poll_stats(self):
+        """
+        Returns the poll stats fields counting the results of this poll, aggregated by the database with a single
+        GROUP BY over the normalised values of PollResult.get_result_tuple and with the segments and locations ids
+        resolved by joins, so only the aggregated rows are loaded
+        """
+        from ureport.stats.models import AgeSegment, SchemeSegment
+
+        # the age segment is the largest min age not above the age of the contact when the poll was sent
+        age_cases = " ".join(
+            ['WHEN r."age" >= %d THEN %d' % (min_age, min_age) for min_age in reversed(AgeSegment.MIN_AGES)]
+        )
+
+        # language=SQL
+        sql = (
+            """
+        WITH results AS (
+          SELECT
+            LOWER(r."ruleset") AS ruleset,
+            -- the text only decides between keeping an empty category or replacing it with an empty one
+            CASE
+              WHEN r."category" IS NOT NULL AND LOWER(r."category") NOT IN %%(ignored)s THEN LOWER(r."category")
+              ELSE ''
+            END AS category,
+            CASE WHEN r."born" IS NOT NULL AND r."born" <> 0 THEN GREATEST(%%(poll_year)s - r."born", 0) END AS age,
+            LOWER(NULLIF(r."gender", '')) AS gender,
+            UPPER(COALESCE(NULLIF(r."ward", ''), NULLIF(r."district", ''), NULLIF(r."state", ''))) AS osm_id,
+            LOWER(NULLIF(r."scheme", '')) AS scheme,
+            DATE_TRUNC('day', r."date") AS date,
+            COUNT(*) AS count
+          FROM polls_pollresult r
+          WHERE r."org_id" = %%(org_id)s AND r."flow" = %%(flow)s AND r."ruleset" IS NOT NULL AND r."ruleset" <> ''
+          GROUP BY 1, 2, 3, 4, 5, 6, 7
+        ),
+        questions AS (
+          SELECT DISTINCT ON (fr."result_uuid") q."id" AS question_id, q."flow_result_id", fr."result_uuid"
+          FROM polls_pollquestion q INNER JOIN flows_flowresult fr ON fr."id" = q."flow_result_id"
+          WHERE q."poll_id" = %%(poll_id)s
+          ORDER BY fr."result_uuid", q."id" DESC
+        ),
+        categories AS (
+          SELECT c."question_id", LOWER(frc."category") AS category, MAX(frc."id") AS id
+          FROM polls_pollresponsecategory c
+          INNER JOIN flows_flowresultcategory frc ON frc."id" = c."flow_result_category_id"
+          INNER JOIN polls_pollquestion q ON q."id" = c."question_id"
+          WHERE q."poll_id" = %%(poll_id)s
+          GROUP BY 1, 2
+        ),
+        ages AS (SELECT "min_age", MAX("id") AS id FROM stats_agesegment GROUP BY 1),
+        genders AS (SELECT LOWER("gender") AS gender, MAX("id") AS id FROM stats_gendersegment GROUP BY 1),
+        schemes AS (SELECT LOWER("scheme") AS scheme, MAX("id") AS id FROM stats_schemesegment GROUP BY 1),
+        locations AS (
+          SELECT UPPER("osm_id") AS osm_id, MAX("id") AS id FROM locations_boundary
+          WHERE "org_id" = %%(org_id)s GROUP BY 1
+        )
+        SELECT q."flow_result_id", c."id", a."id", g."id", s."id", CASE WHEN s."id" IS NULL THEN r."scheme" END,
+          l."id", r."date", SUM(r."count")
+        FROM results r
+        INNER JOIN questions q ON q."result_uuid" = r."ruleset"
+        LEFT OUTER JOIN categories c ON c."question_id" = q."question_id" AND c."category" = r."category"
+        LEFT OUTER JOIN ages a ON a."min_age" = (CASE %s END)
+        LEFT OUTER JOIN genders g ON g."gender" = r."gender"
+        LEFT OUTER JOIN schemes s ON s."scheme" = r."scheme"
+        LEFT OUTER JOIN locations l ON l."osm_id" = r."osm_id"
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+        """
+            % age_cases
+        )
+
+        params = dict(
+            org_id=self.org_id,
+            flow=self.flow_uuid,
+            poll_id=self.pk,
+            poll_year=self.poll_date.year,
+            ignored=tuple(PollResponseCategory.IGNORED_CATEGORY_RULES),
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        stats_kwargs = []
+        for flow_result_id, category_id, age_id, gender_id, scheme_id, new_scheme, location_id, date, count in rows:
+            if new_scheme:
+                scheme_id = SchemeSegment.objects.get_or_create(scheme=new_scheme)[0].id
+
+            stat_kwargs = dict(org_id=self.org_id, flow_result_id=flow_result_id, count=count, date=date)
+            if category_id:
+                stat_kwargs["flow_result_category_id"] = category_id
+            if age_id:
+                stat_kwargs["age_segment_id"] = age_id
+            if gender_id:
+                stat_kwargs["gender_segment_id"] = gender_id
+            if scheme_id:
+                stat_kwargs["scheme_segment_id"] = scheme_id
+            if location_id:
+                stat_kwargs["location_id"] = location_id
+
+            stats_kwargs.append(stat_kwargs)
+
+        return stats_kwargs
+
+    def count_poll_stats(self):
+        """
+        Returns the poll stats fields counting the results of this poll with PollStatsCounter
+        """
+        from ureport.polls.counters import PollStatsCounter
+
+        poll_results = PollResult.objects.filter(org_id=self.org_id, flow=self.flow_uuid).exclude(ruleset=None)
+        rows = poll_results.values_list(*PollStatsCounter.COLUMNS).iterator(
+            chunk_size=Poll.POLL_STATS_COUNT_CHUNK_SIZE
+        )
+
+        return PollStatsCounter(self).count(rows)
+
+    def get_poll_stats(self):
+        """
+        Returns the poll stats fields counting the results of this poll with the configured rebuild engine
+        """
+        if getattr(settings, "POLL_STATS_REBUILD_ENGINE", "sql") == "python":
+            return self.count_poll_stats()
+        return self.aggregate_poll_stats()
+
+    @classmethod
+    def use_incremental_poll_stats(cls):
+        # the deltas need the previous values of the updated results, which the upsert ingestion never loads
+        return getattr(settings, "POLL_STATS_INCREMENTAL", False) and not getattr(
+            settings, "POLL_RESULTS_UPSERT_INGESTION", False
+        )
+
+    def add_poll_stats_deltas(self, poll_stats_deltas):
+        """
+        Appends the +1/-1 changes of the poll results tuples to the poll stats, to be merged by the stats squash
+        """
+        from ureport.stats.models import PollStats
+
+        lookups = self.get_poll_stats_lookups()
+
+        poll_stats_to_insert = []
+        for stat_tuple, count in poll_stats_deltas.items():
+            if not stat_tuple or count == 0:
+                continue
+
+            stat_kwargs = self.get_poll_stats_kwargs(stat_tuple, count, lookups)
+            if stat_kwargs is not None:
+                poll_stats_to_insert.append(stat_kwargs)
+
+        PollStats.insert_stats(poll_stats_to_insert)
+        return len(poll_stats_to_insert)
+
+    def has_incremental_poll_stats(self):
+        """
+        Whether the stats of this poll are kept up to date with deltas at ingestion, which only some backends emit
+        """
+        if not Poll.use_incremental_poll_stats():
+            return False
+
+        backend = self.org.get_backend(backend_slug=self.backend.slug)
+        return backend.supports_poll_stats_deltas
+
+    def update_poll_results_counts(self):
+        """
+        Brings the poll stats up to date after a sync, the stats are rebuilt unless they are kept up to date with
+        deltas at ingestion, then only the results caches are refreshed
+        """
+        if self.stopped_syncing or not self.has_incremental_poll_stats():
+            self.rebuild_poll_results_counts()
+            return
+
+        self.update_flow_polls_results_cache()
+
+    def update_flow_polls_results_cache(self):
+        import time
+
+        flow_polls = Poll.objects.filter(org_id=self.org_id, flow_uuid=self.flow_uuid, stopped_syncing=False)
+        for flow_poll in flow_polls:
+            start_update_cache = time.time()
+
+            # update the word clouds for questions
+            flow_poll.update_question_word_clouds()
+
+            flow_poll.update_questions_results_cache()
+            logger.info(
+                "Calculated questions results and updated the cache for poll #%d on org #%d in %ds"
+                % (flow_poll.pk, flow_poll.org_id, time.time() - start_update_cache)
+            )
+
+            logger.info(
+                "Poll responses counts for poll #%d on org #%d are %s responded out of %s polled"
+                % (flow_poll.pk, flow_poll.org_id, flow_poll.responded_runs(), flow_poll.runs())
+            )
+
     def rebuild_poll_results_counts(self):
         import time
 
-        from ureport.locations.models import Boundary
-        from ureport.stats.models import AgeSegment, GenderSegment, PollStats, SchemeSegment
-        from ureport.utils import chunk_list
+        from ureport.stats.models import PollStats
 
         start = time.time()
 
         poll_id = self.pk
         org_id = self.org_id
         flow = self.flow_uuid
-        poll_year = self.poll_date.year
 
         if self.stopped_syncing:
             flow_polls = Poll.objects.filter(org_id=org_id, flow_uuid=flow, stopped_syncing=True)
@@ -372,136 +742,56 @@ class Poll(SmartModel):
 
         else:
             with r.lock(key, timeout=Poll.POLL_SYNC_LOCK_TIMEOUT):
-                poll_results_ids = PollResult.objects.filter(org_id=org_id, flow=flow).values_list("pk", flat=True)
-
-                questions = self.questions.all().select_related("flow_result").prefetch_related("response_categories")
-                questions_dict = dict()
-
-                if not questions.exists():
+                if not self.questions.exists():
                     logger.info("Poll cannot sync without questions for poll #%d on org #%d" % (poll_id, org_id))
                     return
 
-                for qsn in questions:
-                    categories = qsn.response_categories.all().select_related("flow_result_category")
-                    categoryies_dict = {elt.flow_result_category.category.lower(): elt.id for elt in categories}
-                    flow_categories_dict = {
-                        elt.flow_result_category.category.lower(): elt.flow_result_category.id for elt in categories
-                    }
-                    questions_dict[qsn.flow_result.result_uuid] = dict(
-                        id=qsn.id,
-                        flow_result_id=qsn.flow_result_id,
-                        categories=categoryies_dict,
-                        flow_categories=flow_categories_dict,
-                    )
-
-                gender_dict = {elt.gender.lower(): elt.id for elt in GenderSegment.objects.all()}
-                age_dict = {elt.min_age: elt.id for elt in AgeSegment.objects.all()}
-                scheme_dict = {elt.scheme.lower(): elt.id for elt in SchemeSegment.objects.all()}
+                poll_stats_to_insert = self.get_poll_stats()
 
-                boundaries = Boundary.objects.filter(org_id=org_id)
-                location_dict = {elt.osm_id.upper(): elt.id for elt in boundaries}
-
-                logger.info("Results query time for pair %s, %s took %ds" % (org_id, flow, time.time() - start))
-
-                processed_results = 0
-                stats_dict = defaultdict(int)
-
-                for batch in chunk_list(poll_results_ids, 1000):
-                    poll_results = list(PollResult.objects.filter(pk__in=batch))
-
-                    for result in poll_results:
-                        gen_stats = result.generate_poll_stats()
-                        for dict_key in gen_stats.keys():
-                            stats_dict[dict_key] += gen_stats[dict_key]
+                logger.info(
+                    "Rebuild counts progress... aggregated %d counters for pair %s, %s in %ds"
+                    % (len(poll_stats_to_insert), org_id, flow, time.time() - start)
+                )
 
-                        processed_results += 1
+                # Delete existing counters and then create new counters
+                self.delete_poll_stats()
 
-                    logger.info(
-                        "Rebuild counts progress... build counters dict for pair %s, %s, processed %d in %ds"
-                        % (org_id, flow, processed_results, time.time() - start)
-                    )
+                PollStats.insert_stats(poll_stats_to_insert)
 
-                poll_stats_obj_to_insert = []
-                for stat_tuple in stats_dict.keys():
-                    org_id, ruleset, category, born, gender, state, district, ward, scheme, date = stat_tuple
-                    count = stats_dict.get(stat_tuple)
-                    stat_kwargs = dict(org_id=org_id, count=count, date=date)
-
-                    if ruleset not in questions_dict:
-                        continue
-
-                    question_id = questions_dict[ruleset].get("id")
-                    if not question_id:
-                        continue
-
-                    flow_result_id = questions_dict[ruleset].get("flow_result_id")
-                    if not flow_result_id:
-                        continue
-
-                    flow_category_id = questions_dict[ruleset].get("flow_categories", dict()).get(category)
-
-                    gender_id = None
-                    if gender:
-                        gender_id = gender_dict.get(gender, gender_dict.get("O"))
-
-                    age_id = None
-                    if born:
-                        age_id = age_dict.get(AgeSegment.get_age_segment_min_age(max(poll_year - int(born), 0)))
-
-                    scheme_id = None
-                    if scheme:
-                        scheme_id = scheme_dict.get(scheme, None)
-                        if scheme_id is None:
-                            scheme_obj, created_flag = SchemeSegment.objects.get_or_create(scheme=scheme.lower())
-                            scheme_dict[scheme.lower()] = scheme_obj.id
-
-                    location_id = None
-                    if ward:
-                        location_id = location_dict.get(ward)
-                    elif district:
-                        location_id = location_dict.get(district)
-                    elif state:
-                        location_id = location_dict.get(state)
-
-                    if flow_result_id:
-                        stat_kwargs["flow_result_id"] = flow_result_id
-
-                    if flow_category_id:
-                        stat_kwargs["flow_result_category_id"] = flow_category_id
-
-                    if age_id:
-                        stat_kwargs["age_segment_id"] = age_id
-                    if gender_id:
-                        stat_kwargs["gender_segment_id"] = gender_id
-                    if scheme_id:
-                        stat_kwargs["scheme_segment_id"] = scheme_id
-                    if location_id:
-                        stat_kwargs["location_id"] = location_id
-
-                    poll_stats_obj_to_insert.append(PollStats(**stat_kwargs))
+                self.update_flow_polls_results_cache()
 
-                # Delete existing counters and then create new counters
-                self.delete_poll_stats()
+    def replay_poll_stats(self):
+        """
+        Rebuilds the stats of a poll whose results were cleared from the results exported to the cold storage, counted
+        with PollStatsCounter. Returns whether the poll had exported results
+        """
+        from ureport.polls.cold_storage import PollResultsColdStorage
+        from ureport.polls.counters import PollStatsCounter
+        from ureport.stats.models import PollStats
 
-                PollStats.objects.bulk_create(poll_stats_obj_to_insert)
+        cold_storage = PollResultsColdStorage.get_default()
+        if cold_storage is None or not cold_storage.exists(self):
+            logger.info("No exported results to replay for poll #%d on org #%d" % (self.pk, self.org_id))
+            return False
 
-                flow_polls = Poll.objects.filter(org_id=org_id, flow_uuid=flow, stopped_syncing=False)
-                for flow_poll in flow_polls:
-                    start_update_cache = time.time()
+        r = get_redis_connection()
+        key = Poll.POLL_REBUILD_COUNTS_LOCK % (self.org_id, self.flow_uuid)
+        with r.lock(key, timeout=Poll.POLL_SYNC_LOCK_TIMEOUT):
+            rows = cold_storage.read_rows(self, PollStatsCounter.COLUMNS)
+            poll_stats_to_insert = PollStatsCounter(self).count(rows)
 
-                    # update the word clouds for questions
-                    flow_poll.update_question_word_clouds()
+            self.delete_poll_stats(force=True)
+            PollStats.insert_stats(poll_stats_to_insert)
 
-                    flow_poll.update_questions_results_cache()
-                    logger.info(
-                        "Calculated questions results and updated the cache for poll #%d on org #%d in %ds"
-                        % (poll_id, org_id, time.time() - start_update_cache)
-                    )
+            # the polls of the flow stopped syncing, so only their results caches are refreshed like in the rebuild
+            for flow_poll in Poll.objects.filter(org_id=self.org_id, flow_uuid=self.flow_uuid, is_active=True):
+                flow_poll.update_questions_results_cache()
 
-                    logger.info(
-                        "Poll responses counts for poll #%d on org #%d are %s responded out of %s polled"
-                        % (poll_id, org_id, flow_poll.responded_runs(), flow_poll.runs())
-                    )
+        logger.info(
+            "Replayed %d counters from the exported results for poll #%d on org #%d"
+            % (len(poll_stats_to_insert), self.pk, self.org_id)
+        )
+        return True
 
     def get_question_uuids(self):
         question_uuids = FlowResult.objects.filter(org=self.org, flow_uuid=self.flow_uuid).values_list(
@@ -728,6 +1018,18 @@ class PollQuestion(SmartModel):
     POLL_QUESTION_RESULTS_CACHE_KEY = "org:%d:poll:%d:question_results:%d"
     POLL_QUESTION_RESULTS_CACHE_TIMEOUT = 60 * 12
 
+    AGE_SEGMENT_LABELS = {0: "0-14", 15: "15-19", 20: "20-24", 25: "25-30", 31: "31-34", 35: "35+"}
+
+    # the poll stats of the question as PollStats.get_question_stats selects them, on the stats_pollstats alias ps
+    QUESTION_STATS_SQL_CONDITION = """
+    ps."org_id" = %(org_id)s AND ps."flow_result_id" = %(flow_result_id)s AND (
+      ps."question_id" = %(question_id)s OR NOT EXISTS (
+        SELECT 1 FROM stats_pollstats q
+        WHERE q."org_id" = %(org_id)s AND q."flow_result_id" = %(flow_result_id)s AND q."question_id" = %(question_id)s
+      )
+    )
+    """
+
     QUESTION_COLOR_CHOICES = (
         (None, "-----"),
         ("D1", _("Dark 1 background and White text")),
@@ -860,11 +1162,7 @@ class PollQuestion(SmartModel):
         )
 
     def get_results(self, segment=None):
-        key = PollQuestion.POLL_QUESTION_RESULTS_CACHE_KEY % (self.poll.org.pk, self.poll.pk, self.pk)
-        if segment:
-            key += ":" + slugify(six.text_type(json.dumps(segment)))
-
-        cached_value = cache.get(key, None)
+        cached_value = cache.get(self.get_results_cache_key(segment), None)
         if cached_value:
             return cached_value["results"]
 
@@ -914,9 +1212,8 @@ class PollQuestion(SmartModel):
             poll_word_cloud.save()
 
     def calculate_results(self, segment=None):
-        from stop_words import safe_get_stop_words
-
-        from ureport.stats.models import AgeSegment, GenderSegment, PollStats, PollWordCloud
+        from ureport.locations.models import Boundary
+        from ureport.stats.models import AgeSegment, GenderSegment, PollStats
 
         org = self.poll.org
         open_ended = self.is_open_ended()
@@ -927,32 +1224,7 @@ class PollQuestion(SmartModel):
         results = []
 
         if open_ended and not segment:
-
-            poll_word_cloud = PollWordCloud.get_question_poll_cloud(org, self)
-
-            unclean_categories = []
-            if poll_word_cloud:
-                unclean_categories = [dict(label=key, count=val) for key, val in poll_word_cloud.words.items()]
-
-            ureport_languages = getattr(settings, "LANGUAGES", [("en", "English")])
-
-            org_languages = [lang[1].lower() for lang in ureport_languages if lang[0] == org.language]
-
-            if "english" not in org_languages:
-                org_languages.append("english")
-
-            ignore_words = [elt.strip().lower() for elt in org.get_config("common.ignore_words", "").split(",")]
-            for lang in org_languages:
-                ignore_words += safe_get_stop_words(lang)
-
-            categories = []
-
-            # sort by count, then alphabetically
-            unclean_categories = sorted(unclean_categories, key=lambda c: (-c["count"], c["label"]))
-
-            for category in unclean_categories:
-                if len(category["label"]) > 1 and category["label"] not in ignore_words and len(categories) < 100:
-                    categories.append(dict(label=strip_tags(category["label"]), count=int(category["count"])))
+            categories = self.get_word_cloud_categories()
 
             results.append(dict(open_ended=open_ended, set=responded, unset=polled - responded, categories=categories))
 
@@ -971,17 +1243,25 @@ class PollQuestion(SmartModel):
 
                     location_boundaries = org.get_segment_org_boundaries(segment)
 
-                    for boundary in location_boundaries:
-                        categories = []
-                        osm_id = boundary.get("osm_id").upper()
+                    location_level = dict(
+                        state=Boundary.STATE_LEVEL, district=Boundary.DISTRICT_LEVEL, ward=Boundary.WARD_LEVEL
+                    )[location_part]
+                    if location_part == "state" and org.get_config("common.is_global"):
+                        location_level = Boundary.COUNTRY_LEVEL
+                    location_field = PollStats.LOCATION_LEVEL_FIELDS.get(location_level)
 
-                        categories_results = (
-                            PollStats.get_question_stats(org.id, self)
-                            .filter(
+                    for boundary in location_boundaries:
+                        if location_field:
+                            boundary_filter = Q(**{location_field: boundary["id"]})
+                        else:
+                            boundary_filter = (
                                 Q(location__id=boundary["id"])
                                 | Q(location__parent__id=boundary["id"])
                                 | Q(location__parent__parent__id=boundary["id"])
                             )
+                        categories_results = (
+                            PollStats.get_question_stats(org.id, self)
+                            .filter(boundary_filter)
                             .exclude(flow_result_category=None)
                             .values("flow_result_category__category")
                             .annotate(label=F("flow_result_category__category"), count=Sum("count"))
@@ -992,52 +1272,19 @@ class PollQuestion(SmartModel):
                         unset_count_stats = (
                             PollStats.get_question_stats(org.id, self)
                             .filter(flow_result_category=None)
-                            .filter(
-                                Q(location__id=boundary["id"])
-                                | Q(location__parent__id=boundary["id"])
-                                | Q(location__parent__parent__id=boundary["id"])
-                            )
+                            .filter(boundary_filter)
                             .aggregate(Sum("count"))
                         )
-                        unset_count = unset_count_stats.get("count__sum", 0) or 0
-
-                        for category_obj in categories_qs:
-                            key = category_obj.flow_result_category.category.lower()
-                            categorie_label = (
-                                category_obj.category_displayed or category_obj.flow_result_category.category
-                            )
-                            if key not in PollResponseCategory.IGNORED_CATEGORY_RULES:
-                                category_count = categories_results_dict.get(key, 0)
-                                categories.append(dict(count=category_count, label=strip_tags(categorie_label)))
-
-                        set_count = sum([elt["count"] for elt in categories])
+                        categories_results_dict[None] = unset_count_stats.get("count__sum", 0) or 0
 
                         results.append(
-                            dict(
-                                open_ended=open_ended,
-                                set=set_count,
-                                unset=unset_count,
-                                boundary=osm_id,
-                                label=strip_tags(boundary.get("name")),
-                                categories=categories,
-                            )
+                            self.get_boundary_results(boundary, categories_results_dict, categories_qs, open_ended)
                         )
                 elif age_part:
                     ages = AgeSegment.objects.all().values("id", "min_age", "max_age")
                     results = []
                     for age in ages:
-                        if age["min_age"] == 0:
-                            data_key = "0-14"
-                        elif age["min_age"] == 15:
-                            data_key = "15-19"
-                        elif age["min_age"] == 20:
-                            data_key = "20-24"
-                        elif age["min_age"] == 25:
-                            data_key = "25-30"
-                        elif age["min_age"] == 31:
-                            data_key = "31-34"
-                        elif age["min_age"] == 35:
-                            data_key = "35+"
+                        data_key = PollQuestion.AGE_SEGMENT_LABELS.get(age["min_age"])
 
                         categories_results = (
                             PollStats.get_question_stats(org.id, self)
@@ -1056,15 +1303,7 @@ class PollQuestion(SmartModel):
                         )
                         unset_count = unset_count_stats.get("count__sum", 0) or 0
 
-                        categories = []
-                        for category_obj in categories_qs:
-                            key = category_obj.flow_result_category.category.lower()
-                            categorie_label = (
-                                category_obj.category_displayed or category_obj.flow_result_category.category
-                            )
-                            if key not in PollResponseCategory.IGNORED_CATEGORY_RULES:
-                                category_count = categories_results_dict.get(key, 0)
-                                categories.append(dict(count=category_count, label=strip_tags(categorie_label)))
+                        categories = self.get_results_categories(categories_qs, categories_results_dict)
 
                         set_count = sum([elt["count"] for elt in categories])
 
@@ -1091,7 +1330,6 @@ class PollQuestion(SmartModel):
                             .values("label", "count")
                         )
                         categories_results_dict = {elt["label"].lower(): elt["count"] for elt in categories_results}
-                        categories = []
 
                         unset_count_stats = (
                             PollStats.get_question_stats(org.id, self)
@@ -1100,14 +1338,7 @@ class PollQuestion(SmartModel):
                         )
                         unset_count = unset_count_stats.get("count__sum", 0) or 0
 
-                        for category_obj in categories_qs:
-                            key = category_obj.flow_result_category.category.lower()
-                            categorie_label = (
-                                category_obj.category_displayed or category_obj.flow_result_category.category
-                            )
-                            if key not in PollResponseCategory.IGNORED_CATEGORY_RULES:
-                                category_count = categories_results_dict.get(key, 0)
-                                categories.append(dict(count=category_count, label=strip_tags(categorie_label)))
+                        categories = self.get_results_categories(categories_qs, categories_results_dict)
 
                         set_count = sum([elt["count"] for elt in categories])
                         results.append(
@@ -1128,26 +1359,312 @@ class PollQuestion(SmartModel):
                     .values("label", "count")
                 )
                 categories_results_dict = {elt["label"].lower(): elt["count"] for elt in categories_results}
-                categories = []
 
-                for category_obj in categories_qs:
-                    key = category_obj.flow_result_category.category.lower()
-                    categorie_label = category_obj.category_displayed or category_obj.flow_result_category.category
-                    if key not in PollResponseCategory.IGNORED_CATEGORY_RULES:
-                        category_count = categories_results_dict.get(key, 0)
-                        categories.append(dict(count=category_count, label=strip_tags(categorie_label)))
+                categories = self.get_results_categories(categories_qs, categories_results_dict)
 
                 results.append(
                     dict(open_ended=open_ended, set=responded, unset=polled - responded, categories=categories)
                 )
 
+        self.set_results_cache(results, segment=segment)
+
+        return results
+
+    def calculate_all_results(self):
+        """
+        Calculates the polled and responded counts and the results overall and by state, age and gender of the
+        question from a single GROUPING SETS query over its poll stats, and fills the same caches as calculate_polled,
+        calculate_responded and calculate_results for these segments
+        """
+        from ureport.locations.models import Boundary
+        from ureport.stats.models import AgeSegment, GenderSegment, PollStats
+
+        org = self.poll.org
+        open_ended = self.is_open_ended()
+        org_gender_labels = org.get_gender_labels()
+
+        location_level = Boundary.COUNTRY_LEVEL if org.get_config("common.is_global") else Boundary.STATE_LEVEL
+
+        # the states are in the ancestry columns of the stats, the countries of global orgs are found with joins
+        state_sql, state_joins_sql = 'ps."state_id"', ""
+        if location_level not in PollStats.LOCATION_LEVEL_FIELDS:
+            state_sql = """
+            CASE
+              WHEN l."level" = %(location_level)s THEN l."id"
+              WHEN p."level" = %(location_level)s THEN p."id"
+              WHEN gp."level" = %(location_level)s THEN gp."id"
+            END"""
+            state_joins_sql = """
+          LEFT OUTER JOIN locations_boundary l ON l."id" = ps."location_id"
+          LEFT OUTER JOIN locations_boundary p ON p."id" = l."parent_id"
+          LEFT OUTER JOIN locations_boundary gp ON gp."id" = p."parent_id"
+            """
+
+        # language=SQL
+        sql = """
+        SELECT
+          LOWER(c."category") AS category,
+          GROUPING(s."age_segment_id", s."gender_segment_id", s."state_id") AS grouping,
+          s."age_segment_id",
+          s."gender_segment_id",
+          s."state_id",
+          SUM(s."count")
+        FROM (
+          SELECT
+            ps."flow_result_category_id",
+            ps."age_segment_id",
+            ps."gender_segment_id",
+            %s AS state_id,
+            ps."count"
+          FROM stats_pollstats ps
+          %s
+          WHERE %s
+        ) s
+        LEFT OUTER JOIN flows_flowresultcategory c ON c."id" = s."flow_result_category_id"
+        GROUP BY GROUPING SETS (
+          (LOWER(c."category")),
+          (LOWER(c."category"), s."age_segment_id"),
+          (LOWER(c."category"), s."gender_segment_id"),
+          (LOWER(c."category"), s."state_id")
+        )
+        """ % (
+            state_sql,
+            state_joins_sql,
+            PollQuestion.QUESTION_STATS_SQL_CONDITION,
+        )
+
+        params = dict(
+            org_id=org.id, flow_result_id=self.flow_result_id, question_id=self.pk, location_level=location_level
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        # the grouping bits are set for the segments a row is not grouped by, (age, gender, state) from high to low
+        overall_counts = defaultdict(int)
+        segments_counts = {0b011: defaultdict(dict), 0b101: defaultdict(dict), 0b110: defaultdict(dict)}
+        for category, grouping, age_segment_id, gender_segment_id, state_id, count in rows:
+            if grouping == 0b111:
+                overall_counts[category] += count
+            elif grouping in segments_counts:
+                segment_id = {0b011: age_segment_id, 0b101: gender_segment_id, 0b110: state_id}[grouping]
+                segments_counts[grouping][segment_id][category] = count
+
+        ages_counts, genders_counts, states_counts = (segments_counts[elt] for elt in (0b011, 0b101, 0b110))
+
+        polled = sum(overall_counts.values())
+        responded = sum(count for category, count in overall_counts.items() if category is not None)
+
+        cache.set(
+            PollQuestion.POLL_QUESTION_POLLED_CACHE_KEY % (org.pk, self.poll.pk, self.pk), {"results": polled}, None
+        )
+        cache.set(
+            PollQuestion.POLL_QUESTION_RESPONDED_CACHE_KEY % (org.pk, self.poll.pk, self.pk),
+            {"results": responded},
+            None,
+        )
+
+        categories_qs = (
+            self.response_categories.filter(is_active=True).select_related("flow_result_category").order_by("pk")
+        )
+
+        if open_ended:
+            categories = self.get_word_cloud_categories()
+        else:
+            categories = self.get_results_categories(categories_qs, overall_counts)
+        results = [dict(open_ended=open_ended, set=responded, unset=polled - responded, categories=categories)]
+        self.set_results_cache(results)
+
+        results = [
+            self.get_boundary_results(boundary, states_counts.get(boundary["id"], dict()), categories_qs, open_ended)
+            for boundary in org.get_segment_org_boundaries(dict(location="State"))
+        ]
+        self.set_results_cache(results, segment=dict(location="State"))
+
+        results = []
+        for age in AgeSegment.objects.all().values("id", "min_age"):
+            counts = ages_counts.get(age["id"], dict())
+            categories = self.get_results_categories(categories_qs, counts)
+            results.append(
+                dict(
+                    set=sum([elt["count"] for elt in categories]),
+                    unset=counts.get(None, 0),
+                    label=PollQuestion.AGE_SEGMENT_LABELS.get(age["min_age"]),
+                    categories=categories,
+                )
+            )
+        results = sorted(results, key=lambda i: i["label"])
+        self.set_results_cache(results, segment=dict(age="Age"))
+
+        genders = GenderSegment.objects.all()
+        if not org.get_config("common.has_extra_gender"):
+            genders = genders.exclude(gender="O")
+
+        results = []
+        for gender in genders.values("gender", "id"):
+            counts = genders_counts.get(gender["id"], dict())
+            categories = self.get_results_categories(categories_qs, counts)
+            results.append(
+                dict(
+                    set=sum([elt["count"] for elt in categories]),
+                    unset=counts.get(None, 0),
+                    label=org_gender_labels.get(gender["gender"]),
+                    categories=categories,
+                )
+            )
+        self.set_results_cache(results, segment=dict(gender="Gender"))
+
+    def calculate_participation_maps_results(self):
+        """
+        Calculates the results of the question for the districts of every state and the wards of every district from
+        a single query of its poll stats by location, rolled up the boundaries tree in memory, and writes all their
+        caches at once
+        """
+        from ureport.locations.models import Boundary
+
+        org = self.poll.org
+        open_ended = self.is_open_ended()
+
+        # language=SQL
+        sql = """
+        SELECT ps."location_id", LOWER(c."category"), SUM(ps."count")
+        FROM stats_pollstats ps
+        LEFT OUTER JOIN flows_flowresultcategory c ON c."id" = ps."flow_result_category_id"
+        WHERE ps."location_id" IS NOT NULL AND %s
+        GROUP BY 1, 2
+        """ % (
+            PollQuestion.QUESTION_STATS_SQL_CONDITION
+        )
+
+        params = dict(org_id=org.id, flow_result_id=self.flow_result_id, question_id=self.pk)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        boundaries = list(org.boundaries.all().values("id", "osm_id", "name", "parent_id", "level", "is_active"))
+        boundaries_by_id = {elt["id"]: elt for elt in boundaries}
+
+        # like the location segments, a boundary counts the stats of its location, its children and grandchildren
+        boundaries_counts = defaultdict(lambda: defaultdict(int))
+        for location_id, category, count in rows:
+            boundary_id = location_id
+            for depth in range(3):
+                if boundary_id is None:
+                    break
+                boundaries_counts[boundary_id][category] += count
+                boundary_id = boundaries_by_id.get(boundary_id, dict()).get("parent_id")
+
+        children = defaultdict(list)
+        for boundary in sorted(boundaries, key=lambda elt: elt["osm_id"]):
+            parent = boundaries_by_id.get(boundary["parent_id"])
+            if parent and boundary["is_active"]:
+                children[(parent["osm_id"], boundary["level"])].append(boundary)
+
+        categories_qs = (
+            self.response_categories.filter(is_active=True).select_related("flow_result_category").order_by("pk")
+        )
+
+        def get_segment_results(parent_osm_id, level):
+            return [
+                self.get_boundary_results(
+                    boundary, boundaries_counts.get(boundary["id"], dict()), categories_qs, open_ended
+                )
+                for boundary in children[(parent_osm_id, level)]
+            ]
+
+        cache_entries = dict()
+        for state in org.get_segment_org_boundaries(dict(location="State")):
+            segment = dict(location="District", parent=state["osm_id"])
+            cache_entries[self.get_results_cache_key(segment)] = {
+                "results": get_segment_results(state["osm_id"], Boundary.DISTRICT_LEVEL)
+            }
+
+            for district in children[(state["osm_id"], Boundary.DISTRICT_LEVEL)]:
+                segment = dict(location="Ward", parent=district["osm_id"])
+                cache_entries[self.get_results_cache_key(segment)] = {
+                    "results": get_segment_results(district["osm_id"], Boundary.WARD_LEVEL)
+                }
+
+        # a single pipeline for all the keys
+        cache.set_many(cache_entries, None)
+
+        return len(cache_entries)
+
+    def get_boundary_results(self, boundary, categories_results_dict, categories_qs, open_ended):
+        """
+        Returns the results of the question for a location segment boundary from the counts by lowered category label,
+        with the unset count under None
+        """
+        categories = self.get_results_categories(categories_qs, categories_results_dict)
+
+        return dict(
+            open_ended=open_ended,
+            set=sum([elt["count"] for elt in categories]),
+            unset=categories_results_dict.get(None, 0),
+            boundary=boundary.get("osm_id").upper(),
+            label=strip_tags(boundary.get("name")),
+            categories=categories,
+        )
+
+    def get_results_categories(self, categories_qs, categories_results_dict):
+        """
+        Returns the public categories of the question with their counts from the given dict of lowered labels
+        """
+        categories = []
+        for category_obj in categories_qs:
+            key = category_obj.flow_result_category.category.lower()
+            categorie_label = category_obj.category_displayed or category_obj.flow_result_category.category
+            if key not in PollResponseCategory.IGNORED_CATEGORY_RULES:
+                category_count = categories_results_dict.get(key, 0)
+                categories.append(dict(count=category_count, label=strip_tags(categorie_label)))
+
+        return categories
+
+    def get_word_cloud_categories(self):
+        from stop_words import safe_get_stop_words
+
+        from ureport.stats.models import PollWordCloud
+
+        org = self.poll.org
+
+        poll_word_cloud = PollWordCloud.get_question_poll_cloud(org, self)
+
+        unclean_categories = []
+        if poll_word_cloud:
+            unclean_categories = [dict(label=key, count=val) for key, val in poll_word_cloud.words.items()]
+
+        ureport_languages = getattr(settings, "LANGUAGES", [("en", "English")])
+
+        org_languages = [lang[1].lower() for lang in ureport_languages if lang[0] == org.language]
+
+        if "english" not in org_languages:
+            org_languages.append("english")
+
+        ignore_words = [elt.strip().lower() for elt in org.get_config("common.ignore_words", "").split(",")]
+        for lang in org_languages:
+            ignore_words += safe_get_stop_words(lang)
+
+        categories = []
+
+        # sort by count, then alphabetically
+        unclean_categories = sorted(unclean_categories, key=lambda c: (-c["count"], c["label"]))
+
+        for category in unclean_categories:
+            if len(category["label"]) > 1 and category["label"] not in ignore_words and len(categories) < 100:
+                categories.append(dict(label=strip_tags(category["label"]), count=int(category["count"])))
+
+        return categories
+
+    def get_results_cache_key(self, segment=None):
         key = PollQuestion.POLL_QUESTION_RESULTS_CACHE_KEY % (self.poll.org.pk, self.poll.pk, self.pk)
         if segment:
             key += ":" + slugify(six.text_type(json.dumps(segment)))
+        return key
 
-        cache.set(key, {"results": results}, None)
-
-        return results
+    def set_results_cache(self, results, segment=None):
+        cache.set(self.get_results_cache_key(segment), {"results": results}, None)
 
     def get_total_summary_data(self):
         cached_results = self.get_results()
@@ -1316,6 +1833,422 @@ class PollResult(models.Model):
 
     scheme = models.CharField(max_length=16, null=True)
 
+    # integer references of the uuid, OSM id and segment columns above, filled on sync for the readers to move to, the
+    # referenced rows can be deleted without touching the results so they are not constrained
+    flow_result = models.ForeignKey(
+        FlowResult, on_delete=models.DO_NOTHING, null=True, db_index=False, db_constraint=False, related_name="+"
+    )
+
+    contact_ref = models.ForeignKey(
+        "contacts.Contact",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        related_name="+",
+    )
+
+    state_boundary = models.ForeignKey(
+        "locations.Boundary",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        related_name="+",
+    )
+
+    district_boundary = models.ForeignKey(
+        "locations.Boundary",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        related_name="+",
+    )
+
+    ward_boundary = models.ForeignKey(
+        "locations.Boundary",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        related_name="+",
+    )
+
+    gender_segment = models.ForeignKey(
+        "stats.GenderSegment",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        related_name="+",
+    )
+
+    scheme_segment = models.ForeignKey(
+        "stats.SchemeSegment",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        related_name="+",
+    )
+
+    BULK_UPDATE_BATCH_SIZE = 1000
+
+    DEFAULT_PARTITION_TABLE = "polls_pollresult_default"
+
+    ORG_PARTITION_TABLE = "polls_pollresult_org_%d"
+
+    COPY_COLUMNS = (
+        "org_id",
+        "flow",
+        "ruleset",
+        "contact",
+        "date",
+        "completed",
+        "category",
+        "text",
+        "state",
+        "district",
+        "ward",
+        "gender",
+        "born",
+        "scheme",
+        "flow_result_id",
+        "contact_ref_id",
+        "state_boundary_id",
+        "district_boundary_id",
+        "ward_boundary_id",
+        "gender_segment_id",
+        "scheme_segment_id",
+    )
+
+    @classmethod
+    def save_new_results(cls, poll_results):
+        """
+        Inserts the given new poll results, with COPY FROM STDIN when the COPY bulk loader is enabled
+        """
+        from ureport.utils import copy_rows, use_copy_bulk_loader
+
+        if not use_copy_bulk_loader():
+            return len(cls.objects.bulk_create(poll_results))
+
+        rows = (tuple(getattr(result, column) for column in cls.COPY_COLUMNS) for result in poll_results)
+        return copy_rows(cls._meta.db_table, cls.COPY_COLUMNS, rows)
+
+    @classmethod
+    def bulk_update_values(cls, poll_results):
+        """
+        Writes the current values of the given poll results back to the database using one set-based
+        UPDATE ... FROM (VALUES ...) statement per batch instead of one UPDATE per row
+        """
+        from ureport.utils import chunk_list
+
+        num_updated = 0
+        for batch in chunk_list(poll_results, cls.BULK_UPDATE_BATCH_SIZE):
+            batch = list(batch)
+
+            params = []
+            for result in batch:
+                params.extend(
+                    [
+                        result.pk,
+                        result.category,
+                        result.text,
+                        result.state,
+                        result.district,
+                        result.ward,
+                        result.date,
+                        result.born,
+                        result.gender,
+                        result.scheme,
+                        result.completed,
+                        result.flow_result_id,
+                        result.contact_ref_id,
+                        result.state_boundary_id,
+                        result.district_boundary_id,
+                        result.ward_boundary_id,
+                        result.gender_segment_id,
+                        result.scheme_segment_id,
+                    ]
+                )
+
+            values_sql = ", ".join(["(%s)" % ", ".join(["%s"] * 18)] * len(batch))
+
+            # the results of a single org only need to be looked up in the partition of that org
+            org_sql = ""
+            org_ids = {result.org_id for result in batch}
+            if len(org_ids) == 1:
+                org_sql = 'AND r."org_id" = %s'
+                params.append(org_ids.pop())
+
+            # language=SQL
+            sql = """
+            UPDATE polls_pollresult AS r SET
+              "category" = v."category",
+              "text" = v."text",
+              "state" = v."state",
+              "district" = v."district",
+              "ward" = v."ward",
+              "date" = v."date"::timestamptz,
+              "born" = v."born"::integer,
+              "gender" = v."gender",
+              "scheme" = v."scheme",
+              "completed" = v."completed"::boolean,
+              "flow_result_id" = v."flow_result_id"::integer,
+              "contact_ref_id" = v."contact_ref_id"::integer,
+              "state_boundary_id" = v."state_boundary_id"::integer,
+              "district_boundary_id" = v."district_boundary_id"::integer,
+              "ward_boundary_id" = v."ward_boundary_id"::integer,
+              "gender_segment_id" = v."gender_segment_id"::integer,
+              "scheme_segment_id" = v."scheme_segment_id"::integer
+            FROM (VALUES %s) AS v("id", "category", "text", "state", "district", "ward", "date", "born", "gender", "scheme", "completed",
+              "flow_result_id", "contact_ref_id", "state_boundary_id", "district_boundary_id", "ward_boundary_id",
+              "gender_segment_id", "scheme_segment_id")
+            WHERE r."id" = v."id"::integer %s
+            """ % (
+                values_sql,
+                org_sql,
+            )
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                num_updated += cursor.rowcount
+
+        return num_updated
+
+    @classmethod
+    def upsert_results(cls, poll_results):
+        """
+        Inserts the given poll results or updates the existing ones for the same (org, flow, contact, ruleset) key
+        using INSERT ... ON CONFLICT, so no lookup of the existing results is needed before saving.
+
+        The database keeps the same rules the sync applies in memory: a value only replaces an existing result when
+        it is newer and changes something, a path (no category) only when it is more than 5 seconds newer, and any
+        result replaces an existing one without a date. Returns the counts of (values inserted, values updated,
+        paths inserted, paths updated), results that lost against the existing ones are neither.
+        """
+        from ureport.utils import chunk_list
+
+        counts = [0, 0, 0, 0]
+        for batch in chunk_list(poll_results, cls.BULK_UPDATE_BATCH_SIZE):
+            batch = list(batch)
+
+            params = []
+            for result in batch:
+                params.extend(
+                    [
+                        result.org_id,
+                        result.flow,
+                        result.ruleset,
+                        result.contact,
+                        result.date,
+                        result.completed,
+                        result.category,
+                        result.text,
+                        result.state,
+                        result.district,
+                        result.ward,
+                        result.gender,
+                        result.born,
+                        result.scheme,
+                        result.flow_result_id,
+                        result.contact_ref_id,
+                        result.state_boundary_id,
+                        result.district_boundary_id,
+                        result.ward_boundary_id,
+                        result.gender_segment_id,
+                        result.scheme_segment_id,
+                    ]
+                )
+
+            values_sql = ", ".join(["(%s)" % ", ".join(["%s"] * 21)] * len(batch))
+
+            key_params = []
+            for result in batch:
+                key_params.extend([result.org_id, result.flow, result.contact, result.ruleset])
+            keys_sql = ", ".join(["(%s, %s, %s, %s)"] * len(batch))
+
+            # xmax can't be read from a partitioned table, so the inserted rows are the ones whose id was not there in
+            # the snapshot of the statement
+            # language=SQL
+            sql = """
+            WITH existing AS (
+              SELECT "id" FROM polls_pollresult WHERE ("org_id", "flow", "contact", "ruleset") IN (VALUES %(keys)s)
+            ), upserted AS (
+            INSERT INTO polls_pollresult AS r ("org_id", "flow", "ruleset", "contact", "date", "completed", "category",
+              "text", "state", "district", "ward", "gender", "born", "scheme", "flow_result_id", "contact_ref_id",
+              "state_boundary_id", "district_boundary_id", "ward_boundary_id", "gender_segment_id",
+              "scheme_segment_id")
+            VALUES %(values)s
+            ON CONFLICT ("org_id", "flow", "contact", "ruleset") DO UPDATE SET
+              "category" = EXCLUDED."category",
+              "text" = EXCLUDED."text",
+              "state" = EXCLUDED."state",
+              "district" = EXCLUDED."district",
+              "ward" = EXCLUDED."ward",
+              "date" = EXCLUDED."date",
+              "born" = EXCLUDED."born",
+              "gender" = EXCLUDED."gender",
+              "scheme" = EXCLUDED."scheme",
+              "completed" = EXCLUDED."completed",
+              "flow_result_id" = EXCLUDED."flow_result_id",
+              "contact_ref_id" = EXCLUDED."contact_ref_id",
+              "state_boundary_id" = EXCLUDED."state_boundary_id",
+              "district_boundary_id" = EXCLUDED."district_boundary_id",
+              "ward_boundary_id" = EXCLUDED."ward_boundary_id",
+              "gender_segment_id" = EXCLUDED."gender_segment_id",
+              "scheme_segment_id" = EXCLUDED."scheme_segment_id"
+            WHERE r."date" IS NULL
+              OR (EXCLUDED."category" IS NULL AND EXCLUDED."date" > r."date" + INTERVAL '5 seconds')
+              OR (
+                EXCLUDED."category" IS NOT NULL
+                AND EXCLUDED."date" > r."date"
+                AND (r."category", r."text", r."state", r."district", r."ward", r."born", r."gender", r."scheme",
+                     r."completed")
+                  IS DISTINCT FROM
+                  (EXCLUDED."category", EXCLUDED."text", EXCLUDED."state", EXCLUDED."district", EXCLUDED."ward",
+                   EXCLUDED."born", EXCLUDED."gender", EXCLUDED."scheme", EXCLUDED."completed")
+              )
+            RETURNING r."id", (r."category" IS NULL) AS "is_path"
+            )
+            SELECT u."id" NOT IN (SELECT "id" FROM existing) AS "inserted", u."is_path" FROM upserted u
+            """ % dict(
+                keys=keys_sql, values=values_sql
+            )
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, key_params + params)
+                for inserted, is_path in cursor.fetchall():
+                    counts[(2 if is_path else 0) + (0 if inserted else 1)] += 1
+
+        return tuple(counts)
+
+    @classmethod
+    def is_partitioned(cls):
+        from ureport.utils import is_partitioned_table
+
+        return is_partitioned_table(cls._meta.db_table)
+
+    @classmethod
+    def get_org_partition_table(cls, org_id):
+        return cls.ORG_PARTITION_TABLE % int(org_id)
+
+    @classmethod
+    def get_partitioned_org_ids(cls):
+        """
+        Returns the ids of the orgs whose results have their own partition
+        """
+        from ureport.utils import get_table_partitions
+
+        prefix = cls.ORG_PARTITION_TABLE.split("%")[0]
+        partitions = get_table_partitions(cls._meta.db_table)
+        return sorted(int(name.replace(prefix, "", 1)) for name in partitions if name.startswith(prefix))
+
+    @classmethod
+    def get_default_partition_org_ids(cls):
+        """
+        Returns the ids of the orgs with results still in the default partition
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT "org_id" FROM %s ORDER BY "org_id"' % cls.DEFAULT_PARTITION_TABLE)
+            return [row[0] for row in cursor.fetchall()]
+
+    @classmethod
+    def create_org_partition(cls, org_id):
+        """
+        Creates the partition of the results of the given org, moving its results out of the default partition.
+        Returns the number of results moved
+        """
+        from ureport.utils import attach_partition_from_default
+
+        start = time.time()
+
+        table = cls.get_org_partition_table(org_id)
+        num_moved = attach_partition_from_default(
+            cls._meta.db_table,
+            table,
+            ("id",) + cls.COPY_COLUMNS,
+            "FOR VALUES IN (%(org_id)s)",
+            '"org_id" = %(org_id)s',
+            dict(org_id=int(org_id)),
+        )
+
+        logger.info(
+            "Moved %d poll results of org #%d to partition %s in %0.3fs"
+            % (num_moved, org_id, table, time.time() - start)
+        )
+        return num_moved
+
+    @classmethod
+    def drop_org_partition(cls, org_id):
+        """
+        Removes all the results of the given org by dropping its partition, returns whether the org had one
+        """
+        from ureport.utils import detach_partition
+
+        table = cls.get_org_partition_table(org_id)
+        if not detach_partition(cls._meta.db_table, table):
+            return False
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE %s" % table)
+
+        logger.info("Dropped partition %s with the poll results of org #%d" % (table, org_id))
+        return True
+
+    @classmethod
+    def get_refs_lookups(cls, org_id, flow_uuid):
+        """
+        Returns the maps used to resolve the rulesets, OSM ids and segments of the results of a flow to their integer
+        references, loaded with a single query
+        """
+        # language=SQL
+        sql = """
+        SELECT 'flow_results', LOWER(fr."result_uuid"), fr."id" FROM flows_flowresult fr
+        WHERE fr."org_id" = %(org_id)s AND fr."flow_uuid" = %(flow)s
+        UNION ALL
+        SELECT 'boundaries', UPPER(b."osm_id"), b."id" FROM locations_boundary b WHERE b."org_id" = %(org_id)s
+        UNION ALL
+        SELECT 'genders', LOWER(g."gender"), g."id" FROM stats_gendersegment g
+        UNION ALL
+        SELECT 'schemes', LOWER(s."scheme"), s."id" FROM stats_schemesegment s
+        """
+
+        lookups = dict(flow_results=dict(), boundaries=dict(), genders=dict(), schemes=dict())
+        with connection.cursor() as cursor:
+            cursor.execute(sql, dict(org_id=org_id, flow=flow_uuid))
+            for lookup, key, ref_id in cursor.fetchall():
+                lookups[lookup][key] = ref_id
+
+        return lookups
+
+    @classmethod
+    def set_results_refs(cls, org_id, flow_uuid, poll_results):
+        """
+        Sets the integer references of the given results of a flow before they are saved
+        """
+        if not poll_results:
+            return
+
+        lookups = cls.get_refs_lookups(org_id, flow_uuid)
+        for poll_result in poll_results:
+            poll_result.set_refs(lookups)
+
+    def set_refs(self, lookups):
+        """
+        Sets the integer references of the ruleset, OSM ids and segments of this result from the maps of
+        get_refs_lookups, the contact reference is set by the sync with the contact of the result
+        """
+        flow_results, boundaries = lookups["flow_results"], lookups["boundaries"]
+
+        self.flow_result_id = flow_results.get(self.ruleset.lower()) if self.ruleset else None
+        self.state_boundary_id = boundaries.get(self.state.upper()) if self.state else None
+        self.district_boundary_id = boundaries.get(self.district.upper()) if self.district else None
+        self.ward_boundary_id = boundaries.get(self.ward.upper()) if self.ward else None
+        self.gender_segment_id = lookups["genders"].get(self.gender.lower()) if self.gender else None
+        self.scheme_segment_id = lookups["schemes"].get(self.scheme.lower()) if self.scheme else None
+
     def get_result_tuple(self):
         if not self.org_id or not self.flow or not self.ruleset:
             return ()
@@ -1380,4 +2313,13 @@ class PollResult(models.Model):
         return generated_stats
 
     class Meta:
-        index_together = [["org", "flow"], ["org", "flow", "ruleset", "text"]]
+        index_together = [["org", "flow"]]
+        unique_together = ("org", "flow", "contact", "ruleset")
+        indexes = [
+            # the word clouds only read the results with a text, which no longer need to be copied in the index
+            models.Index(
+                name="polls_pllrslt_org_flw_rlst_txt",
+                fields=["org", "flow", "ruleset"],
+                condition=Q(text__isnull=False),
+            )
+        ]
@@ -156,8 +156,11 @@ def pull_results_recent_polls(org, since, until):
 
 @org_task("clear-old-poll-results", 60 * 60 * 5)
 def clear_old_poll_results(org, since, until):
+    from .cold_storage import PollResultsColdStorage
     from .models import Poll
 
+    cold_storage = PollResultsColdStorage.get_default()
+
     now = timezone.now()
     r = get_redis_connection()
     syncing_window = now - timedelta(days=365)
@@ -184,6 +187,10 @@ def clear_old_poll_results(org, since, until):
                     poll.rebuild_poll_results_counts()
 
                     if not poll.stopped_syncing:
+                        # keep the results in the cold storage so the stats can still be rebuilt from them
+                        if cold_storage is not None:
+                            cold_storage.export(poll)
+
                         poll.delete_poll_results()
                         Poll.objects.filter(org=org, flow_uuid=poll.flow_uuid).update(stopped_syncing=True)
                         logger.info(
@@ -229,6 +236,13 @@ def pull_refresh_from_archives(poll_id):
     Poll.pull_results_from_archives(poll_id)
 
 
+@app.task(name="polls.pull_org_refresh_from_archives")
+def pull_org_refresh_from_archives(org_id):
+    from .models import Poll
+
+    Poll.pull_org_results_from_archives(org_id)
+
+
 @app.task(name="polls.rebuild_counts")
 def rebuild_counts():
     from .models import Poll
@@ -338,4 +352,7 @@ def polls_stats_squash():
         logger.info("Skipping squashing stats as it is still running")
     else:
         with r.lock(key, timeout=lock_timeout):
-            PollStats.squash()
+            if PollStats.use_batches_squash():
+                PollStats.squash_batches()
+            else:
+                PollStats.squash()
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import gzip
+import json
+import tempfile
 import uuid
 import zoneinfo
 from datetime import datetime, timedelta
+from io import StringIO
 
 import six
+from django_redis import get_redis_connection
 from mock import Mock, patch
 from temba_client.exceptions import TembaRateExceededError
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
 from django.db.models import Sum
 from django.http import HttpRequest
 from django.template import TemplateSyntaxError
@@ -23,10 +30,13 @@ from dash.orgs.models import TaskState
 from dash.tags.models import Tag
 from ureport.flows.models import FlowResultCategory
 from ureport.locations.models import Boundary
+from ureport.polls.cold_storage import PollResultsColdStorage
+from ureport.polls.counters import PollStatsCounter
 from ureport.polls.models import Poll, PollImage, PollQuestion, PollResponseCategory, PollResult
 from ureport.polls.tasks import (
     backfill_poll_results,
     fetch_old_sites_count,
+    polls_stats_squash,
     pull_refresh,
     pull_results_main_poll,
     pull_results_other_polls,
@@ -37,7 +47,15 @@ from ureport.polls.tasks import (
     update_results_age_gender,
 )
 from ureport.polls.templatetags.ureport import question_segmented_results
-from ureport.stats.models import AgeSegment, ContactActivity, GenderSegment, PollStats, PollWordCloud
+from ureport.stats.models import (
+    AgeSegment,
+    ContactActivity,
+    GenderSegment,
+    PollStats,
+    PollWordCloud,
+    SchemeSegment,
+)
+from ureport.stats.tasks import create_poll_stats_partitions
 from ureport.tests import MockTembaClient, TestBackend, UreportTest
 from ureport.utils import datetime_to_json_date, json_date_to_datetime
 
@@ -1185,17 +1203,21 @@ class PollTest(UreportTest):
 
         self.assertFalse(PollResult.objects.filter(org=self.nigeria, flow=poll.flow_uuid))
 
-    @patch("ureport.polls.tasks.pull_refresh_from_archives.apply_async")
+    @patch("ureport.polls.tasks.pull_org_refresh_from_archives.apply_async")
     @patch("ureport.polls.models.Poll.get_flow_date")
     @patch("dash.orgs.models.Org.get_backend")
     @patch("ureport.tests.TestBackend.pull_results")
     def test_poll_pull_results(
-        self, mock_pull_results, mock_get_backend, mock_poll_flow_date, mock_pull_refresh_from_archives_task
+        self, mock_pull_results, mock_get_backend, mock_poll_flow_date, mock_pull_org_refresh_from_archives_task
     ):
         mock_get_backend.return_value = TestBackend(self.rapidpro_backend)
         mock_pull_results.return_value = (1, 2, 3, 4, 5, 6)
         mock_poll_flow_date.return_value = None
 
+        r = get_redis_connection()
+        r.delete(Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % self.nigeria.pk)
+        r.delete(Poll.POLL_ARCHIVES_IMPORT_QUEUED_KEY % self.nigeria.pk)
+
         poll = self.create_poll(self.nigeria, "Poll 1", "flow-uuid", self.education_nigeria, self.admin)
 
         self.assertFalse(poll.has_synced)
@@ -1204,20 +1226,30 @@ class PollTest(UreportTest):
         poll = Poll.objects.get(pk=poll.pk)
         self.assertTrue(poll.has_synced)
 
-        mock_pull_refresh_from_archives_task.assert_called_once_with((poll.pk,), queue="sync")
+        mock_pull_org_refresh_from_archives_task.assert_called_once_with((self.nigeria.pk,), countdown=0, queue="sync")
 
         self.assertEqual(mock_get_backend.call_args[1], {"backend_slug": "rapidpro"})
         mock_pull_results.assert_called_once()
 
-    @patch("ureport.polls.tasks.pull_refresh_from_archives.apply_async")
+        # the other polls of the org join the queued import instead of queueing their own
+        poll2 = self.create_poll(self.nigeria, "Poll 2", "flow-uuid-2", self.education_nigeria, self.admin)
+        Poll.pull_results(poll2.pk)
+
+        mock_pull_org_refresh_from_archives_task.assert_called_once()
+        self.assertEqual(
+            r.smembers(Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % self.nigeria.pk), {b"%d" % poll.pk, b"%d" % poll2.pk}
+        )
+
+    @patch("ureport.polls.tasks.pull_org_refresh_from_archives.apply_async")
     @patch("ureport.polls.models.Poll.get_flow_date")
     @patch("dash.orgs.models.Org.get_backend")
     @patch("ureport.tests.TestBackend.pull_results")
     def test_poll_pull_results_old_flows(
-        self, mock_pull_results, mock_get_backend, mock_poll_flow_date, mock_pull_refresh_from_archives_task
+        self, mock_pull_results, mock_get_backend, mock_poll_flow_date, mock_pull_org_refresh_from_archives_task
     ):
         mock_get_backend.return_value = TestBackend(self.rapidpro_backend)
         mock_pull_results.return_value = (1, 2, 3, 4, 5, 6)
+        get_redis_connection().delete(Poll.POLL_ARCHIVES_IMPORT_QUEUED_KEY % self.nigeria.pk)
 
         mock_poll_flow_date.return_value = datetime_to_json_date(timezone.now() - timedelta(days=88))
         poll = self.create_poll(self.nigeria, "Poll 1", "flow-uuid", self.education_nigeria, self.admin)
@@ -1228,7 +1260,7 @@ class PollTest(UreportTest):
         poll = Poll.objects.get(pk=poll.pk)
         self.assertTrue(poll.has_synced)
 
-        self.assertFalse(mock_pull_refresh_from_archives_task.called)
+        self.assertFalse(mock_pull_org_refresh_from_archives_task.called)
 
         poll.has_synced = False
         poll.save()
@@ -1242,11 +1274,69 @@ class PollTest(UreportTest):
         poll = Poll.objects.get(pk=poll.pk)
         self.assertTrue(poll.has_synced)
 
-        mock_pull_refresh_from_archives_task.assert_called_once_with((poll.pk,), queue="sync")
+        mock_pull_org_refresh_from_archives_task.assert_called_once_with((self.nigeria.pk,), countdown=0, queue="sync")
 
         self.assertEqual(mock_get_backend.call_args[1], {"backend_slug": "rapidpro"})
         mock_pull_results.assert_called_once()
 
+    @patch("ureport.polls.tasks.pull_org_refresh_from_archives.apply_async")
+    @patch("dash.orgs.models.Org.get_backend")
+    @patch("ureport.tests.TestBackend.pull_org_results_from_archives")
+    def test_poll_pull_org_results_from_archives(
+        self, mock_pull_org_results_from_archives, mock_get_backend, mock_pull_org_refresh_from_archives_task
+    ):
+        mock_get_backend.return_value = TestBackend(self.rapidpro_backend)
+
+        r = get_redis_connection()
+        pending_key = Poll.POLL_ARCHIVES_PENDING_POLLS_KEY % self.nigeria.pk
+        r.delete(pending_key)
+        r.delete(Poll.POLL_ARCHIVES_IMPORT_QUEUED_KEY % self.nigeria.pk)
+
+        poll1 = self.create_poll(self.nigeria, "Poll 1", "flow-uuid-1", self.education_nigeria, self.admin)
+        poll2 = self.create_poll(self.nigeria, "Poll 2", "flow-uuid-2", self.education_nigeria, self.admin)
+        poll3 = self.create_poll(self.nigeria, "Poll 3", "flow-uuid-3", self.education_nigeria, self.admin)
+        Poll.objects.filter(pk=poll3.pk).update(stopped_syncing=True)
+
+        Poll.pull_org_results_from_archives_task(self.nigeria.pk, [poll1.pk, poll2.pk, poll3.pk])
+        mock_pull_org_refresh_from_archives_task.assert_called_once_with((self.nigeria.pk,), countdown=0, queue="sync")
+
+        # the backend imports the pending polls still syncing together and clears them when done
+        def pull_org_results_from_archives(org, polls):
+            r.srem(pending_key, *[poll.pk for poll in polls])
+            return {poll.flow_uuid: (1, 0, 0, 0, 0, 1) for poll in polls}
+
+        mock_pull_org_results_from_archives.side_effect = pull_org_results_from_archives
+
+        with patch("ureport.polls.models.Poll.update_poll_results_counts") as mock_update_poll_results_counts:
+            Poll.pull_org_results_from_archives(self.nigeria.pk)
+            self.assertEqual(mock_update_poll_results_counts.call_count, 2)
+
+        self.assertEqual(mock_pull_org_results_from_archives.call_count, 1)
+        org, polls = mock_pull_org_results_from_archives.call_args[0]
+        self.assertEqual(org, self.nigeria)
+        self.assertEqual({poll.pk for poll in polls}, {poll1.pk, poll2.pk})
+
+        self.assertFalse(r.smembers(pending_key))
+        self.assertTrue(Poll.objects.get(pk=poll1.pk).has_synced)
+        self.assertTrue(Poll.objects.get(pk=poll2.pk).has_synced)
+        mock_pull_org_refresh_from_archives_task.assert_called_once()
+
+        # polls left pending by the backend, still syncing or paused, are imported by a later task
+        mock_pull_org_results_from_archives.side_effect = None
+        mock_pull_org_results_from_archives.return_value = dict()
+
+        Poll.pull_org_results_from_archives_task(self.nigeria.pk, [poll1.pk])
+        Poll.pull_org_results_from_archives(self.nigeria.pk)
+
+        self.assertEqual(r.smembers(pending_key), {b"%d" % poll1.pk})
+        mock_pull_org_refresh_from_archives_task.assert_called_with((self.nigeria.pk,), countdown=300, queue="sync")
+
+        # deleting the results of a poll imports its archives again
+        imported_key = Poll.POLL_ARCHIVES_IMPORTED_KEY % (self.nigeria.pk, poll1.flow_uuid)
+        r.sadd(imported_key, "archive-hash")
+        poll1.delete_poll_results()
+        self.assertFalse(r.exists(imported_key))
+
 
 class PollQuestionTest(UreportTest):
     def setUp(self):
@@ -1362,7 +1452,7 @@ class PollQuestionTest(UreportTest):
             org=self.uganda,
             flow=poll1.flow_uuid,
             ruleset=poll_question1.flow_result.result_uuid,
-            contact="contact-3",
+            contact="contact-6",
             date=now,
             category="All responses",
             state="",
@@ -1401,7 +1491,7 @@ class PollQuestionTest(UreportTest):
             org=self.uganda,
             flow=poll1.flow_uuid,
             ruleset=poll_question1.flow_result.result_uuid,
-            contact="contact-5",
+            contact="contact-7",
             date=now,
             category="All responses",
             state="",
@@ -2072,6 +2162,116 @@ class PollQuestionTest(UreportTest):
         self.assertEqual(12, PollStats.objects.all().count())
         self.assertEqual(poll_question1.calculate_results(segment=dict(age="Age")), calculated_results)
 
+    def test_squash_batches_poll_stats(self):
+        poll1 = self.create_poll(self.uganda, "Poll 1", "uuid-1", self.health_uganda, self.admin, featured=True)
+        poll_question1 = self.create_poll_question(self.admin, poll1, "question 1", "uuid-101")
+        yes_category = self.create_poll_response_category(poll_question1, "rule-uuid-1", "Yes")
+
+        now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        def create_stats(count, flow_result_category=None, date=now):
+            return PollStats.objects.create(
+                org=self.uganda,
+                question=poll_question1,
+                flow_result=poll_question1.flow_result,
+                flow_result_category=flow_result_category,
+                date=date,
+                count=count,
+            )
+
+        get_redis_connection().delete(PollStats.LAST_SQUASHED_ID_KEY)
+        PollStats.objects.all().delete()
+
+        self.assertEqual(PollStats.squash_batches(), (0, 0))
+
+        first_stats = create_stats(1)
+        create_stats(2, yes_category.flow_result_category)
+        create_stats(3, yes_category.flow_result_category)
+        create_stats(-1, yes_category.flow_result_category)
+        create_stats(5, date=None)
+        last_stats = create_stats(-1)
+
+        get_redis_connection().set(PollStats.LAST_SQUASHED_ID_KEY, first_stats.id - 1)
+
+        # the first batch merges all the rows of its flow result and date, the rows of the next batch are already
+        # squashed, and the row without date has nothing to be merged with
+        self.assertEqual(PollStats.squash_batches(batch_size=2), (5, 2))
+        self.assertEqual(int(get_redis_connection().get(PollStats.LAST_SQUASHED_ID_KEY)), last_stats.id)
+
+        self.assertEqual(PollStats.objects.filter(is_squashed=True).count(), 2)
+        self.assertEqual(PollStats.objects.filter(date=None).count(), 1)
+        self.assertEqual(PollStats.objects.filter(flow_result_category=None).exclude(date=None).get().count, 0)
+        self.assertEqual(PollStats.objects.get(flow_result_category=yes_category.flow_result_category).count, 4)
+
+        # the squashed rows are not merged again when nothing was added to their sets
+        self.assertEqual(PollStats.squash_batches(), (0, 0))
+        self.assertEqual(PollStats.objects.count(), 3)
+
+        create_stats(2, yes_category.flow_result_category)
+        create_stats(3, date=None)
+
+        self.assertEqual(PollStats.squash_batches(), (4, 2))
+        self.assertEqual(PollStats.objects.count(), 3)
+        self.assertEqual(PollStats.objects.get(flow_result_category=yes_category.flow_result_category).count, 6)
+        self.assertEqual(PollStats.objects.get(date=None).count, 8)
+
+        with self.settings(POLL_STATS_BATCHES_SQUASH=True):
+            with patch("ureport.stats.models.PollStats.squash_batches") as mock_squash_batches:
+                with patch("ureport.stats.models.PollStats.squash") as mock_squash:
+                    polls_stats_squash()
+
+                    mock_squash_batches.assert_called_once_with()
+                    self.assertFalse(mock_squash.called)
+
+    def test_poll_stats_partitions(self):
+        now = timezone.now()
+        last_year = now - timedelta(days=365)
+
+        this_month = PollStats.get_month_partition_bounds(now)[0]
+        next_month = PollStats.get_month_partition_bounds(now)[1]
+        last_year_month = PollStats.get_month_partition_bounds(last_year)[0]
+
+        self.assertEqual(this_month.day, 1)
+        self.assertEqual(
+            PollStats.get_month_partition_table(now),
+            "stats_pollstats_y%04dm%02d" % (this_month.year, this_month.month),
+        )
+
+        PollStats.objects.create(org=self.uganda, date=last_year, count=1)
+        PollStats.objects.create(org=self.uganda, date=now, count=2)
+        PollStats.objects.create(org=self.uganda, date=None, count=3)
+
+        self.assertEqual(PollStats.get_default_partition_months(), [last_year_month, this_month])
+
+        self.assertEqual(
+            PollStats.create_future_partitions(months_ahead=1),
+            [PollStats.get_month_partition_table(now), PollStats.get_month_partition_table(next_month)],
+        )
+        self.assertEqual(PollStats.create_future_partitions(months_ahead=1), [])
+        self.assertEqual(PollStats.get_default_partition_months(), [last_year_month])
+
+        # the stats are still read and written through the model
+        self.assertEqual(PollStats.objects.filter(date__gte=this_month).count(), 1)
+        PollStats.objects.create(org=self.uganda, date=next_month, count=4)
+        self.assertEqual(PollStats.objects.filter(date__gte=this_month).aggregate(Sum("count"))["count__sum"], 6)
+
+        out = StringIO()
+        call_command("partition_poll_stats", stdout=out)
+        self.assertIn("Moved 1 poll stats to %s" % PollStats.get_month_partition_table(last_year), out.getvalue())
+        self.assertEqual(PollStats.get_default_partition_months(), [])
+        self.assertEqual(PollStats.objects.count(), 4)
+
+        out = StringIO()
+        call_command("partition_poll_stats", "--detach", last_year_month.strftime("%Y-%m"), stdout=out)
+        self.assertIn("Detached %s" % PollStats.get_month_partition_table(last_year), out.getvalue())
+        self.assertEqual(PollStats.objects.count(), 3)
+        self.assertFalse(PollStats.detach_month_partition(last_year))
+
+        with patch("ureport.stats.models.PollStats.create_future_partitions") as mock_create_future_partitions:
+            mock_create_future_partitions.return_value = []
+            create_poll_stats_partitions()
+            mock_create_future_partitions.assert_called_once_with()
+
     def test_tasks(self):
         self.org = self.create_org("burundi", zoneinfo.ZoneInfo("Africa/Bujumbura"), self.admin)
 
@@ -2153,7 +2353,7 @@ class PollResultsTest(UreportTest):
     def test_contact_activity(self):
         self.assertFalse(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid"))
 
-        PollResult.objects.create(
+        poll_result = PollResult.objects.create(
             org=self.nigeria,
             flow=self.poll.flow_uuid,
             ruleset=self.poll_question.flow_result.result_uuid,
@@ -2164,15 +2364,8 @@ class PollResultsTest(UreportTest):
 
         self.assertFalse(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid"))
 
-        PollResult.objects.create(
-            org=self.nigeria,
-            flow=self.poll.flow_uuid,
-            ruleset=self.poll_question.flow_result.result_uuid,
-            category="No",
-            date=self.now,
-            contact="contact-uuid",
-            completed=False,
-        )
+        poll_result.category = "No"
+        poll_result.save()
 
         self.assertTrue(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid"))
         self.assertEqual(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid").count(), 12)
@@ -2276,6 +2469,35 @@ class PollResultsTest(UreportTest):
             .exclude(ward=None)
         )
 
+        # results inserted by one statement are processed together, with the values of the last result of a contact
+        PollResult.objects.bulk_create(
+            [
+                PollResult(
+                    org=self.nigeria,
+                    flow=self.poll.flow_uuid,
+                    ruleset=ruleset,
+                    contact="contact-uuid3",
+                    category="Yes",
+                    completed=False,
+                    born=born,
+                    date=self.now,
+                )
+                for ruleset, born in (("ruleset-1", 1990), ("ruleset-2", 2000))
+            ]
+        )
+
+        self.assertEqual(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid3").count(), 12)
+        self.assertEqual(
+            set(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid3").values_list("born", "used")),
+            {(2000, True)},
+        )
+
+        PollResult.objects.filter(org=self.nigeria, contact="contact-uuid3").update(gender="F")
+        self.assertEqual(
+            set(ContactActivity.objects.filter(org=self.nigeria, contact="contact-uuid3").values_list("gender")),
+            {("F",)},
+        )
+
     def test_poll_result_generate_stats(self):
         poll_result1 = PollResult.objects.create(
             org=self.nigeria,
@@ -2352,7 +2574,7 @@ class PollResultsTest(UreportTest):
             org=self.nigeria,
             flow=self.poll.flow_uuid,
             ruleset="other-uuid",
-            contact="contact-uuid",
+            contact="contact-uuid-3",
             category="No Response",
             text="None",
             completed=False,
@@ -2393,7 +2615,7 @@ class PollResultsTest(UreportTest):
             org=self.nigeria,
             flow=self.poll.flow_uuid,
             ruleset="other-uuid",
-            contact="contact-uuid",
+            contact="contact-uuid-4",
             category="Yes",
             text="Yeah",
             completed=False,
@@ -2437,7 +2659,7 @@ class PollResultsTest(UreportTest):
             flow=self.poll.flow_uuid,
             ruleset=self.poll_question.flow_result.result_uuid,
             date=None,
-            contact="contact-uuid",
+            contact="contact-uuid-5",
             completed=False,
         )
 
@@ -2448,6 +2670,340 @@ class PollResultsTest(UreportTest):
             [(self.nigeria.id, self.poll_question.flow_result.result_uuid, "", "", "", "", "", "", "", None)],
         )
 
+    def test_bulk_update_values(self):
+        poll_result1 = PollResult.objects.create(
+            org=self.nigeria,
+            flow=self.poll.flow_uuid,
+            ruleset=self.poll_question.flow_result.result_uuid,
+            contact="contact-uuid",
+            category="Yes",
+            text="Yeah",
+            completed=False,
+            date=self.last_week,
+        )
+        poll_result2 = PollResult.objects.create(
+            org=self.nigeria,
+            flow=self.poll.flow_uuid,
+            ruleset=self.poll_question.flow_result.result_uuid,
+            contact="contact-uuid-2",
+            category="No",
+            text="Nah",
+            completed=False,
+            born=1990,
+            date=self.last_week,
+        )
+        poll_result3 = PollResult.objects.create(
+            org=self.nigeria,
+            flow=self.poll.flow_uuid,
+            ruleset=self.poll_question.flow_result.result_uuid,
+            contact="contact-uuid-3",
+            category="No",
+            text="Nah",
+            completed=False,
+            date=self.last_week,
+        )
+
+        self.assertEqual(PollResult.bulk_update_values([]), 0)
+
+        poll_result1.category = None
+        poll_result1.text = ""
+        poll_result1.state = "R-LAGOS"
+        poll_result1.born = 2000
+        poll_result1.gender = "F"
+        poll_result1.scheme = "tel"
+        poll_result1.completed = True
+        poll_result1.date = self.now
+
+        poll_result2.born = None
+        poll_result2.date = None
+
+        with self.assertNumQueries(1):
+            self.assertEqual(PollResult.bulk_update_values([poll_result1, poll_result2]), 2)
+
+        poll_result1.refresh_from_db()
+        self.assertIsNone(poll_result1.category)
+        self.assertEqual(poll_result1.text, "")
+        self.assertEqual(poll_result1.state, "R-LAGOS")
+        self.assertEqual(poll_result1.born, 2000)
+        self.assertEqual(poll_result1.gender, "F")
+        self.assertEqual(poll_result1.scheme, "tel")
+        self.assertTrue(poll_result1.completed)
+        self.assertEqual(poll_result1.date, self.now)
+
+        poll_result2.refresh_from_db()
+        self.assertEqual(poll_result2.category, "No")
+        self.assertIsNone(poll_result2.born)
+        self.assertIsNone(poll_result2.date)
+
+        # untouched rows are left alone
+        poll_result3.refresh_from_db()
+        self.assertEqual(poll_result3.date, self.last_week)
+
+    def test_upsert_results(self):
+        def build_result(contact, category, text, date):
+            return PollResult(
+                org=self.nigeria,
+                flow=self.poll.flow_uuid,
+                ruleset=self.poll_question.flow_result.result_uuid,
+                contact=contact,
+                category=category,
+                text=text,
+                completed=False,
+                date=date,
+            )
+
+        self.assertEqual(PollResult.upsert_results([]), (0, 0, 0, 0))
+
+        with self.assertNumQueries(1):
+            counts = PollResult.upsert_results(
+                [
+                    build_result("contact-uuid", "Yes", "Yeah", self.last_week),
+                    build_result("contact-uuid-2", None, "", self.last_week),
+                    build_result("contact-uuid-3", "No", "Nah", None),
+                ]
+            )
+        self.assertEqual(counts, (2, 0, 1, 0))
+        self.assertEqual(PollResult.objects.filter(org=self.nigeria).count(), 3)
+
+        counts = PollResult.upsert_results(
+            [
+                # newer value replaces the old one
+                build_result("contact-uuid", "No", "Nah", self.now),
+                # path only a second newer is ignored
+                build_result("contact-uuid-2", None, "", self.last_week + timedelta(seconds=1)),
+                # existing result without a date is always replaced
+                build_result("contact-uuid-3", "Yes", "Yeah", self.last_month),
+            ]
+        )
+        self.assertEqual(counts, (0, 2, 0, 0))
+        self.assertEqual(PollResult.objects.filter(org=self.nigeria).count(), 3)
+
+        self.assertEqual(PollResult.objects.get(contact="contact-uuid").category, "No")
+        self.assertEqual(PollResult.objects.get(contact="contact-uuid-2").date, self.last_week)
+        self.assertEqual(PollResult.objects.get(contact="contact-uuid-3").date, self.last_month)
+
+        counts = PollResult.upsert_results(
+            [
+                # older value is ignored
+                build_result("contact-uuid", "Yes", "Yeah", self.last_week),
+                # same value for a newer run is ignored
+                build_result("contact-uuid-3", "Yes", "Yeah", self.now),
+                # path more than 5 seconds newer replaces the old one
+                build_result("contact-uuid-2", None, "", self.now),
+            ]
+        )
+        self.assertEqual(counts, (0, 0, 0, 1))
+
+        self.assertEqual(PollResult.objects.get(contact="contact-uuid").category, "No")
+        self.assertEqual(PollResult.objects.get(contact="contact-uuid-2").date, self.now)
+        self.assertEqual(PollResult.objects.get(contact="contact-uuid-3").date, self.last_month)
+
+    def test_set_results_refs(self):
+        lagos_boundary = Boundary.objects.create(
+            org=self.nigeria,
+            osm_id="R-LAGOS",
+            name="Lagos",
+            parent=None,
+            level=1,
+            geometry='{"type":"MultiPolygon", "coordinates":[[1, 2]]}',
+        )
+        male_gender = GenderSegment.objects.get(gender="M")
+        scheme_segment = SchemeSegment.objects.create(scheme="tel")
+
+        poll_result = PollResult(
+            org=self.nigeria,
+            flow=self.poll.flow_uuid,
+            ruleset=self.poll_question.flow_result.result_uuid.upper(),
+            contact="contact-uuid",
+            category="Yes",
+            text="Yes",
+            completed=False,
+            date=self.now,
+            state="r-lagos",
+            district="R-UNKNOWN",
+            gender="m",
+            scheme="TEL",
+        )
+        other_result = PollResult(
+            org=self.nigeria, flow=self.poll.flow_uuid, ruleset="other-ruleset", contact="contact-uuid-2"
+        )
+
+        PollResult.set_results_refs(self.nigeria.id, self.poll.flow_uuid, [])
+
+        with self.assertNumQueries(1):
+            PollResult.set_results_refs(self.nigeria.id, self.poll.flow_uuid, [poll_result, other_result])
+
+        self.assertEqual(poll_result.flow_result_id, self.poll_question.flow_result_id)
+        self.assertEqual(poll_result.state_boundary_id, lagos_boundary.id)
+        self.assertIsNone(poll_result.district_boundary_id)
+        self.assertIsNone(poll_result.ward_boundary_id)
+        self.assertEqual(poll_result.gender_segment_id, male_gender.id)
+        self.assertEqual(poll_result.scheme_segment_id, scheme_segment.id)
+
+        self.assertIsNone(other_result.flow_result_id)
+        self.assertIsNone(other_result.state_boundary_id)
+        self.assertIsNone(other_result.gender_segment_id)
+        self.assertIsNone(other_result.scheme_segment_id)
+
+        # the references are written with the results
+        PollResult.upsert_results([poll_result])
+        saved_result = PollResult.objects.get(contact="contact-uuid")
+        self.assertEqual(saved_result.flow_result_id, self.poll_question.flow_result_id)
+        self.assertEqual(saved_result.state_boundary_id, lagos_boundary.id)
+        self.assertEqual(saved_result.gender_segment_id, male_gender.id)
+
+        # and kept when the value is updated
+        saved_result.category = "No"
+        PollResult.bulk_update_values([saved_result])
+        saved_result.refresh_from_db()
+        self.assertEqual(saved_result.category, "No")
+        self.assertEqual(saved_result.scheme_segment_id, scheme_segment.id)
+
+    def test_org_partitions(self):
+        def create_result(org, contact):
+            return PollResult.objects.create(
+                org=org,
+                flow=self.poll.flow_uuid,
+                ruleset=self.poll_question.flow_result.result_uuid,
+                contact=contact,
+                category="Yes",
+                text="Yes",
+                completed=False,
+                date=self.now,
+            )
+
+        self.assertTrue(PollResult.is_partitioned())
+        self.assertEqual(PollResult.get_partitioned_org_ids(), [])
+        self.assertEqual(
+            PollResult.get_org_partition_table(self.nigeria.id), "polls_pollresult_org_%d" % self.nigeria.id
+        )
+
+        create_result(self.nigeria, "contact-uuid")
+        create_result(self.nigeria, "contact-uuid-2")
+        create_result(self.uganda, "contact-uuid")
+
+        self.assertEqual(PollResult.get_default_partition_org_ids(), sorted([self.nigeria.id, self.uganda.id]))
+
+        self.assertEqual(PollResult.create_org_partition(self.nigeria.id), 2)
+        self.assertEqual(PollResult.get_partitioned_org_ids(), [self.nigeria.id])
+        self.assertEqual(PollResult.get_default_partition_org_ids(), [self.uganda.id])
+
+        # the results are still read and written through the model
+        self.assertEqual(PollResult.objects.filter(org=self.nigeria).count(), 2)
+        create_result(self.nigeria, "contact-uuid-3")
+        self.assertEqual(PollResult.objects.filter(org=self.nigeria).count(), 3)
+        self.assertEqual(PollResult.get_default_partition_org_ids(), [self.uganda.id])
+
+        out = StringIO()
+        call_command("partition_poll_results", stdout=out)
+        self.assertIn("Moved 1 poll results of org #%d" % self.uganda.id, out.getvalue())
+        self.assertEqual(PollResult.get_partitioned_org_ids(), sorted([self.nigeria.id, self.uganda.id]))
+        self.assertEqual(PollResult.get_default_partition_org_ids(), [])
+
+        out = StringIO()
+        call_command("partition_poll_results", str(self.nigeria.id), "--drop", stdout=out)
+        self.assertIn("Dropped the poll results partition of org #%d" % self.nigeria.id, out.getvalue())
+        self.assertFalse(PollResult.objects.filter(org=self.nigeria))
+        self.assertEqual(PollResult.objects.filter(org=self.uganda).count(), 1)
+
+        self.assertFalse(PollResult.drop_org_partition(self.nigeria.id))
+
+    def test_cold_storage(self):
+        yes_category = self.create_poll_response_category(self.poll_question, "rule-uuid-1", "Yes")
+
+        for contact, category, text, gender, date in (
+            ("contact-uuid", "Yes", "Yeah", "M", self.last_week),
+            ("contact-uuid-2", "Yes", "Yes", "F", self.last_month),
+            ("contact-uuid-3", None, None, None, None),
+        ):
+            PollResult.objects.create(
+                org=self.nigeria,
+                flow=self.poll.flow_uuid,
+                ruleset=self.poll_question.flow_result.result_uuid,
+                contact=contact,
+                category=category,
+                text=text,
+                gender=gender,
+                born=1990,
+                state="R-LAGOS",
+                completed=True,
+                date=date,
+            )
+
+        expected_rows = list(
+            PollResult.objects.filter(org=self.nigeria, flow=self.poll.flow_uuid)
+            .order_by("id")
+            .values_list(*PollStatsCounter.COLUMNS)
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            cold_storage = PollResultsColdStorage("poll_results", storage=FileSystemStorage(location=directory))
+
+            self.assertFalse(cold_storage.exists(self.poll))
+
+            # results are written and read back in chunks
+            with patch("ureport.polls.cold_storage.PollResultsColdStorage.EXPORT_CHUNK_SIZE", 2):
+                self.assertEqual(cold_storage.export(self.poll), 3)
+
+            self.assertTrue(cold_storage.exists(self.poll))
+            self.assertEqual(
+                cold_storage.get_path(self.poll),
+                "poll_results/org_%d/%s.jsonl.gz" % (self.nigeria.id, self.poll.flow_uuid),
+            )
+
+            with cold_storage.storage.open(cold_storage.get_path(self.poll), "rb") as stored_file:
+                lines = gzip.decompress(stored_file.read()).decode("utf-8").splitlines()
+
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(json.loads(lines[0])["version"], PollResultsColdStorage.VERSION)
+            self.assertEqual(
+                json.loads(lines[1])["columns"]["date"], [self.last_week.isoformat(), self.last_month.isoformat()]
+            )
+            self.assertEqual(json.loads(lines[2])["num_results"], 1)
+
+            self.assertEqual(list(cold_storage.read_rows(self.poll, PollStatsCounter.COLUMNS)), expected_rows)
+
+            # exporting again replaces the previous export
+            self.assertEqual(cold_storage.export(self.poll), 3)
+            self.assertEqual(
+                list(cold_storage.read_rows(self.poll, ("contact",))),
+                [("contact-uuid",), ("contact-uuid-2",), ("contact-uuid-3",)],
+            )
+
+            self.poll.delete_poll_results()
+            Poll.objects.filter(pk=self.poll.pk).update(stopped_syncing=True)
+            self.poll.refresh_from_db()
+
+            with patch("ureport.polls.cold_storage.PollResultsColdStorage.get_default") as mock_get_default:
+                mock_get_default.return_value = None
+                self.assertFalse(self.poll.replay_poll_stats())
+
+                mock_get_default.return_value = cold_storage
+                self.assertTrue(self.poll.replay_poll_stats())
+
+        poll_stats = PollStats.objects.filter(org=self.nigeria, flow_result=self.poll_question.flow_result)
+        self.assertEqual(poll_stats.aggregate(Sum("count"))["count__sum"], 3)
+        self.assertEqual(
+            poll_stats.filter(flow_result_category=yes_category.flow_result_category).aggregate(Sum("count"))[
+                "count__sum"
+            ],
+            2,
+        )
+
+    def test_benchmark_poll_results_size(self):
+        out = StringIO()
+        call_command(
+            "benchmark_poll_results_size", "--results", "500", "--questions", "5", "--states", "3", stdout=out
+        )
+
+        output = out.getvalue()
+        self.assertIn("500 results of 5 questions", output)
+        self.assertIn("Current format with the full text index", output)
+        self.assertIn("bench_pollresult_org_flow_ruleset_text", output)
+        self.assertIn("Compact format", output)
+        self.assertIn("bench_compact_org_result_with_text", output)
+        self.assertIn("Partial text index:", output)
+
     def test_poll_results_stats(self):
         nigeria_boundary = Boundary.objects.create(
             org=self.nigeria,
@@ -2514,6 +3070,9 @@ class PollResultsTest(UreportTest):
         self.assertEqual(poll_stat.flow_result, self.poll_question.flow_result)
         self.assertEqual(poll_stat.flow_result_category, yes_category.flow_result_category)
         self.assertEqual(poll_stat.location, ikeja_boundary)
+        self.assertEqual(poll_stat.state, lagos_boundary)
+        self.assertEqual(poll_stat.district, oyo_boundary)
+        self.assertEqual(poll_stat.ward, ikeja_boundary)
         self.assertEqual(poll_stat.gender_segment, GenderSegment.objects.get(gender="M"))
         self.assertEqual(poll_stat.age_segment, AgeSegment.objects.get(min_age=0))
         self.assertEqual(poll_stat.date, self.now.replace(hour=0, minute=0, second=0, microsecond=0))
@@ -2522,7 +3081,7 @@ class PollResultsTest(UreportTest):
             org=self.nigeria,
             flow=self.poll.flow_uuid,
             ruleset=self.poll_question.flow_result.result_uuid,
-            contact="contact-uuid",
+            contact="contact-uuid-2",
             category="Yes",
             text="Yeah",
             completed=False,
@@ -2560,6 +3119,203 @@ class PollResultsTest(UreportTest):
             [{"count": 1, "label": "Yes"}, {"count": 0, "label": "No"}],
         )
 
+        # the grouped query fills the same caches as the results calculated segment by segment
+        self.poll_question.calculate_all_results()
+
+        self.assertEqual(self.poll_question.get_polled(), 2)
+        self.assertEqual(self.poll_question.get_responded(), 2)
+
+        for segment in [None, dict(location="State"), dict(age="Age"), dict(gender="Gender")]:
+            cached_results = self.poll_question.get_results(segment=segment)
+            self.assertEqual(cached_results, self.poll_question.calculate_results(segment=segment))
+
+        # the participation maps results of all districts and wards are built from one query
+        cache.delete(self.poll_question.get_results_cache_key(dict(location="District", parent="R-LAGOS")))
+        self.assertEqual(self.poll_question.calculate_participation_maps_results(), 2)
+
+        for segment in [dict(location="District", parent="R-LAGOS"), dict(location="Ward", parent="R-OYO")]:
+            cached_results = self.poll_question.get_results(segment=segment)
+            self.assertEqual(cached_results, self.poll_question.calculate_results(segment=segment))
+            self.assertEqual(len(cached_results), 1)
+            self.assertEqual(cached_results[0]["set"], 1)
+
+        self.assertEqual(
+            self.poll_question.get_results(segment=dict(location="State")),
+            [
+                dict(
+                    open_ended=False,
+                    set=1,
+                    unset=0,
+                    boundary="R-LAGOS",
+                    label="Lagos",
+                    categories=[{"count": 1, "label": "Yes"}, {"count": 0, "label": "No"}],
+                )
+            ],
+        )
+
+    def test_aggregate_poll_stats(self):
+        lagos_boundary = Boundary.objects.create(
+            org=self.nigeria,
+            osm_id="R-LAGOS",
+            name="Lagos",
+            parent=None,
+            level=1,
+            geometry='{"type":"MultiPolygon", "coordinates":[[1, 2]]}',
+        )
+        yes_category = self.create_poll_response_category(self.poll_question, uuid.uuid4(), "Yes")
+
+        def create_result(contact, category, text, **kwargs):
+            return PollResult.objects.create(
+                org=self.nigeria,
+                flow=self.poll.flow_uuid,
+                ruleset=kwargs.pop("ruleset", self.poll_question.flow_result.result_uuid),
+                contact=contact,
+                category=category,
+                text=text,
+                completed=False,
+                date=self.now,
+                **kwargs,
+            )
+
+        self.assertEqual(self.poll.aggregate_poll_stats(), [])
+
+        create_result("contact-1", "Yes", "Yeah", gender="M", state="r-lagos", born=self.poll.poll_date.year - 16)
+        create_result("contact-2", "yes", "yes", gender="m", state="R-LAGOS", born=self.poll.poll_date.year - 17)
+        create_result("contact-3", "Other", "Nope", scheme="NEWSCHEME")
+        create_result("contact-4", None, "", district="R-UNKNOWN")
+        create_result("contact-5", "Yes", "Yeah", ruleset="other-ruleset-uuid")
+
+        stats_kwargs = self.poll.aggregate_poll_stats()
+
+        # new schemes get their segment, ignored categories and unknown locations are counted without them
+        scheme_segment = SchemeSegment.objects.get(scheme="newscheme")
+        today = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+        flow_result_id = self.poll_question.flow_result_id
+
+        self.assertEqual(len(stats_kwargs), 3)
+        self.assertIn(
+            dict(
+                org_id=self.nigeria.id,
+                flow_result_id=flow_result_id,
+                flow_result_category_id=yes_category.flow_result_category_id,
+                age_segment_id=AgeSegment.objects.get(min_age=15).id,
+                gender_segment_id=GenderSegment.objects.get(gender="M").id,
+                location_id=lagos_boundary.id,
+                count=2,
+                date=today,
+            ),
+            stats_kwargs,
+        )
+        self.assertIn(
+            dict(
+                org_id=self.nigeria.id,
+                flow_result_id=flow_result_id,
+                scheme_segment_id=scheme_segment.id,
+                count=1,
+                date=today,
+            ),
+            stats_kwargs,
+        )
+        self.assertIn(dict(org_id=self.nigeria.id, flow_result_id=flow_result_id, count=1, date=today), stats_kwargs)
+
+        # the scheme segment exists now, so only the aggregation query runs
+        with self.assertNumQueries(1):
+            self.assertCountEqual(stats_kwargs, self.poll.aggregate_poll_stats())
+
+        self.poll.rebuild_poll_results_counts()
+        self.assertEqual(PollStats.objects.filter(org=self.nigeria).aggregate(Sum("count"))["count__sum"], 4)
+
+        # the Python counter gives the same counts as the database
+        self.assertCountEqual(stats_kwargs, self.poll.count_poll_stats())
+
+        # and so does it when the results are counted over several chunks
+        with patch.object(PollStatsCounter, "CHUNK_SIZE", 2):
+            self.assertCountEqual(stats_kwargs, self.poll.count_poll_stats())
+
+        with self.settings(POLL_STATS_REBUILD_ENGINE="python"):
+            with patch("ureport.polls.models.Poll.aggregate_poll_stats") as mock_aggregate_poll_stats:
+                self.poll.rebuild_poll_results_counts()
+                self.assertFalse(mock_aggregate_poll_stats.called)
+
+        self.assertEqual(PollStats.objects.filter(org=self.nigeria).aggregate(Sum("count"))["count__sum"], 4)
+
+        out = StringIO()
+        call_command("benchmark_poll_stats", self.poll.pk, stdout=out)
+        self.assertIn("Counting 5 results of poll #%d" % self.poll.pk, out.getvalue())
+        self.assertEqual(out.getvalue().count(" 4 results counted"), 3)
+
+    def test_add_poll_stats_deltas(self):
+        yes_category = self.create_poll_response_category(self.poll_question, uuid.uuid4(), "Yes")
+        no_category = self.create_poll_response_category(self.poll_question, uuid.uuid4(), "No")
+
+        def build_result(category, text):
+            return PollResult(
+                org=self.nigeria,
+                flow=self.poll.flow_uuid,
+                ruleset=self.poll_question.flow_result.result_uuid,
+                contact="contact-uuid",
+                category=category,
+                text=text,
+                completed=False,
+                gender="M",
+                date=self.now,
+            )
+
+        self.assertEqual(self.poll.add_poll_stats_deltas(dict()), 0)
+
+        yes_tuple = build_result("Yes", "Yeah").get_result_tuple()
+        no_tuple = build_result("No", "Nah").get_result_tuple()
+
+        self.assertEqual(self.poll.add_poll_stats_deltas({yes_tuple: 2}), 1)
+
+        # a result changing category moves its count, unchanged tuples are skipped
+        self.assertEqual(self.poll.add_poll_stats_deltas({yes_tuple: -1, no_tuple: 1, tuple(): 1}), 2)
+        self.assertEqual(
+            self.poll.add_poll_stats_deltas({build_result("Maybe", "Hmm").get_result_tuple(): 0}),
+            0,
+        )
+
+        self.assertEqual(PollStats.objects.filter(flow_result=self.poll_question.flow_result).count(), 3)
+        self.assertEqual(
+            PollStats.objects.filter(flow_result_category=yes_category.flow_result_category).aggregate(Sum("count"))[
+                "count__sum"
+            ],
+            1,
+        )
+        self.assertEqual(
+            PollStats.objects.filter(flow_result_category=no_category.flow_result_category).aggregate(Sum("count"))[
+                "count__sum"
+            ],
+            1,
+        )
+        self.assertEqual(
+            PollStats.objects.filter(gender_segment=GenderSegment.objects.get(gender="M")).count(),
+            3,
+        )
+
+        with self.settings(POLL_STATS_INCREMENTAL=True, POLL_RESULTS_UPSERT_INGESTION=False):
+            self.assertTrue(Poll.use_incremental_poll_stats())
+
+            with patch("ureport.polls.models.Poll.rebuild_poll_results_counts") as mock_rebuild_counts:
+                with patch("ureport.polls.models.Poll.update_flow_polls_results_cache") as mock_update_cache:
+                    self.poll.update_poll_results_counts()
+
+                    self.assertFalse(mock_rebuild_counts.called)
+                    mock_update_cache.assert_called_once_with()
+
+            # the stats of the polls whose backend does not emit deltas are still rebuilt
+            with patch.object(TestBackend, "supports_poll_stats_deltas", False):
+                self.assertFalse(self.poll.has_incremental_poll_stats())
+
+                with patch("ureport.polls.models.Poll.rebuild_poll_results_counts") as mock_rebuild_counts:
+                    self.poll.update_poll_results_counts()
+                    mock_rebuild_counts.assert_called_once_with()
+
+        with self.settings(POLL_STATS_INCREMENTAL=True, POLL_RESULTS_UPSERT_INGESTION=True):
+            self.assertFalse(Poll.use_incremental_poll_stats())
+
+        self.assertFalse(Poll.use_incremental_poll_stats())
+
 
 class PollsTasksTest(UreportTest):
     def setUp(self):
@@ -1056,6 +1056,11 @@ CELERY_BEAT_SCHEDULE = {
         "relative": True,
         "options": {"queue": "slow"},
     },
+    "create-poll-stats-partitions": {
+        "task": "stats.create_poll_stats_partitions",
+        "schedule": crontab(hour=1, minute=0),
+        "options": {"queue": "slow"},
+    },
 }
 
 # -----------------------------------------------------------------------------------
@@ -1064,6 +1069,36 @@ CELERY_BEAT_SCHEDULE = {
 UREPORT_DEFAULT_PRIMARY_COLOR = "#FFD100"
 UREPORT_DEFAULT_SECONDARY_COLOR = "#1F49BF"
 
+# -----------------------------------------------------------------------------------
+# Poll results sync
+# -----------------------------------------------------------------------------------
+
+# save synced poll results with INSERT ... ON CONFLICT instead of looking up the existing results first
+POLL_RESULTS_UPSERT_INGESTION = False
+
+# keep the poll stats up to date with the deltas of each synced batch instead of rebuilding them after every sync,
+# the nightly rebuild still repairs the stats, not supported with the upsert ingestion
+POLL_STATS_INCREMENTAL = False
+
+# how the poll stats are counted when rebuilt, "sql" aggregates them in the database and "python" counts them with
+# PollStatsCounter, reading the results in chunks
+POLL_STATS_REBUILD_ENGINE = "sql"
+
+# squash the poll stats added since the last squash with a GROUP BY per batch of ids instead of one statement per set
+POLL_STATS_BATCHES_SQUASH = False
+
+# load new poll results and rebuilt poll stats with COPY FROM STDIN instead of multi-row INSERTs
+USE_COPY_BULK_LOADER = False
+
+# directory where downloaded run archives are cached for all the sync workers of the host, disabled when not set
+ARCHIVES_CACHE_DIR = None
+
+# max total size in bytes of the cached archives, the least recently used are evicted first
+ARCHIVES_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+# directory of the default file storage where the results of old polls are exported before being cleared, so their
+# stats can be replayed from them later, the results are cleared without export when not set
+POLL_RESULTS_COLD_STORAGE_DIR = None
 
 # -----------------------------------------------------------------------------------
 # non org urls
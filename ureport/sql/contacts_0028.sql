@@ -0,0 +1,112 @@
+-----------------------------------------------------------------------------
+-- Reporters counter types of a contact, same as the ones of ureport_increment_counter_for_contact
+-----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION ureport_reporters_counter_types(_contact contacts_contact)
+RETURNS SETOF TEXT AS $$
+  SELECT t."type" FROM UNNEST(ARRAY[
+    'total-reporters',
+    'gender:' || LOWER(_contact.gender),
+    'born:' || LOWER(CAST(_contact.born AS VARCHAR)),
+    'occupation:' || LOWER(_contact.occupation),
+    'registered_on:' || CAST(DATE(_contact.registered_on) AS VARCHAR),
+    'registered_gender:' || CAST(DATE(_contact.registered_on) AS VARCHAR) || ':' || LOWER(_contact.gender),
+    'registered_born:' || CAST(DATE(_contact.registered_on) AS VARCHAR) || ':' || LOWER(CAST(_contact.born AS VARCHAR)),
+    'registered_state:' || CAST(DATE(_contact.registered_on) AS VARCHAR) || ':' || UPPER(_contact.state),
+    'registered_scheme:' || CAST(DATE(_contact.registered_on) AS VARCHAR) || ':' || LOWER(_contact.scheme),
+    'state:' || UPPER(_contact.state),
+    'district:' || UPPER(_contact.district),
+    'ward:' || UPPER(_contact.ward),
+    'scheme:' || LOWER(_contact.scheme)
+  ]) AS t("type")
+  WHERE _contact.org_id IS NOT NULL AND t."type" IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+
+-----------------------------------------------------------------------------
+-- Reporters counters deltas of a contact update, same as the ones of ureport_adjust_counter_for_contact
+-----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION ureport_reporters_counter_deltas(_new_contact contacts_contact, _old_contact contacts_contact)
+RETURNS TABLE("org_id" INT, "type" TEXT, "delta" INT) AS $$
+  -- no org id or activity change, count all the reporters counters for the previous values
+  SELECT _old_contact.org_id, t."type", CASE WHEN _new_contact.org_id IS NOT NULL AND _new_contact.is_active THEN 1 ELSE -1 END
+  FROM ureport_reporters_counter_types(_old_contact) AS t("type")
+  WHERE _new_contact.org_id IS NULL OR _new_contact.is_active != _old_contact.is_active
+  UNION ALL
+  -- same org, move the counters of the changed values
+  SELECT _new_contact.org_id, d."type", d."delta"
+  FROM (VALUES
+    (CASE WHEN _new_contact.gender != _old_contact.gender THEN 'gender:' || LOWER(_old_contact.gender) END, -1),
+    (CASE WHEN _new_contact.gender != _old_contact.gender THEN 'gender:' || LOWER(_new_contact.gender) END, 1),
+    (CASE WHEN _new_contact.born != _old_contact.born THEN 'born:' || LOWER(CAST(_old_contact.born AS VARCHAR)) END, -1),
+    (CASE WHEN _new_contact.born != _old_contact.born THEN 'born:' || LOWER(CAST(_new_contact.born AS VARCHAR)) END, 1),
+    (CASE WHEN _new_contact.occupation != _old_contact.occupation THEN 'occupation:' || LOWER(_old_contact.occupation) END, -1),
+    (CASE WHEN _new_contact.occupation != _old_contact.occupation THEN 'occupation:' || LOWER(_new_contact.occupation) END, 1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on THEN 'registered_on:' || CAST(DATE(_old_contact.registered_on) AS VARCHAR) END, -1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on THEN 'registered_on:' || CAST(DATE(_new_contact.registered_on) AS VARCHAR) END, 1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.gender != _old_contact.gender THEN 'registered_gender:' || CAST(DATE(_old_contact.registered_on) AS VARCHAR) || ':' || LOWER(_old_contact.gender) END, -1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.gender != _old_contact.gender THEN 'registered_gender:' || CAST(DATE(_new_contact.registered_on) AS VARCHAR) || ':' || LOWER(_new_contact.gender) END, 1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.born != _old_contact.born THEN 'registered_born:' || CAST(DATE(_old_contact.registered_on) AS VARCHAR) || ':' || LOWER(CAST(_old_contact.born AS VARCHAR)) END, -1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.born != _old_contact.born THEN 'registered_born:' || CAST(DATE(_new_contact.registered_on) AS VARCHAR) || ':' || LOWER(CAST(_new_contact.born AS VARCHAR)) END, 1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.state != _old_contact.state THEN 'registered_state:' || CAST(DATE(_old_contact.registered_on) AS VARCHAR) || ':' || UPPER(_old_contact.state) END, -1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.state != _old_contact.state THEN 'registered_state:' || CAST(DATE(_new_contact.registered_on) AS VARCHAR) || ':' || UPPER(_new_contact.state) END, 1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.scheme != _old_contact.scheme THEN 'registered_scheme:' || CAST(DATE(_old_contact.registered_on) AS VARCHAR) || ':' || LOWER(_old_contact.scheme) END, -1),
+    (CASE WHEN _new_contact.registered_on != _old_contact.registered_on AND _new_contact.scheme != _old_contact.scheme THEN 'registered_scheme:' || CAST(DATE(_new_contact.registered_on) AS VARCHAR) || ':' || LOWER(_new_contact.scheme) END, 1),
+    (CASE WHEN _new_contact.state != _old_contact.state THEN 'state:' || UPPER(_old_contact.state) END, -1),
+    (CASE WHEN _new_contact.state != _old_contact.state THEN 'state:' || UPPER(_new_contact.state) END, 1),
+    (CASE WHEN _new_contact.district != _old_contact.district THEN 'district:' || UPPER(_old_contact.district) END, -1),
+    (CASE WHEN _new_contact.district != _old_contact.district THEN 'district:' || UPPER(_new_contact.district) END, 1),
+    (CASE WHEN _new_contact.ward != _old_contact.ward THEN 'ward:' || UPPER(_old_contact.ward) END, -1),
+    (CASE WHEN _new_contact.ward != _old_contact.ward THEN 'ward:' || UPPER(_new_contact.ward) END, 1),
+    (CASE WHEN _new_contact.scheme != _old_contact.scheme THEN 'scheme:' || LOWER(_old_contact.scheme) END, -1),
+    (CASE WHEN _new_contact.scheme != _old_contact.scheme THEN 'scheme:' || LOWER(_new_contact.scheme) END, 1)
+  ) AS d("type", "delta")
+  WHERE _new_contact.org_id IS NOT NULL AND _new_contact.is_active = _old_contact.is_active
+    AND _new_contact.org_id = _old_contact.org_id AND d."type" IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+
+-----------------------------------------------------------------------------
+-- Updates our reporters counters once per statement, with one row per org and counter type changed by the statement
+-----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION ureport_update_counters_for_statement() RETURNS TRIGGER AS $$
+BEGIN
+  -- Contacts being created, increment counters for the contacts in new_contacts
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO contacts_reporterscounter("org_id", "type", "count")
+    SELECT n.org_id, t."type", COUNT(*)
+    FROM new_contacts n CROSS JOIN LATERAL ureport_reporters_counter_types(ROW(n.*)::contacts_contact) AS t("type")
+    GROUP BY n.org_id, t."type";
+  -- Contacts changed, adjust the counters with the deltas of each contact
+  ELSIF TG_OP = 'UPDATE' THEN
+    INSERT INTO contacts_reporterscounter("org_id", "type", "count")
+    SELECT d.org_id, d."type", SUM(d."delta")
+    FROM old_contacts o JOIN new_contacts n ON n.id = o.id
+    CROSS JOIN LATERAL ureport_reporters_counter_deltas(ROW(n.*)::contacts_contact, ROW(o.*)::contacts_contact) AS d
+    GROUP BY d.org_id, d."type"
+    HAVING SUM(d."delta") != 0;
+  -- Contacts being deleted, decrement all reporters counters for their values
+  ELSIF TG_OP = 'DELETE' THEN
+    INSERT INTO contacts_reporterscounter("org_id", "type", "count")
+    SELECT o.org_id, t."type", -COUNT(*)
+    FROM old_contacts o CROSS JOIN LATERAL ureport_reporters_counter_types(ROW(o.*)::contacts_contact) AS t("type")
+    GROUP BY o.org_id, t."type";
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replace the trigger on INSERT DELETE OR UPDATE on contacts_contact, a trigger with transition tables has one event
+DROP TRIGGER IF EXISTS ureport_when_contacts_update_then_update_counters on contacts_contact;
+
+DROP TRIGGER IF EXISTS ureport_when_contacts_insert_then_update_counters ON contacts_contact;
+CREATE TRIGGER ureport_when_contacts_insert_then_update_counters
+  AFTER INSERT ON contacts_contact REFERENCING NEW TABLE AS new_contacts
+  FOR EACH STATEMENT EXECUTE PROCEDURE ureport_update_counters_for_statement();
+
+DROP TRIGGER IF EXISTS ureport_when_contacts_updated_then_update_counters ON contacts_contact;
+CREATE TRIGGER ureport_when_contacts_updated_then_update_counters
+  AFTER UPDATE ON contacts_contact REFERENCING OLD TABLE AS old_contacts NEW TABLE AS new_contacts
+  FOR EACH STATEMENT EXECUTE PROCEDURE ureport_update_counters_for_statement();
+
+DROP TRIGGER IF EXISTS ureport_when_contacts_delete_then_update_counters ON contacts_contact;
+CREATE TRIGGER ureport_when_contacts_delete_then_update_counters
+  AFTER DELETE ON contacts_contact REFERENCING OLD TABLE AS old_contacts
+  FOR EACH STATEMENT EXECUTE PROCEDURE ureport_update_counters_for_statement();
@@ -0,0 +1,46 @@
+-----------------------------------------------------------------------------
+-- Updates our contact activities once per statement, with the latest result of each contact changed by the statement
+-----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION ureport_update_contact_activities_for_statement() RETURNS TRIGGER AS $$
+BEGIN
+  -- Insert the missing activities of the 12 months from the month of each result
+  INSERT INTO stats_contactactivity(contact, date, org_id)
+  SELECT DISTINCT r.contact, month_days.missing_month, r.org_id
+  FROM new_results r
+  CROSS JOIN LATERAL (
+    SELECT generate_series(date_trunc('month', r.date)::timestamp,(date_trunc('month', r.date)::timestamp+ interval '11 months')::date,interval '1 month')::date
+  ) AS month_days(missing_month)
+  WHERE r.org_id IS NOT NULL AND r.flow IS NOT NULL AND r.ruleset IS NOT NULL AND r.category IS NOT NULL
+    AND NOT EXISTS (
+      SELECT 1 FROM stats_contactactivity a
+      WHERE a.org_id = r.org_id AND a.contact = r.contact AND a.date = month_days.missing_month
+    )
+  ON CONFLICT (org_id, contact, date) DO NOTHING;
+
+  -- Copy the values of the last result of each contact to its activities of the last year
+  UPDATE stats_contactactivity a SET born = r.born, gender = r.gender, state = r.state, district = r.district, ward = r.ward, scheme = r.scheme, used = TRUE
+  FROM (
+    SELECT DISTINCT ON (n.org_id, n.contact) n.org_id, n.contact, n.born, n.gender, n.state, n.district, n.ward, n.scheme
+    FROM new_results n
+    WHERE n.org_id IS NOT NULL AND n.flow IS NOT NULL AND n.ruleset IS NOT NULL AND n.category IS NOT NULL
+    ORDER BY n.org_id, n.contact, n.id DESC
+  ) r
+  WHERE a.org_id = r.org_id AND a.contact = r.contact AND a.date > date_trunc('month', CURRENT_DATE) - INTERVAL '1 year';
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replace the trigger for INSERT, UPDATE, AND DELETE on polls_pollresult, a trigger with transition tables has one
+-- event and is only fired on the partitioned table, with the rows of all its partitions
+DROP TRIGGER IF EXISTS ureport_when_poll_result_contact_activities on polls_pollresult;
+
+DROP TRIGGER IF EXISTS ureport_when_poll_results_insert_then_update_contact_activities ON polls_pollresult;
+CREATE TRIGGER ureport_when_poll_results_insert_then_update_contact_activities
+  AFTER INSERT ON polls_pollresult REFERENCING NEW TABLE AS new_results
+  FOR EACH STATEMENT EXECUTE PROCEDURE ureport_update_contact_activities_for_statement();
+
+DROP TRIGGER IF EXISTS ureport_when_poll_results_update_then_update_contact_activities ON polls_pollresult;
+CREATE TRIGGER ureport_when_poll_results_update_then_update_contact_activities
+  AFTER UPDATE ON polls_pollresult REFERENCING NEW TABLE AS new_results
+  FOR EACH STATEMENT EXECUTE PROCEDURE ureport_update_contact_activities_for_statement();
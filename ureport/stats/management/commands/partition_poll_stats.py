@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ureport.stats.models import PollStats
+from ureport.utils import is_partitioned_table
+
+
+class Command(BaseCommand):
+    help = "Moves the dated poll stats out of the default partition into monthly partitions and creates the next ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--detach", nargs="+", metavar="YYYY-MM", help="Detach the partitions of the given months to archive them"
+        )
+
+    def handle(self, *args, **options):
+        if not is_partitioned_table(PollStats._meta.db_table):
+            raise CommandError("The poll stats table is not partitioned, run the migrations first")
+
+        if options["detach"]:
+            for value in options["detach"]:
+                try:
+                    month = datetime.strptime(value, "%Y-%m").replace(tzinfo=timezone.utc)
+                except ValueError:
+                    raise CommandError("Invalid month %s, expected YYYY-MM" % value)
+
+                table = PollStats.get_month_partition_table(month)
+                if PollStats.detach_month_partition(month):
+                    self.stdout.write("Detached %s" % table)
+                else:
+                    self.stdout.write("No partition %s" % table)
+            return
+
+        for month in PollStats.get_default_partition_months():
+            num_moved = PollStats.create_month_partition(month)
+            self.stdout.write("Moved %d poll stats to %s" % (num_moved, PollStats.get_month_partition_table(month)))
+
+        for table in PollStats.create_future_partitions():
+            self.stdout.write("Created %s" % table)
@@ -0,0 +1,74 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# language=SQL
+POPULATE_POLLSTATS_LOCATION_ANCESTRY_SQL = """
+UPDATE stats_pollstats s SET
+  "state_id" = CASE WHEN l."level" = 1 THEN l."id" WHEN p."level" = 1 THEN p."id" WHEN gp."level" = 1 THEN gp."id" END,
+  "district_id" = CASE WHEN l."level" = 2 THEN l."id" WHEN p."level" = 2 THEN p."id" WHEN gp."level" = 2 THEN gp."id" END,
+  "ward_id" = CASE WHEN l."level" = 3 THEN l."id" WHEN p."level" = 3 THEN p."id" WHEN gp."level" = 3 THEN gp."id" END
+FROM locations_boundary l
+LEFT OUTER JOIN locations_boundary p ON p."id" = l."parent_id"
+LEFT OUTER JOIN locations_boundary gp ON gp."id" = p."parent_id"
+WHERE l."id" = s."location_id";
+"""
+
+# language=SQL
+INDEX_SQL_POLLSTATS_ORG_STATE_RESULT_DATE = """
+CREATE INDEX IF NOT EXISTS stats_pollstats_org_state_result_date on stats_pollstats (org_id, state_id, flow_result_id, date) WHERE state_id IS NOT NULL;
+"""
+
+# language=SQL
+INDEX_SQL_POLLSTATS_ORG_DISTRICT_RESULT_DATE = """
+CREATE INDEX IF NOT EXISTS stats_pollstats_org_district_result_date on stats_pollstats (org_id, district_id, flow_result_id, date) WHERE district_id IS NOT NULL;
+"""
+
+# language=SQL
+INDEX_SQL_POLLSTATS_ORG_WARD_RESULT_DATE = """
+CREATE INDEX IF NOT EXISTS stats_pollstats_org_ward_result_date on stats_pollstats (org_id, ward_id, flow_result_id, date) WHERE ward_id IS NOT NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("locations", "0006_boundary_backend"),
+        ("stats", "0026_populate_flow_result_word_clouds"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pollstats",
+            name="state",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="locations.boundary",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollstats",
+            name="district",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="locations.boundary",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pollstats",
+            name="ward",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="locations.boundary",
+            ),
+        ),
+        migrations.RunSQL(POPULATE_POLLSTATS_LOCATION_ANCESTRY_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(INDEX_SQL_POLLSTATS_ORG_STATE_RESULT_DATE, ""),
+        migrations.RunSQL(INDEX_SQL_POLLSTATS_ORG_DISTRICT_RESULT_DATE, ""),
+        migrations.RunSQL(INDEX_SQL_POLLSTATS_ORG_WARD_RESULT_DATE, ""),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+# language=SQL
+PARTITION_POLL_STATS_SQL = """
+DO $$
+DECLARE
+  _next_id bigint;
+  _sequence text;
+  _rec record;
+BEGIN
+  SELECT COALESCE(MAX(id), 0) + 1 INTO _next_id FROM stats_pollstats;
+  _sequence := pg_get_serial_sequence('stats_pollstats', 'id');
+
+  -- the existing table becomes the default partition with all its rows, no data is copied
+  ALTER TABLE stats_pollstats RENAME TO stats_pollstats_default;
+
+  IF EXISTS (
+    SELECT 1 FROM pg_attribute WHERE attrelid = 'stats_pollstats_default'::regclass AND attname = 'id' AND attidentity <> ''
+  ) THEN
+    ALTER TABLE stats_pollstats_default ALTER COLUMN id DROP IDENTITY;
+  ELSE
+    ALTER TABLE stats_pollstats_default ALTER COLUMN id DROP DEFAULT;
+    EXECUTE format('DROP SEQUENCE IF EXISTS %s', _sequence);
+  END IF;
+
+  -- the date can be NULL so it cannot be part of a primary key, the ids stay unique with the date in a unique key
+  FOR _rec IN SELECT conname FROM pg_constraint WHERE conrelid = 'stats_pollstats_default'::regclass AND contype = 'p' LOOP
+    EXECUTE format('ALTER TABLE stats_pollstats_default DROP CONSTRAINT %I', _rec.conname);
+  END LOOP;
+
+  CREATE TABLE stats_pollstats (LIKE stats_pollstats_default) PARTITION BY RANGE (date);
+
+  CREATE SEQUENCE stats_pollstats_id_seq AS bigint OWNED BY stats_pollstats.id;
+  PERFORM setval('stats_pollstats_id_seq', _next_id, false);
+  ALTER TABLE stats_pollstats ALTER COLUMN id SET DEFAULT nextval('stats_pollstats_id_seq');
+
+  ALTER TABLE stats_pollstats ADD CONSTRAINT stats_pollstats_id_date_uniq UNIQUE (id, date);
+
+  -- the foreign keys and the indexes move to the partitioned table under their names, the ones of the default
+  -- partition are renamed and get attached to them instead of being built again
+  FOR _rec IN
+    SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+    WHERE conrelid = 'stats_pollstats_default'::regclass AND contype IN ('u', 'f')
+  LOOP
+    EXECUTE format(
+      'ALTER TABLE stats_pollstats_default RENAME CONSTRAINT %I TO %I', _rec.conname, left(_rec.conname, 55) || '_default'
+    );
+    EXECUTE format('ALTER TABLE stats_pollstats ADD CONSTRAINT %I %s', _rec.conname, _rec.definition);
+  END LOOP;
+
+  FOR _rec IN
+    SELECT c.relname, pg_get_indexdef(i.indexrelid) AS definition FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = 'stats_pollstats_default'::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE pg_constraint.conindid = i.indexrelid)
+  LOOP
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', _rec.relname, left(_rec.relname, 55) || '_default');
+    EXECUTE regexp_replace(
+      _rec.definition, '^CREATE (UNIQUE )?INDEX \\S+ ON \\S+', format('CREATE \\1INDEX %I ON stats_pollstats', _rec.relname)
+    );
+  END LOOP;
+
+  ALTER TABLE stats_pollstats ATTACH PARTITION stats_pollstats_default DEFAULT;
+END;
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0027_pollstats_location_ancestry"),
+    ]
+
+    operations = [migrations.RunSQL(PARTITION_POLL_STATS_SQL)]
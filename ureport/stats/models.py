@@ -3,8 +3,11 @@ import time
 from collections import defaultdict
 from datetime import timedelta
 
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.core.cache import cache
-from django.db import connection, models
+from django.db import connection, models, transaction
 from django.db.models import Count, ExpressionWrapper, F, IntegerField, JSONField, Q, Sum
 from django.db.models.functions import ExtractYear
 from django.utils import timezone, translation
@@ -26,13 +29,14 @@ class GenderSegment(models.Model):
 
 
 class AgeSegment(models.Model):
+    MIN_AGES = [0, 15, 20, 25, 31, 35]
+
     min_age = models.IntegerField(null=True)
     max_age = models.IntegerField(null=True)
 
     @classmethod
     def get_age_segment_min_age(cls, age):
-        min_ages = [0, 15, 20, 25, 31, 35]
-        return [elt for elt in min_ages if age >= elt][-1]
+        return [elt for elt in cls.MIN_AGES if age >= elt][-1]
 
 
 class SchemeSegment(models.Model):
@@ -80,12 +84,326 @@ class PollStats(models.Model):
 
     location = models.ForeignKey(Boundary, null=True, on_delete=models.SET_NULL)
 
+    # the ancestors of the location at each level, including itself, so location segments are equality filters
+    state = models.ForeignKey(Boundary, null=True, on_delete=models.SET_NULL, related_name="+")
+
+    district = models.ForeignKey(Boundary, null=True, on_delete=models.SET_NULL, related_name="+")
+
+    ward = models.ForeignKey(Boundary, null=True, on_delete=models.SET_NULL, related_name="+")
+
     date = models.DateTimeField(null=True)
 
     count = models.IntegerField(default=0, help_text=_("Number of items with this counter"))
 
     is_squashed = models.BooleanField(null=True, help_text=_("Whether this row was created by squashing"))
 
+    LAST_SQUASHED_ID_KEY = "poll-stats-last-squashed-id"
+
+    DEFAULT_PARTITION_TABLE = "stats_pollstats_default"
+
+    MONTH_PARTITION_TABLE = "stats_pollstats_y%04dm%02d"
+
+    PARTITION_MONTHS_AHEAD = 3
+
+    SQUASH_BATCH_SIZE = 100_000
+
+    SQUASH_KEY_COLUMNS = (
+        "org_id",
+        "question_id",
+        "flow_result_id",
+        "category_id",
+        "flow_result_category_id",
+        "age_segment_id",
+        "gender_segment_id",
+        "scheme_segment_id",
+        "location_id",
+        "state_id",
+        "district_id",
+        "ward_id",
+        "date",
+    )
+
+    LOCATION_LEVEL_FIELDS = {
+        Boundary.STATE_LEVEL: "state_id",
+        Boundary.DISTRICT_LEVEL: "district_id",
+        Boundary.WARD_LEVEL: "ward_id",
+    }
+
+    COPY_COLUMNS = (
+        "org_id",
+        "flow_result_id",
+        "flow_result_category_id",
+        "age_segment_id",
+        "gender_segment_id",
+        "scheme_segment_id",
+        "location_id",
+        "state_id",
+        "district_id",
+        "ward_id",
+        "date",
+        "count",
+    )
+
+    @classmethod
+    def insert_stats(cls, stats_kwargs):
+        """
+        Inserts new poll stats from the given fields dicts, with COPY FROM STDIN when the COPY bulk loader is enabled
+        """
+        from ureport.utils import copy_rows, use_copy_bulk_loader
+
+        stats_kwargs = cls.add_locations_ancestry(list(stats_kwargs))
+
+        if use_copy_bulk_loader():
+            rows = (tuple(kwargs.get(column) for column in cls.COPY_COLUMNS) for kwargs in stats_kwargs)
+            return copy_rows(cls._meta.db_table, cls.COPY_COLUMNS, rows)
+
+        return len(cls.objects.bulk_create([cls(**kwargs) for kwargs in stats_kwargs]))
+
+    @classmethod
+    def add_locations_ancestry(cls, stats_kwargs):
+        """
+        Sets the state, district and ward ids of the given poll stats fields dicts from the ancestors of their location
+        """
+        location_ids = {kwargs["location_id"] for kwargs in stats_kwargs if kwargs.get("location_id")}
+        if not location_ids:
+            return stats_kwargs
+
+        boundaries = Boundary.objects.filter(id__in=location_ids).values_list(
+            "id", "level", "parent_id", "parent__level", "parent__parent_id", "parent__parent__level"
+        )
+
+        ancestry_map = dict()
+        for location_id, level, parent_id, parent_level, grand_parent_id, grand_parent_level in boundaries:
+            ancestry = dict()
+            for boundary_id, boundary_level in (
+                (location_id, level),
+                (parent_id, parent_level),
+                (grand_parent_id, grand_parent_level),
+            ):
+                if boundary_id and boundary_level in cls.LOCATION_LEVEL_FIELDS:
+                    ancestry[cls.LOCATION_LEVEL_FIELDS[boundary_level]] = boundary_id
+            ancestry_map[location_id] = ancestry
+
+        for kwargs in stats_kwargs:
+            kwargs.update(ancestry_map.get(kwargs.get("location_id"), dict()))
+
+        return stats_kwargs
+
+    @classmethod
+    def get_boundaries_stats_filters(cls, org, osm_ids):
+        """
+        Returns the filters of the poll stats of each of the given boundaries and their descendants, an equality on
+        the ancestry column of their level when they have one
+        """
+        boundaries = Boundary.objects.filter(org=org, osm_id__in=list(osm_ids)).values_list("osm_id", "id", "level")
+
+        boundaries_filters = dict()
+        for osm_id, boundary_id, level in boundaries:
+            if level in cls.LOCATION_LEVEL_FIELDS:
+                boundaries_filters[osm_id] = {cls.LOCATION_LEVEL_FIELDS[level]: boundary_id}
+            else:
+                boundary_ids = list(
+                    Boundary.objects.filter(org=org)
+                    .filter(Q(osm_id=osm_id) | Q(parent__osm_id=osm_id) | Q(parent__parent__osm_id=osm_id))
+                    .values_list("pk", flat=True)
+                )
+                boundaries_filters[osm_id] = dict(location_id__in=boundary_ids)
+
+        return boundaries_filters
+
+    @classmethod
+    def use_batches_squash(cls):
+        return getattr(settings, "POLL_STATS_BATCHES_SQUASH", False)
+
+    @classmethod
+    def get_squash_filter(cls, column, values):
+        """
+        Returns the filter of the rows whose column is one of the given values, which may include None
+        """
+        not_null_values = [value for value in values if value is not None]
+
+        conditions = []
+        if not_null_values:
+            conditions.append('"%s" = ANY(%%(%s)s)' % (column, column))
+        if len(not_null_values) < len(values):
+            conditions.append('"%s" IS NULL' % column)
+        return "(%s)" % " OR ".join(conditions), not_null_values
+
+    @classmethod
+    def squash_batches(cls, batch_size=None):
+        """
+        Squashes the poll stats added since the last squash, keeping the id of the last squashed row as watermark like
+        ReportersCounter.squash_counts. For each batch of ids above the watermark, all the rows of the flow results and
+        dates found in the batch are merged per set of key columns in one transaction, with a DELETE of the sets having
+        more than one row feeding a GROUP BY INSERT of GREATEST(0, SUM(count)) like squash does.
+
+        Sets already down to one row are left as they are, so the rows squashed by the previous run only cost their
+        lookup. The watermark is the max id when the squash starts. Returns the counts of (rows in, rows out).
+        """
+        batch_size = batch_size or cls.SQUASH_BATCH_SIZE
+
+        r = get_redis_connection()
+        last_squashed_id = int(r.get(cls.LAST_SQUASHED_ID_KEY) or 0)
+
+        start = time.time()
+
+        max_id = cls.objects.aggregate(max_id=models.Max("id"))["max_id"] or 0
+        if max_id < last_squashed_id:
+            # the table was emptied since the last squash
+            last_squashed_id = 0
+
+        key_columns = ", ".join(['"%s"' % column for column in cls.SQUASH_KEY_COLUMNS])
+
+        # language=SQL
+        keys_sql = """
+        SELECT ARRAY_AGG(DISTINCT "flow_result_id"), ARRAY_AGG(DISTINCT "date") FROM stats_pollstats
+        WHERE "id" > %(min_id)s AND "id" <= %(max_id)s
+        """
+
+        rows_in, rows_out = 0, 0
+        while last_squashed_id < max_id:
+            batch_max_id = min(last_squashed_id + batch_size, max_id)
+
+            with connection.cursor() as cursor:
+                cursor.execute(keys_sql, dict(min_id=last_squashed_id, max_id=batch_max_id))
+                flow_result_ids, dates = cursor.fetchone()
+
+            # the batch rows may all have been squashed with the rows of a previous batch
+            if flow_result_ids:
+                flow_result_filter, flow_result_ids = cls.get_squash_filter("flow_result_id", flow_result_ids)
+                date_filter, dates = cls.get_squash_filter("date", dates)
+
+                # language=SQL
+                sql = """
+                WITH matched AS (
+                  SELECT "id", COUNT(*) OVER (PARTITION BY %(columns)s) AS "set_size" FROM stats_pollstats
+                  WHERE %(flow_result_filter)s AND %(date_filter)s
+                ), deleted AS (
+                  DELETE FROM stats_pollstats WHERE "id" IN (SELECT "id" FROM matched WHERE "set_size" > 1)
+                  RETURNING %(columns)s, "count"
+                ), inserted AS (
+                  INSERT INTO stats_pollstats(%(columns)s, "count", "is_squashed")
+                  SELECT %(columns)s, GREATEST(0, SUM("count")), TRUE FROM deleted
+                  GROUP BY %(columns)s
+                  RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM deleted), (SELECT COUNT(*) FROM inserted);
+                """ % dict(
+                    columns=key_columns, flow_result_filter=flow_result_filter, date_filter=date_filter
+                )
+
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, dict(flow_result_id=flow_result_ids, date=dates))
+                        batch_rows_in, batch_rows_out = cursor.fetchone()
+
+                rows_in += batch_rows_in
+                rows_out += batch_rows_out
+
+            last_squashed_id = batch_max_id
+            r.set(cls.LAST_SQUASHED_ID_KEY, last_squashed_id)
+
+            logger.info(
+                "Squashing poll stats progress... up to id %d, %d rows in, %d rows out in %0.3fs"
+                % (last_squashed_id, rows_in, rows_out, time.time() - start)
+            )
+
+        logger.info(
+            "Squashed %d rows of %s into %d rows in %0.3fs" % (rows_in, cls.__name__, rows_out, time.time() - start)
+        )
+        return rows_in, rows_out
+
+    @classmethod
+    def get_month_partition_bounds(cls, month):
+        start = month.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return start, end
+
+    @classmethod
+    def get_month_partition_table(cls, month):
+        start = cls.get_month_partition_bounds(month)[0]
+        return cls.MONTH_PARTITION_TABLE % (start.year, start.month)
+
+    @classmethod
+    def get_default_partition_months(cls):
+        """
+        Returns the months of the dated stats still in the default partition
+        """
+        # language=SQL
+        sql = """
+        SELECT DISTINCT date_trunc('month', "date" AT TIME ZONE 'UTC') AS "month" FROM %s
+        WHERE "date" IS NOT NULL ORDER BY "month"
+        """ % (
+            cls.DEFAULT_PARTITION_TABLE
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return [row[0].replace(tzinfo=timezone.utc) for row in cursor.fetchall()]
+
+    @classmethod
+    def create_month_partition(cls, month):
+        """
+        Creates the partition of the stats of the given month, moving them out of the default partition. Returns the
+        number of stats moved
+        """
+        from ureport.utils import attach_partition_from_default
+
+        start_time = time.time()
+
+        start, end = cls.get_month_partition_bounds(month)
+        table = cls.get_month_partition_table(month)
+        num_moved = attach_partition_from_default(
+            cls._meta.db_table,
+            table,
+            [field.column for field in cls._meta.concrete_fields],
+            "FOR VALUES FROM (%(start)s) TO (%(end)s)",
+            '"date" IS NOT NULL AND "date" >= %(start)s AND "date" < %(end)s',
+            dict(start=start.isoformat(), end=end.isoformat()),
+        )
+
+        logger.info("Moved %d poll stats to partition %s in %0.3fs" % (num_moved, table, time.time() - start_time))
+        return num_moved
+
+    @classmethod
+    def create_future_partitions(cls, months_ahead=None):
+        """
+        Creates the missing partitions of the current month and of the next months, so new stats never land in the
+        default partition. Returns the names of the partitions created
+        """
+        from ureport.utils import get_table_partitions
+
+        if months_ahead is None:
+            months_ahead = cls.PARTITION_MONTHS_AHEAD
+
+        partitions = set(get_table_partitions(cls._meta.db_table))
+
+        created = []
+        month, next_month = cls.get_month_partition_bounds(timezone.now())
+        for i in range(months_ahead + 1):
+            table = cls.get_month_partition_table(month)
+            if table not in partitions:
+                cls.create_month_partition(month)
+                created.append(table)
+
+            month, next_month = cls.get_month_partition_bounds(next_month)
+
+        return created
+
+    @classmethod
+    def detach_month_partition(cls, month):
+        """
+        Detaches the partition of the stats of the given month, keeping it as a table of its own to be archived.
+        Returns whether the month had a partition
+        """
+        from ureport.utils import detach_partition
+
+        table = cls.get_month_partition_table(month)
+        detached = detach_partition(cls._meta.db_table, table)
+        if detached:
+            logger.info("Detached poll stats partition %s" % table)
+        return detached
+
     @classmethod
     def squash(cls):
         start = time.time()
@@ -183,8 +501,8 @@ class PollStats(models.Model):
                       LIMIT 10000
                   ) RETURNING "count"
                 )
-                INSERT INTO stats_pollstats("org_id", "question_id", "flow_result_id", "category_id", "flow_result_category_id", "age_segment_id", "gender_segment_id", "scheme_segment_id", "location_id", "date", "count", "is_squashed")
-                VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, date_trunc('day', TIMESTAMP %%s)::TIMESTAMP, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
+                INSERT INTO stats_pollstats("org_id", "question_id", "flow_result_id", "category_id", "flow_result_category_id", "age_segment_id", "gender_segment_id", "scheme_segment_id", "location_id", "state_id", "district_id", "ward_id", "date", "count", "is_squashed")
+                VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, date_trunc('day', TIMESTAMP %%s)::TIMESTAMP, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
                 """ % {
                     "where_sql": where_sql
                 }
@@ -199,6 +517,9 @@ class PollStats(models.Model):
                     distinct_set.gender_segment_id,
                     distinct_set.scheme_segment_id,
                     distinct_set.location_id,
+                    distinct_set.state_id,
+                    distinct_set.district_id,
+                    distinct_set.ward_id,
                     str(distinct_set.date),
                 )
 
@@ -383,16 +704,13 @@ class PollStats(models.Model):
         )
 
         top_boundaries = Boundary.get_org_top_level_boundaries_name(org)
+        boundaries_filters = PollStats.get_boundaries_stats_filters(org, top_boundaries.keys())
         output_data = []
         for osm_id, name in top_boundaries.items():
-            boundary_ids = list(
-                Boundary.objects.filter(org=org)
-                .filter(Q(osm_id=osm_id) | Q(parent__osm_id=osm_id) | Q(parent__parent__osm_id=osm_id))
-                .values_list("pk", flat=True)
-            )
+            boundary_filter = boundaries_filters.get(osm_id, dict(location_id__in=[]))
             responses = (
                 PollStats.objects.filter(
-                    org=org, date__gte=start, location_id__in=boundary_ids, flow_result_id__in=flow_result_ids
+                    org=org, date__gte=start, flow_result_id__in=flow_result_ids, **boundary_filter
                 )
                 .exclude(flow_result_category=None)
                 .values("date")
@@ -497,23 +815,20 @@ class PollStats(models.Model):
         )
 
         top_boundaries = Boundary.get_org_top_level_boundaries_name(org)
+        boundaries_filters = PollStats.get_boundaries_stats_filters(org, top_boundaries.keys())
         output_data = []
         for osm_id, name in top_boundaries.items():
-            boundary_ids = list(
-                Boundary.objects.filter(org=org)
-                .filter(Q(osm_id=osm_id) | Q(parent__osm_id=osm_id) | Q(parent__parent__osm_id=osm_id))
-                .values_list("pk", flat=True)
-            )
+            boundary_filter = boundaries_filters.get(osm_id, dict(location_id__in=[]))
             polled_stats = (
                 PollStats.objects.filter(
-                    org=org, date__gte=start, location_id__in=boundary_ids, flow_result_id__in=flow_result_ids
+                    org=org, date__gte=start, flow_result_id__in=flow_result_ids, **boundary_filter
                 )
                 .values("date")
                 .annotate(Sum("count"))
             )
             responded_stats = (
                 PollStats.objects.filter(
-                    org=org, date__gte=start, location_id__in=boundary_ids, flow_result_id__in=flow_result_ids
+                    org=org, date__gte=start, flow_result_id__in=flow_result_ids, **boundary_filter
                 )
                 .exclude(flow_result_category=None)
                 .values("date")
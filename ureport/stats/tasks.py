@@ -5,6 +5,7 @@ from datetime import timedelta
 from django.utils import timezone
 
 from dash.orgs.tasks import org_task
+from ureport.celery import app
 from ureport.utils import chunk_list
 
 logger = logging.getLogger(__name__)
@@ -66,3 +67,15 @@ def update_used_contact_activities(org, since, until):
     logger.info(
         f"Task: Finished updating {org_count} old contact activities until {last_used_time} used field to False on org #{org.id} in {elapsed:.1f} seconds"
     )
+
+
+@app.task(name="stats.create_poll_stats_partitions")
+def create_poll_stats_partitions():
+    from .models import PollStats
+
+    start_time = time.time()
+    created = PollStats.create_future_partitions()
+
+    logger.info(
+        f"Task: create_poll_stats_partitions created {len(created)} partitions {created} in {time.time() - start_time:.1f} seconds"
+    )
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import io
 import json
 import uuid
 import zoneinfo
@@ -124,6 +125,10 @@ class MockResponse(object):
     def __init__(self, status_code, content=""):
         self.content = content
         self.status_code = status_code
+        self.raw = io.BytesIO(content.encode("utf-8") if isinstance(content, str) else content)
+
+    def close(self):
+        pass
 
     def raise_for_status(self):
         if self.status_code != 200:
@@ -3,6 +3,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import json
 import logging
+import queue
+import threading
 import time
 import zoneinfo
 from collections import defaultdict
@@ -15,6 +17,7 @@ from sentry_sdk import capture_exception
 
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection, transaction
 from django.db.models import Sum
 from django.utils import timezone, translation
 
@@ -123,6 +126,243 @@ def chunk_list(iterable, size):
             return
 
 
+def iterate_keyset(queryset, size=1000, ids_only=False, label=None):
+    """
+    Iterates over a queryset in batches of up to size rows, walking the primary keys with id > last_id ORDER BY id
+    LIMIT size, so the memory stays bounded by the batch size and no list of ids is ever built. Yields lists of
+    objects, or of primary keys with ids_only. When a label is given, the progress and throughput are logged after
+    each batch.
+    """
+    start = time.time()
+    num_processed = 0
+    last_id = None
+
+    if ids_only:
+        queryset = queryset.values_list("pk", flat=True)
+
+    queryset = queryset.order_by("pk")
+
+    while True:
+        batch_queryset = queryset if last_id is None else queryset.filter(pk__gt=last_id)
+        batch = list(batch_queryset[:size])
+        if not batch:
+            break
+
+        last_id = batch[-1] if ids_only else batch[-1].pk
+        yield batch
+
+        num_processed += len(batch)
+        if label:
+            elapsed = time.time() - start
+            logger.info(
+                "%s progress... processed %d up to id %d in %ds, %d/s"
+                % (label, num_processed, last_id, elapsed, num_processed / elapsed if elapsed else num_processed)
+            )
+
+        if len(batch) < size:
+            break
+
+
+def prefetch_iterator(iterable, size):
+    """
+    Iterates over an iterable from a background thread that keeps up to size items ahead of the consumer, so slow
+    producers like API pages overlap with the processing of the previous items. Exceptions raised by the iterable are
+    re-raised to the consumer in order, and the thread stops when the consumer stops iterating.
+    """
+    if size <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        error = None
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            error = e
+        finally:
+            # release the pages of generators stopped by the consumer before signaling the end
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+            put((done, error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            try:
+                item, error = items.get(timeout=0.1)
+            except queue.Empty:
+                if thread.is_alive():
+                    continue
+
+                # the thread may have put its last entry right before exiting
+                try:
+                    item, error = items.get_nowait()
+                except queue.Empty:
+                    raise RuntimeError("prefetch thread stopped without finishing the iterable")
+
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class CopyRowsFile(object):
+    """
+    Read-only file object streaming an iterable of tuples in the COPY text format, so rows are encoded as they are
+    read by the database driver instead of all at once
+    """
+
+    def __init__(self, rows):
+        self.lines = ("\t".join(_copy_value(value) for value in row) + "\n" for row in rows)
+        self.buffer = ""
+        self.num_rows = 0
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        buffered = len(self.buffer)
+        while size < 0 or buffered < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            buffered += len(line)
+            self.num_rows += 1
+
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(table, columns, rows):
+    """
+    Loads rows into a table with COPY FROM STDIN, streaming them from an iterable of tuples ordered as the columns.
+    Returns the number of rows loaded
+    """
+    rows_file = CopyRowsFile(rows)
+    sql = "COPY %s (%s) FROM STDIN" % (table, ", ".join(['"%s"' % column for column in columns]))
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, rows_file)
+
+    return rows_file.num_rows
+
+
+def use_copy_bulk_loader():
+    return getattr(settings, "USE_COPY_BULK_LOADER", False)
+
+
+def is_partitioned_table(table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [table])
+        return cursor.fetchone() is not None
+
+
+def get_table_partitions(table):
+    """
+    Returns the names of the partitions of a partitioned table
+    """
+    # language=SQL
+    sql = """
+    SELECT c."relname" FROM pg_inherits i JOIN pg_class c ON c."oid" = i."inhrelid"
+    WHERE i."inhparent" = %s::regclass ORDER BY c."relname"
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def attach_partition_from_default(table, partition, columns, bound_sql, check_sql, params=None):
+    """
+    Creates a partition of a partitioned table whose default partition is named <table>_default, moving the rows
+    matching the CHECK of the partition out of the default partition, and attaches it with the given FOR VALUES bound,
+    all in one transaction. The params of the CHECK and of the bound are named, as they are shared by both.
+
+    The CHECK spares attaching the partition from scanning it again, but the default partition is still scanned to
+    verify it has no rows of the partition left. Returns the number of rows moved.
+    """
+    default_table = "%s_default" % table
+    columns_sql = ", ".join(['"%s"' % column for column in columns])
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # tables with deferred constraint checks still pending cannot be altered
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)" % (partition, table))
+            cursor.execute(
+                "ALTER TABLE %s ADD CONSTRAINT %s_check CHECK (%s)" % (partition, partition, check_sql), params
+            )
+
+            # the named params of the CHECK are left for the cursor, values substituted by % are not parsed again
+            # language=SQL
+            sql = """
+            WITH moved AS (
+              DELETE FROM %(default_table)s WHERE %(check_sql)s RETURNING %(columns)s
+            )
+            INSERT INTO %(partition)s (%(columns)s) SELECT %(columns)s FROM moved
+            """ % dict(
+                default_table=default_table,
+                check_sql=check_sql,
+                partition=partition,
+                columns=columns_sql,
+            )
+            cursor.execute(sql, params)
+            num_moved = cursor.rowcount
+
+            cursor.execute("ALTER TABLE %s ATTACH PARTITION %s %s" % (table, partition, bound_sql), params)
+
+    return num_moved
+
+
+def detach_partition(table, partition):
+    """
+    Detaches a partition from its partitioned table, keeping it as a table of its own. Returns whether it was attached
+    """
+    if partition not in get_table_partitions(table):
+        return False
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("ALTER TABLE %s DETACH PARTITION %s" % (table, partition))
+
+    return True
+
+
 def get_logo(org):
     if hasattr(org, "_logo_field"):
         return org._logo_field
@@ -993,6 +1233,24 @@ def get_segment_org_boundaries(org, segment):
     return location_boundaries
 
 
+# language=SQL
+POLL_RESULTS_AGE_AND_GENDER_SQL = """
+UPDATE polls_pollresult r
+SET "born" = CASE WHEN c."born" > 0 THEN c."born" ELSE r."born" END,
+    "gender" = CASE WHEN c."gender" <> '' THEN c."gender" ELSE r."gender" END,
+    "gender_segment_id" = CASE
+      WHEN c."gender" <> ''
+        THEN (SELECT g."id" FROM stats_gendersegment g WHERE LOWER(g."gender") = LOWER(c."gender") LIMIT 1)
+      ELSE r."gender_segment_id"
+    END
+FROM contacts_contact c
+WHERE c."id" >= %%(min_id)s AND c."id" <= %%(max_id)s AND (c."born" > 0 OR c."gender" <> '') %s
+  AND r."org_id" = c."org_id" AND r."contact" = c."uuid"
+  AND (r."born" IS DISTINCT FROM CASE WHEN c."born" > 0 THEN c."born" ELSE r."born" END
+    OR r."gender" IS DISTINCT FROM CASE WHEN c."gender" <> '' THEN c."gender" ELSE r."gender" END)
+"""
+
+
 def populate_age_and_gender_poll_results(org=None):
     from ureport.contacts.models import Contact
 
@@ -1000,39 +1258,25 @@ def populate_age_and_gender_poll_results(org=None):
 
     last_contact_id_populated = cache.get(LAST_POPULATED_CONTACT, 0)
 
-    all_contacts = Contact.objects.filter(id__gt=last_contact_id_populated).values_list("id", flat=True).order_by("id")
+    all_contacts = Contact.objects.filter(id__gt=last_contact_id_populated)
+    sql = POLL_RESULTS_AGE_AND_GENDER_SQL % ""
 
     if org is not None:
-        all_contacts = Contact.objects.filter(org=org).values_list("id", flat=True).order_by("id")
+        all_contacts = Contact.objects.filter(org=org)
+        sql = POLL_RESULTS_AGE_AND_GENDER_SQL % 'AND c."org_id" = %(org_id)s'
 
     start = time.time()
-    i = 0
+    rows_count = 0
 
-    all_contacts = list(all_contacts)
-
-    for contact_id_batch in chunk_list(all_contacts, 1000):
-        contact_batch = list(contact_id_batch)
-        contacts = Contact.objects.filter(id__in=contact_batch)
-        for contact in contacts:
-            i += 1
+    for batch_ids in iterate_keyset(all_contacts, 1000, ids_only=True, label="Poll results age and gender update"):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, dict(org_id=org.id if org else None, min_id=batch_ids[0], max_id=batch_ids[-1]))
+            rows_count += cursor.rowcount
 
-            update_fields = dict()
-            if contact.born > 0:
-                update_fields["born"] = contact.born
+        if org is None:
+            cache.set(LAST_POPULATED_CONTACT, batch_ids[-1], None)
 
-            if contact.gender != "":
-                update_fields["gender"] = contact.gender
-
-            if update_fields:
-                results_ids = list(PollResult.objects.filter(contact=contact.uuid).values_list("id", flat=True))
-                PollResult.objects.filter(id__in=results_ids).update(**update_fields)
-
-            if org is None:
-                cache.set(LAST_POPULATED_CONTACT, contact.pk, None)
-
-        logger.info(
-            "Processed poll results update %d / %d contacts in %ds" % (i, len(all_contacts), time.time() - start)
-        )
+    logger.info("Updated age and gender of %d poll results in %.1fs" % (rows_count, time.time() - start))
 
 
 def populate_contact_activity(org):
@@ -1048,18 +1292,10 @@ def populate_contact_activity(org):
         .values_list("flow_uuid", flat=True)
     )
 
-    all_contacts = Contact.objects.filter(org=org).values_list("id", flat=True).order_by("id")
+    all_contacts = Contact.objects.filter(org=org)
 
-    start = time.time()
-    i = 0
-
-    all_contacts = list(all_contacts)
-
-    for contact_id_batch in chunk_list(all_contacts, 1000):
-        contact_batch = list(contact_id_batch)
-        contacts = Contact.objects.filter(id__in=contact_batch)
+    for contacts in iterate_keyset(all_contacts, 1000, label="Contact activity poll results update"):
         for contact in contacts:
-            i += 1
             results = PollResult.objects.filter(contact=contact.uuid, org_id=org.id, flow__in=flows).exclude(date=None)
 
             oldest_id = None
@@ -1085,10 +1321,6 @@ def populate_contact_activity(org):
 
             PollResult.objects.filter(id__in=ids_to_update).update(contact=contact.uuid)
 
-        logger.info(
-            "Processed poll results update %d / %d contacts in %ds" % (i, len(all_contacts), time.time() - start)
-        )
-
 
 Org.get_gender_labels = get_gender_labels
 Org.get_org_contacts_counts = get_org_contacts_counts
@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import json
+import threading
 import zoneinfo
 from datetime import datetime
 
@@ -17,11 +18,13 @@ from dash.categories.models import Category
 from dash.test import MockClientQuery, MockResponse
 from ureport.contacts.models import ReportersCounter
 from ureport.locations.models import Boundary
-from ureport.polls.models import CACHE_ORG_FLOWS_KEY, UREPORT_ASYNC_FETCHED_DATA_CACHE_TIME, Poll
+from ureport.polls.models import CACHE_ORG_FLOWS_KEY, UREPORT_ASYNC_FETCHED_DATA_CACHE_TIME, Poll, PollResult
 from ureport.tests import UreportTest
 from ureport.utils import (
     GLOBAL_COUNT_CACHE_KEY,
     ORG_CONTACT_COUNT_KEY,
+    CopyRowsFile,
+    copy_rows,
     datetime_to_json_date,
     fetch_flows,
     fetch_old_sites_count,
@@ -36,7 +39,9 @@ from ureport.utils import (
     get_registration_stats,
     get_reporters_count,
     get_ureporters_locations_stats,
+    iterate_keyset,
     json_date_to_datetime,
+    prefetch_iterator,
     update_poll_flow_data,
 )
 
@@ -71,6 +76,108 @@ class UtilsTest(UreportTest):
         self.assertEqual(json_date_to_datetime("2014-01-02T01:04:05.000Z"), d2)
         self.assertEqual(json_date_to_datetime("2014-01-02T01:04:05.000"), d2)
 
+    def test_copy_rows(self):
+        d1 = datetime(2014, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+        rows_file = CopyRowsFile([(1, "a\tb", None, True, d1), (2, "c\\d\ne", "", False, None)])
+        self.assertEqual(rows_file.read(5), "1\ta\\t")
+        self.assertEqual(rows_file.read(), "b\t\\N\tt\t2014-01-02T03:04:05+00:00\n2\tc\\\\d\\ne\t\tf\t\\N\n")
+        self.assertEqual(rows_file.read(), "")
+        self.assertEqual(rows_file.num_rows, 2)
+
+        rows = [
+            (self.org.id, "flow-uuid", "ruleset-uuid", "contact-uuid", d1, False, "Yes", "Yeah\tright", None),
+            (self.org.id, "flow-uuid", "ruleset-uuid", "contact-uuid-2", None, True, None, "", "R-LAGOS"),
+        ]
+        columns = ("org_id", "flow", "ruleset", "contact", "date", "completed", "category", "text", "state")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(copy_rows(PollResult._meta.db_table, columns, iter(rows)), 2)
+
+        result1 = PollResult.objects.get(contact="contact-uuid")
+        self.assertEqual(result1.date, d1)
+        self.assertFalse(result1.completed)
+        self.assertEqual(result1.text, "Yeah\tright")
+        self.assertIsNone(result1.state)
+
+        result2 = PollResult.objects.get(contact="contact-uuid-2")
+        self.assertIsNone(result2.date)
+        self.assertIsNone(result2.category)
+        self.assertEqual(result2.text, "")
+        self.assertEqual(result2.state, "R-LAGOS")
+
+    def test_iterate_keyset(self):
+        results = [
+            PollResult.objects.create(
+                org=self.org, flow=self.poll.flow_uuid, ruleset="ruleset-uuid", contact="c-%d" % i, completed=False
+            )
+            for i in range(5)
+        ]
+        results_ids = [elt.pk for elt in results]
+        poll_results = PollResult.objects.filter(org=self.org)
+
+        self.assertEqual(list(iterate_keyset(PollResult.objects.none(), 2)), [])
+
+        # each batch is a single query starting after the last id of the previous batch
+        with self.assertNumQueries(3):
+            batches = list(iterate_keyset(poll_results, 2, ids_only=True, label="Test"))
+        self.assertEqual(batches, [results_ids[:2], results_ids[2:4], results_ids[4:]])
+
+        # a full last batch needs one more query to find there is nothing left
+        with self.assertNumQueries(3):
+            batches = list(iterate_keyset(poll_results.exclude(contact="c-0"), 2))
+        self.assertEqual([[elt.pk for elt in batch] for batch in batches], [results_ids[1:3], results_ids[3:]])
+
+        # deleting the rows of each batch does not skip any row
+        for batch in iterate_keyset(poll_results, 2, ids_only=True):
+            poll_results.filter(pk__gte=batch[0], pk__lte=batch[-1]).delete()
+        self.assertFalse(PollResult.objects.filter(org=self.org).exists())
+
+    def test_prefetch_iterator(self):
+        self.assertEqual(list(prefetch_iterator(iter(range(10)), 2)), list(range(10)))
+        self.assertEqual(list(prefetch_iterator(iter(range(10)), 0)), list(range(10)))
+        self.assertEqual(list(prefetch_iterator(iter([]), 2)), [])
+
+        def failing_pages():
+            yield 1
+            yield 2
+            raise ValueError("rate exceeded")
+
+        consumed = []
+        with self.assertRaises(ValueError):
+            for page in prefetch_iterator(failing_pages(), 2):
+                consumed.append(page)
+
+        # items before the error are all consumed in order
+        self.assertEqual(consumed, [1, 2])
+
+        produced = []
+        pages_closed = threading.Event()
+
+        def pages():
+            try:
+                for page in range(100):
+                    produced.append(page)
+                    yield page
+            finally:
+                pages_closed.set()
+
+        iterator = prefetch_iterator(pages(), 1)
+        self.assertEqual(next(iterator), 0)
+        iterator.close()
+
+        # producer stops and closes the pages soon after the consumer, never reading all of them
+        self.assertTrue(pages_closed.wait(5))
+        self.assertLess(len(produced), 100)
+
+        def interrupted_pages():
+            yield 1
+            raise KeyboardInterrupt()
+
+        # errors that are not exceptions still end the iteration instead of blocking the consumer
+        with self.assertRaises(KeyboardInterrupt):
+            list(prefetch_iterator(interrupted_pages(), 2))
+
     @mock.patch("ureport.utils.get_shared_sites_count")
     def test_get_linked_orgs(self, mock_get_shared_sites_count):
         settings_sites = list(getattr(settings, "COUNTRY_FLAGS_SITES", []))